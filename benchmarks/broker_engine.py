@@ -0,0 +1,102 @@
+"""Measure the broker engine in isolation: idle CPU, event throughput and latency.
+
+Raw DEALER sockets stand in for clients so that only the broker threads
+are measured.
+
+    python benchmarks/broker_engine.py --messages 5000 --samples 1000
+    python benchmarks/broker_engine.py --subscribers 50 --envelope
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from zmq import DEALER, ROUTER, Context
+
+from pyaduct import Broker, Event, Register, Subscribe
+from pyaduct.codec import JSON_CODEC
+from pyaduct.wire import Header
+
+
+def _frames(message, envelope: bool) -> list[bytes]:
+    body = JSON_CODEC.encode(message)
+    if envelope:
+        return [Header.from_message(message).encode(), body]
+    return [body]
+
+
+def _recv(socket) -> list[bytes]:
+    return [frame for frame in socket.recv_multipart() if frame]
+
+
+def _connect(ctx: Context, address: str, name: str, envelope: bool):
+    socket = ctx.socket(DEALER)
+    socket.connect(address)
+    socket.send_multipart(_frames(Register(source=name, envelope=envelope), False))
+    _recv(socket)
+    return socket
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--idle", type=float, default=2.0, help="Idle measurement window (s)")
+    parser.add_argument("--messages", type=int, default=5000, help="Events for throughput")
+    parser.add_argument("--samples", type=int, default=1000, help="Round trips for latency")
+    parser.add_argument("--subscribers", type=int, default=1, help="Fan-out per event")
+    parser.add_argument("--envelope", action="store_true", help="Use header + body framing")
+    args = parser.parse_args()
+
+    address = f"ipc:///tmp/pyaduct-bench-{os.getpid()}"
+    ctx = Context()
+    router = ctx.socket(ROUTER)
+    router.bind(address)
+    broker = Broker(router)
+    broker.start()
+    time.sleep(0.2)
+
+    cpu, wall = time.process_time(), time.perf_counter()
+    time.sleep(args.idle)
+    idle = (time.process_time() - cpu) / (time.perf_counter() - wall) * 100
+
+    sender = _connect(ctx, address, "bench_sender", args.envelope)
+    receivers = []
+    for i in range(args.subscribers):
+        name = f"bench_receiver_{i}"
+        receiver = _connect(ctx, address, name, args.envelope)
+        receiver.send_multipart(_frames(Subscribe(source=name, topic="bench"), args.envelope))
+        _recv(receiver)
+        receivers.append(receiver)
+    frames = _frames(Event(source="bench_sender", topic="bench", body="x" * 64), args.envelope)
+
+    start = time.perf_counter()
+    for _ in range(args.messages):
+        sender.send_multipart(frames)
+    for receiver in receivers:
+        for _ in range(args.messages):
+            _recv(receiver)
+    throughput = args.messages * len(receivers) / (time.perf_counter() - start)
+
+    latencies = []
+    for _ in range(args.samples):
+        start = time.perf_counter()
+        sender.send_multipart(frames)
+        for receiver in receivers:
+            _recv(receiver)
+        latencies.append((time.perf_counter() - start) * 1e6)
+    quantiles = statistics.quantiles(latencies, n=100)
+
+    print(f"idle cpu:   {idle:6.1f} %")
+    print(f"throughput: {throughput:8.0f} deliveries/s")
+    print(f"p50:        {quantiles[49]:8.0f} us")
+    print(f"p99:        {quantiles[98]:8.0f} us")
+
+    sender.close()
+    for receiver in receivers:
+        receiver.close()
+    broker.stop()
+    ctx.destroy()
+
+
+if __name__ == "__main__":
+    main()
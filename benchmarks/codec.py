@@ -0,0 +1,52 @@
+"""Compare wire codecs: encode/decode cost and bytes on the wire per message type.
+
+python benchmarks/codec.py --iterations 20000
+"""
+
+import argparse
+import time
+
+from pyaduct import Command, Event, Ping, Pong, Register, Request, Response, Subscribe
+from pyaduct.codec import CODECS
+from pyaduct.models import ACK
+
+
+def samples():
+    request = Request(source="client_1", target="client_2", body="x" * 64)
+    return [
+        Register(source="client_1", codecs=["binary", "json"]),
+        request,
+        Command(source="client_1", target="broker", body="GET_CLIENTS"),
+        Response(source="client_2", requestor="client_1", request_id=request.id, body="x" * 64),
+        Event(source="client_2", topic="metrics.host_1.cpu", body="x" * 64),
+        Subscribe(source="client_1", topic="metrics.host_1.cpu"),
+        Ping(source="client_1", target="client_2"),
+        Pong(source="client_2", requestor="client_1", request_id=request.id),
+        ACK(source="broker", requestor="client_1", request_id=request.id),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+    n = args.iterations
+
+    print(f"{'type':<10} {'codec':<7} {'bytes':>6} {'encode us':>10} {'decode us':>10}")
+    for message in samples():
+        for codec in CODECS.values():
+            frame = codec.encode(message)
+            start = time.perf_counter()
+            for _ in range(n):
+                codec.encode(message)
+            encode = (time.perf_counter() - start) / n * 1e6
+            start = time.perf_counter()
+            for _ in range(n):
+                codec.decode(frame)
+            decode = (time.perf_counter() - start) / n * 1e6
+            row = f"{message.type.value:<10} {codec.name:<7} {len(frame):>6} "
+            print(row + f"{encode:>10.2f} {decode:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
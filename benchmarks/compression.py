@@ -0,0 +1,69 @@
+"""Compare body compression on telemetry events: bytes on the wire and CPU per event.
+
+Dictionaries are trained on earlier events of the same stream.
+
+python benchmarks/compression.py --events 2000
+"""
+
+import argparse
+import json
+import random
+import time
+
+from pyaduct import Event
+from pyaduct.codec import CODECS, decode
+from pyaduct.compression import Compression, train
+
+
+def telemetry(count: int, readings: int) -> list[Event]:
+    rng = random.Random(0)
+    events = []
+    for i in range(count):
+        body = {
+            "host": f"host-{i % 16:02d}",
+            "region": "eu-west-1",
+            "readings": [
+                {"metric": f"cpu.core{core}.usage", "value": round(rng.uniform(0, 100), 2)}
+                for core in range(readings)
+            ],
+        }
+        events.append(Event(source="collector", topic="telemetry.hosts", body=json.dumps(body)))
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'readings':>8} {'codec':<7} {'compression':<12} {'bytes':>7} {'ratio':>6} {'us':>7}")
+    for readings in (1, 8, 64):
+        events = telemetry(args.events * 2, readings)
+        training, measured = events[: args.events], events[args.events :]
+        for codec in CODECS.values():
+            dictionary = train(codec.encode(event) for event in training[-200:])
+            schemes = {
+                "none": None,
+                "zlib": Compression("zlib", threshold=0),
+                "zlib+dict": Compression(
+                    "zlib", threshold=0, dictionaries={"telemetry.#": dictionary}
+                ),
+                "lzma": Compression("lzma", threshold=0),
+            }
+            plain = sum(len(codec.encode(event)) for event in measured)
+            for name, compression in schemes.items():
+                start = time.perf_counter()
+                size = 0
+                for event in measured:
+                    body = codec.encode(event)
+                    if compression is not None:
+                        body = compression.compress(body, event.topic)
+                    size += len(body)
+                    decode(body)
+                elapsed = (time.perf_counter() - start) / len(measured) * 1e6
+                row = f"{readings:>8} {codec.name:<7} {name:<12} {size / len(measured):>7.0f} "
+                print(row + f"{plain / size:>6.2f} {elapsed:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
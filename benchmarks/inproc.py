@@ -0,0 +1,92 @@
+"""Compare Clients talking to a Broker in the same process over ipc and inproc.
+
+Both runs use the same Client API; only what the clients are constructed
+with differs: a DEALER socket, or the Broker itself.
+
+    python benchmarks/inproc.py --messages 20000 --samples 2000
+"""
+
+import argparse
+import os
+import statistics
+import threading
+import time
+
+from zmq import DEALER, ROUTER, Context
+
+from pyaduct import Broker, Client
+
+
+def _clients(ctx: Context, broker: Broker, address: str, inproc: bool) -> list[Client]:
+    clients = []
+    for name in ("bench_sender", "bench_receiver"):
+        if inproc:
+            client = Client(broker, name=name)
+        else:
+            socket = ctx.socket(DEALER)
+            socket.connect(address)
+            client = Client(socket, name=name, codecs=["binary", "json"])
+        client.start()
+        clients.append(client)
+    return clients
+
+
+def run(inproc: bool, messages: int, samples: int) -> tuple[float, list[float]]:
+    address = f"ipc:///tmp/pyaduct-inproc-bench-{os.getpid()}"
+    ctx = Context()
+    router = ctx.socket(ROUTER)
+    router.bind(address)
+    broker = Broker(router)
+    broker.start()
+    sender, receiver = _clients(ctx, broker, address, inproc)
+    events = receiver.subscribe("bench")
+
+    start = time.perf_counter()
+    for _ in range(messages):
+        sender.publish(sender.generate_event("bench", "x" * 64))
+    for _ in range(messages):
+        events.get(timeout=10)
+    throughput = messages / (time.perf_counter() - start)
+
+    stop = threading.Event()
+
+    def serve():
+        while not stop.is_set():
+            try:
+                request = receiver.requests.get(timeout=0.1)
+            except Exception:
+                continue
+            receiver.respond(request, request.body)
+
+    server = threading.Thread(target=serve)
+    server.start()
+    latencies = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        sender.request(sender.generate_request("bench_receiver", "x" * 64))
+        latencies.append((time.perf_counter() - start) * 1e6)
+    stop.set()
+    server.join()
+
+    sender.stop()
+    receiver.stop()
+    broker.stop()
+    ctx.destroy(linger=0)
+    return throughput, statistics.quantiles(latencies, n=100)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=20000, help="Events for throughput")
+    parser.add_argument("--samples", type=int, default=2000, help="Request round trips")
+    args = parser.parse_args()
+    for label, inproc in (("ipc", False), ("inproc", True)):
+        throughput, quantiles = run(inproc, args.messages, args.samples)
+        print(
+            f"{label:>6}: {throughput:8.0f} events/s, "
+            f"request p50 {quantiles[49]:6.0f} us, p99 {quantiles[98]:6.0f} us"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Measure binary payloads from one Client to others through the Broker.
+
+Payloads go as their own frame, which pyzmq and the broker pass along
+without copying, or as a handle to shared memory that local receivers
+map. For comparison the same bytes are sent base64 encoded in the body,
+and over raw PAIR sockets, which is the floor for a single receiver.
+
+    python benchmarks/payload.py --sizes 1024 65536 1048576 67108864
+    python benchmarks/payload.py --sizes 268435456 --subscribers 4 --samples 5
+"""
+
+import argparse
+import base64
+import os
+import statistics
+import time
+
+from zmq import DEALER, PAIR, ROUTER, Context
+
+from pyaduct import Broker, Client
+
+
+def raw(ctx: Context, payload: bytes, samples: int) -> list[float]:
+    address = f"ipc:///tmp/pyaduct-payload-raw-{os.getpid()}"
+    tx, rx = ctx.socket(PAIR), ctx.socket(PAIR)
+    rx.bind(address)
+    tx.connect(address)
+    latencies = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        tx.send(payload, copy=False)
+        rx.recv(copy=False)
+        latencies.append(time.perf_counter() - start)
+    tx.close(linger=0)
+    rx.close(linger=0)
+    return latencies
+
+
+def bus(ctx: Context, payload: bytes, samples: int, mode: str, subscribers: int) -> list[float]:
+    address = f"ipc:///tmp/pyaduct-payload-{os.getpid()}"
+    router = ctx.socket(ROUTER)
+    router.bind(address)
+    broker = Broker(router)
+    broker._latency = None
+    broker.start()
+    shared_memory = 0 if mode == "shm" else None
+    clients = []
+    for i in range(subscribers + 1):
+        socket = ctx.socket(DEALER)
+        socket.connect(address)
+        client = Client(socket, name=f"payload_{i}", codecs=["binary"], shared_memory=shared_memory)
+        client.start()
+        clients.append(client)
+    sender, receivers = clients[0], clients[1:]
+    queues = [receiver.subscribe("payload") for receiver in receivers]
+    encoded = base64.b64encode(payload).decode("ascii") if mode == "base64" else ""
+    latencies = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        if mode == "base64":
+            sender.publish(sender.generate_event("payload", encoded))
+            for events in queues:
+                base64.b64decode(events.get(timeout=60).body)
+        else:
+            sender.publish(sender.generate_event("payload", "", payload=payload))
+            for events in queues:
+                assert len(events.get(timeout=60).payload) == len(payload)
+        latencies.append(time.perf_counter() - start)
+    for client in clients:
+        client.stop()
+    broker.stop()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1024, 65536, 1048576, 16777216, 67108864]
+    )
+    parser.add_argument("--samples", type=int, default=20, help="Messages per size and mode")
+    parser.add_argument("--subscribers", type=int, default=1, help="Receivers of each payload")
+    args = parser.parse_args()
+    ctx = Context()
+    for size in args.sizes:
+        payload = os.urandom(size)
+        runs = {}
+        if args.subscribers == 1:
+            runs["raw zmq"] = raw(ctx, payload, args.samples)
+        for mode, label in (("frame", "payload frame"), ("shm", "shared memory")):
+            runs[label] = bus(ctx, payload, args.samples, mode, args.subscribers)
+        if size <= 2**26:
+            runs["base64 body"] = bus(ctx, payload, args.samples, "base64", args.subscribers)
+        for label, latencies in runs.items():
+            median = statistics.median(latencies)
+            print(
+                f"{size:>10} B {label:>14}: {median * 1e3:9.2f} ms, "
+                f"{size / median / 2**20:9.1f} MiB/s"
+            )
+    ctx.destroy(linger=0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Compare event throughput of a single Broker with a ShardedBroker.
+
+Producers and consumers are separate processes using raw DEALER sockets,
+so only the broker side is measured. Every consumer subscribes to all
+topics, so each event is delivered once per consumer.
+
+    python benchmarks/sharded_broker.py --workers 0 1 2 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+
+from zmq import DEALER, ROUTER, Context
+
+from pyaduct import Broker, Event, Register, Subscribe
+from pyaduct.codec import JSON_CODEC
+from pyaduct.sharding import ShardedBroker
+from pyaduct.wire import Header
+
+TOPICS = 64
+
+
+def _frames(message) -> list[bytes]:
+    return [Header.from_message(message).encode(), JSON_CODEC.encode(message)]
+
+
+def _connect(ctx: Context, address: str, name: str):
+    socket = ctx.socket(DEALER)
+    socket.sndhwm = socket.rcvhwm = 0
+    socket.connect(address)
+    socket.send_multipart(_frames(Register(source=name, envelope=True)))
+    socket.recv_multipart()
+    return socket
+
+
+def _consume(address: str, name: str, expected: int, ready, done):
+    ctx = Context()
+    socket = _connect(ctx, address, name)
+    socket.send_multipart(_frames(Subscribe(source=name, topic="bench.#")))
+    socket.recv_multipart()
+    ready.release()
+    for _ in range(expected):
+        socket.recv_multipart()
+    done.put(time.perf_counter())
+    ctx.destroy(linger=0)
+
+
+def _produce(address: str, name: str, messages: int, go):
+    ctx = Context()
+    socket = _connect(ctx, address, name)
+    frames = [_frames(Event(source=name, topic=f"bench.{i}", body="x" * 64)) for i in range(TOPICS)]
+    go.wait()
+    for i in range(messages):
+        socket.send_multipart(frames[i % TOPICS])
+    time.sleep(1)
+    ctx.destroy(linger=0)
+
+
+def run(workers: int, producers: int, consumers: int, messages: int) -> float:
+    mp = multiprocessing.get_context("spawn")
+    address = f"ipc:///tmp/pyaduct-sharded-bench-{os.getpid()}"
+    ctx = Context()
+    router = ctx.socket(ROUTER)
+    router.sndhwm = router.rcvhwm = 0
+    router.bind(address)
+    broker = ShardedBroker(router, workers=workers) if workers else Broker(router)
+    broker.start()
+    ready, go, done = mp.Semaphore(0), mp.Event(), mp.Queue()
+    expected = producers * messages
+    processes = [
+        mp.Process(target=_consume, args=(address, f"consumer_{i}", expected, ready, done))
+        for i in range(consumers)
+    ]
+    processes += [
+        mp.Process(target=_produce, args=(address, f"producer_{i}", messages, go))
+        for i in range(producers)
+    ]
+    for process in processes:
+        process.start()
+    for _ in range(consumers):
+        ready.acquire()
+    time.sleep(1)
+    start = time.perf_counter()
+    go.set()
+    end = max(done.get() for _ in range(consumers))
+    for process in processes:
+        process.join()
+    broker.stop()
+    ctx.destroy(linger=0)
+    return expected * consumers / (end - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4])
+    parser.add_argument("--producers", type=int, default=4)
+    parser.add_argument("--consumers", type=int, default=2)
+    parser.add_argument("--messages", type=int, default=5000, help="Events per producer")
+    args = parser.parse_args()
+    print(f"cpus: {os.cpu_count()}")
+    for workers in args.workers:
+        rate = run(workers, args.producers, args.consumers, args.messages)
+        label = f"{workers} workers" if workers else "single Broker"
+        print(f"{label:>14}: {rate:8.0f} deliveries/s")
+
+
+if __name__ == "__main__":
+    main()
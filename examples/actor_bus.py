@@ -80,24 +80,29 @@ if __name__ == "__main__":
     broker = BrokerFactory.generate_ipc_broker()
     broker.start()
     time.sleep(0.1)
+    # All actors share one socket and one set of I/O threads.
+    session = ClientFactory.generate_ipc_session()
+    session.start()
     # Server
-    server_client = ClientFactory.generate_ipc_client("server")
+    server_client = session.client("server")
     server = Server(server_client)
     server.start()
     time.sleep(0.1)
     # Reporter
-    reporter_client = ClientFactory.generate_ipc_client("reporter")
+    reporter_client = session.client("reporter")
     reporter = Reporter(reporter_client)
     reporter.start()
     time.sleep(0.1)
     # Worker
-    worker_client = ClientFactory.generate_ipc_client("worker")
+    worker_client = session.client("worker")
     worker = Worker(worker_client)
     worker.start()
     time.sleep(0.1)
     input("Press Enter to stop the actors...")
     reporter.stop()
     server.stop()
+    worker.stop()
+    session.stop()
     broker.stop()
     print("All actors have stopped.")
     for thread in [reporter.thread, server.thread, worker.thread]:
@@ -1,18 +1,30 @@
 from .broker import Broker  # noqa F401
+from .sharding import ShardedBroker  # noqa F401
+from .federation import FederatedBroker  # noqa F401
 from .client import Client  # noqa F401
+from .async_client import AsyncClient  # noqa F401
+from .session import Session, SessionClient  # noqa F401
 from .models import (
     Command,  # noqa: F401
     Event,  # noqa: F401
+    EventAck,  # noqa: F401
     Message,  # noqa: F401
     Register,  # noqa: F401
+    Release,  # noqa: F401
     Request,  # noqa: F401
     Response,  # noqa: F401
     Subscribe,  # noqa: F401
+    Timeout,  # noqa: F401
+    Unsubscribe,  # noqa: F401
     Ping,  # noqa: F401
     Pong,  # noqa: F401
 )
 from .factory import ClientFactory, BrokerFactory  # noqa F401
-from .store import IMessageStore, InmemMessageStore  # noqa F401
+from .codec import ICodec, JsonCodec, BinaryCodec  # noqa F401
+from .compression import Compression  # noqa F401
+from .store import IMessageStore, InmemMessageStore, SqliteMessageStore  # noqa F401
+from .log import TopicLog  # noqa F401
+from .topics import TopicTrie  # noqa F401
 from loguru import logger
 
 
@@ -0,0 +1,415 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import json
+from uuid import UUID
+
+from loguru import logger
+from zmq.asyncio import Socket
+
+from . import shm
+from .client import ACK_BATCH, ClientException, ResponseTimeout
+from .codec import CODECS, JSON_CODEC, ICodec, decode
+from .compression import COMPRESSORS, DICTIONARIES, Compression
+from .models import (
+    Command,
+    Event,
+    EventAck,
+    Message,
+    MessageType,
+    Ping,
+    Pong,
+    Register,
+    Release,
+    Request,
+    Response,
+    Subscribe,
+    Unsubscribe,
+)
+from .store import IMessageStore
+from .topics import TopicTrie
+from .utils import POLL_TIMEOUT, generate_random_md5
+from .wire import Header, receive_payload, share_payload, unpack_frames
+
+
+class Subscription:
+    """Async iterator over the events of one subscribed pattern.
+
+    Iteration ends once the pattern is unsubscribed or the client stops.
+    """
+
+    def __init__(self, topic: str):
+        self.topic = topic
+        self._queue: asyncio.Queue[Event | None] = asyncio.Queue()
+
+    def __aiter__(self) -> Subscription:
+        return self
+
+    async def __anext__(self) -> Event:
+        event = await self._queue.get()
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+    async def get(self) -> Event:
+        """The next event, for callers that do not iterate."""
+        return await self.__anext__()
+
+    def _put(self, event: Event | None):
+        self._queue.put_nowait(event)
+
+
+class AsyncClient:
+    """A Client for asyncio applications.
+
+    Runs entirely on the event loop it is started from: a single task
+    reads the socket, and sends are awaited directly, so there are no
+    helper threads and a pending request costs one asyncio Future. The
+    methods mirror `Client`, as coroutines.
+    """
+
+    def __init__(
+        self,
+        socket: Socket,
+        store: IMessageStore | None = None,
+        name: str | None = None,
+        codecs: list[str] | None = None,
+        envelope: bool = True,
+        service: str | None = None,
+        balance: str = "round_robin",
+        shared_memory: int | None = None,
+        compression: Compression | None = None,
+    ):
+        assert isinstance(socket, Socket), "Socket must be of type zmq.asyncio.Socket"
+        self._socket = socket
+        self.store: IMessageStore | None = store
+        self.name: str = name or generate_random_md5()
+        self.registered: bool = False
+        self._offered_codecs: list[str] = codecs or [JSON_CODEC.name]
+        self._codec: ICodec = JSON_CODEC
+        self._offer_envelope: bool = envelope
+        # Requests for the service are balanced over every client joining it.
+        self.service: str | None = service
+        self._balance: str = balance
+        self._envelope: bool = False
+        self._broker_envelope: bool = False
+        # Payload size from which to use shared memory, see Client.
+        self._shared_memory: int | None = shared_memory
+        self._shared: bool = False
+        self._compression: Compression | None = compression
+        self._listener: asyncio.Task | None = None
+        self._topics: dict[str, Subscription] = {}
+        self._subscriptions: TopicTrie = TopicTrie()
+        self._pending_requests: dict[UUID, asyncio.Future[Response]] = {}
+        self.requests: asyncio.Queue[Request] = asyncio.Queue()
+        self._acks: list[UUID] = []
+        self._ack_batch: int = ACK_BATCH
+        self._ack_flush: asyncio.TimerHandle | None = None
+
+    async def start(self):
+        self._listener = asyncio.get_running_loop().create_task(
+            self.__listen(), name=f"{self.name}|Listen"
+        )
+        await self._register()
+        logger.success(f"{self.name} | Client started: {self.name}")
+
+    async def stop(self):
+        if self._ack_flush is not None:
+            self._ack_flush.cancel()
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+        for future in self._pending_requests.values():
+            future.cancel()
+        self._pending_requests.clear()
+        for subscription in self._topics.values():
+            subscription._put(None)
+        self._topics.clear()
+        self._socket.close()
+
+    async def subscribe(
+        self,
+        topic: str,
+        offset: int | None = None,
+        since: datetime.datetime | None = None,
+        group: str | None = None,
+        prefetch: int = 100,
+        ack_timeout: float = 30.0,
+    ) -> Subscription:
+        """Subscribe to a topic or wildcard pattern; iterate the result for events.
+
+        See `Client.subscribe` for consumer groups; events received through
+        a group must be passed to ack().
+        """
+        logger.info(f"{self.name} | Subscribing to topic: {topic}")
+        TopicTrie.validate(topic)
+        subscribe = Subscribe(
+            source=self.name,
+            topic=topic,
+            offset=offset,
+            since=since,
+            group=group,
+            prefetch=prefetch,
+            ack_timeout=ack_timeout,
+        )
+        if group is not None:
+            self._ack_batch = min(self._ack_batch, max(1, prefetch // 2))
+        if topic in self._topics:
+            await self._sync_send(subscribe, 2)
+            return self._topics[topic]
+        subscription = self._topics[topic] = Subscription(topic)
+        self._subscriptions.subscribe(topic, topic)
+        try:
+            await self._sync_send(subscribe, 2)
+        except Exception as e:
+            logger.error(f"{self.name} | Failed to subscribe: {e}")
+            self._subscriptions.unsubscribe(topic, topic)
+            del self._topics[topic]
+            raise e
+        return subscription
+
+    async def unsubscribe(self, topic: str, group: str | None = None) -> None:
+        """Stop receiving events for a pattern, ending its iterator."""
+        logger.info(f"{self.name} | Unsubscribing from topic: {topic}")
+        await self._flush_acks()
+        await self._sync_send(Unsubscribe(source=self.name, topic=topic, group=group), 2)
+        self._subscriptions.unsubscribe(topic, topic)
+        if (subscription := self._topics.pop(topic, None)) is not None:
+            subscription._put(None)
+
+    async def ping(self, target: str) -> bool:
+        """Ping a target and wait for a PONG response."""
+        try:
+            response = await self._sync_send(Ping(source=self.name, target=target), 2)
+        except ResponseTimeout:
+            response = None
+        if response and response.type == MessageType.PONG:
+            logger.success(f"{self.name} | PING successful to : {target}")
+            return True
+        logger.warning(f"{self.name} | PING failed to : {target}")
+        return False
+
+    async def get_clients(self) -> list[str] | None:
+        """Returns a list of other clients."""
+        command = Command(source=self.name, target="broker", body="GET_CLIENTS")
+        response = await self._sync_send(command, 2)
+        if response and response.type == MessageType.RESPONSE:
+            clients = response.body.split(",")
+            return [client.strip() for client in clients if client.strip()]
+
+    async def get_stats(self) -> dict | None:
+        """The broker's metrics, as from `Metrics.snapshot`."""
+        command = Command(source=self.name, target="broker", body="STATS")
+        response = await self._sync_send(command, 2)
+        if response and response.type == MessageType.RESPONSE:
+            return json.loads(response.body)
+
+    async def publish(self, event: Event):
+        assert isinstance(event, Event), "Event must be of type Event"
+        await self._send_message(event)
+
+    async def ack(self, *events: Event) -> None:
+        """Acknowledge events received through a consumer group, in batches."""
+        self._acks.extend(event.id for event in events)
+        if len(self._acks) >= self._ack_batch:
+            await self._flush_acks()
+        elif self._ack_flush is None:
+            loop = asyncio.get_running_loop()
+            self._ack_flush = loop.call_later(
+                POLL_TIMEOUT, lambda: loop.create_task(self._flush_acks())
+            )
+
+    async def _flush_acks(self):
+        if self._ack_flush is not None:
+            self._ack_flush.cancel()
+            self._ack_flush = None
+        acks, self._acks = self._acks, []
+        if acks:
+            await self._send_message(EventAck(source=self.name, events=acks))
+
+    async def request(self, request: Request, timeout: int = 5) -> Response | None:
+        assert isinstance(request, Request), "Request must be of type Request"
+        return await self._sync_send(request, timeout)
+
+    async def submit(
+        self, request: Request, timeout: float | None = None
+    ) -> asyncio.Future[Response]:
+        """Send a request and return the Future its Response will complete.
+
+        The Future fails with ResponseTimeout once `timeout` (by default the
+        request's own timeout) has elapsed without a response.
+        """
+        assert isinstance(request, Request), "Request must be of type Request"
+        future = await self._submit(request)
+        delay = request.timeout if timeout is None else timeout
+        handle = asyncio.get_running_loop().call_later(delay, self._expire, request.id)
+        future.add_done_callback(lambda _: handle.cancel())
+        return future
+
+    def generate_request(
+        self,
+        target: str,
+        body: str,
+        timeout: int = 5,
+        key: str | None = None,
+        payload: bytes | memoryview | None = None,
+    ) -> Request:
+        """Builds a Request so that the source is already populated."""
+        return Request(
+            source=self.name,
+            target=target,
+            body=body,
+            timeout=timeout,
+            key=key,
+            payload=payload,
+        )
+
+    def generate_event(
+        self, topic: str, body: str, payload: bytes | memoryview | None = None
+    ) -> Event:
+        """Builds an Event so that the source is already populated."""
+        return Event(source=self.name, topic=topic, body=body, payload=payload)
+
+    async def respond(
+        self, request: Request, message: str, payload: bytes | memoryview | None = None
+    ) -> None:
+        response = Response(
+            source=self.name,
+            requestor=request.source,
+            body=message,
+            request_id=request.id,
+            payload=payload,
+        )
+        await self._send_message(response)
+
+    async def _register(self):
+        """Register with the broker."""
+        register = Register(
+            source=self.name,
+            codecs=self._offered_codecs,
+            envelope=self._offer_envelope,
+            service=self.service,
+            balance=self._balance,
+            host=shm.host_id() if self._shared_memory is not None else None,
+            compression=list(COMPRESSORS),
+            dictionaries=list(DICTIONARIES),
+        )
+        response = await self._sync_send(register, 2)
+        if response is None or response.type != MessageType.ACK:
+            raise ClientException("Failed to register with broker")
+        if response.body in self._offered_codecs and response.body in CODECS:
+            self._codec = CODECS[response.body]
+        self._envelope = self._offer_envelope and self._broker_envelope
+        self._shared = self._shared_memory is not None and getattr(response, "shared_memory", False)
+        self.registered = True
+        logger.success(f"{self.name} | Registered with broker: {response.body}")
+
+    async def _sync_send(self, message: Message, timeout: float) -> Response | None:
+        """Send a message and wait for the response to it."""
+        future = await self._submit(message)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"{self.name} | No response to {message.type.value}: {message.id}")
+            raise ResponseTimeout(f"No response to {message.id} within {timeout}s") from None
+        finally:
+            self._pending_requests.pop(message.id, None)
+
+    async def _submit(self, message: Message) -> asyncio.Future[Response]:
+        future: asyncio.Future[Response] = asyncio.get_running_loop().create_future()
+        self._pending_requests[message.id] = future
+        await self._send_message(message)
+        return future
+
+    def _resolve(self, response: Response):
+        future = self._pending_requests.pop(response.request_id, None)
+        if future is None or future.done():
+            logger.debug(f"{self.name} | Dropping late response: {response.request_id}")
+            return
+        if response.type == MessageType.TIMEOUT:
+            future.set_exception(ResponseTimeout(f"Broker timed out {response.request_id}"))
+        else:
+            future.set_result(response)
+
+    def _expire(self, message_id: UUID):
+        future = self._pending_requests.pop(message_id, None)
+        if future is not None and not future.done():
+            future.set_exception(ResponseTimeout(f"No response to {message_id}"))
+
+    async def __listen(self):
+        while True:
+            frames = unpack_frames(await self._socket.recv_multipart(copy=False))
+            if not frames:
+                continue
+            if len(frames) > 1:
+                # [header, body, payload?]; the header only matters to the broker.
+                self._broker_envelope = True
+            try:
+                message = decode(frames[1] if len(frames) > 1 else frames[0])
+            except Exception as e:
+                logger.error(f"{self.name} | Error decoding message: {e}")
+                continue
+            try:
+                if len(frames) > 2:
+                    payload, segment = receive_payload(frames)
+                    message = message.model_copy(update={"payload": payload})
+                    if segment is not None:
+                        await self._send_message(Release(source=self.name, segments=[segment]))
+                await self._handle_message(message)
+            except Exception as e:
+                # One bad message must not end the listen task.
+                logger.error(f"{self.name} | Error handling {message.type.value} {message.id}: {e}")
+
+    async def _handle_message(self, message: Message):
+        if message.type in (
+            MessageType.RESPONSE,
+            MessageType.PONG,
+            MessageType.ACK,
+            MessageType.TIMEOUT,
+        ):
+            assert isinstance(message, Response)
+            self._resolve(message)
+        elif message.type == MessageType.EVENT:
+            assert isinstance(message, Event)
+            for pattern in self._subscriptions.match(message.topic):
+                if (subscription := self._topics.get(pattern)) is not None:
+                    subscription._put(message)
+        elif message.type == MessageType.PING:
+            assert isinstance(message, Ping)
+            pong = Pong(source=self.name, requestor=message.source, request_id=message.id)
+            await self._send_message(pong)
+        elif message.type == MessageType.REQUEST:
+            assert isinstance(message, Request)
+            self.requests.put_nowait(message)
+        else:
+            logger.error(f"{self.name} | Client does not support message type: {message.type}")
+            return
+        if self.store is not None:
+            self.store.add_rx_message(message)
+
+    async def _send_message(self, message: Message):
+        body = self._codec.encode(message)
+        if self._envelope:
+            if self._compression is not None:
+                body = self._compression.compress(body, getattr(message, "topic", None))
+            header, payload = Header.from_message(message), message.payload
+            if (
+                payload is not None
+                and self._shared
+                and memoryview(payload).nbytes >= self._shared_memory
+            ):
+                header, payload = share_payload(header, payload)
+            frames = [header.encode(), body]
+            if payload is not None:
+                frames.append(payload)
+            await self._socket.send_multipart(frames, copy=False)
+        elif message.payload is not None:
+            raise ClientException("Payloads need the header framing")
+        else:
+            await self._socket.send(body)
+        if self.store is not None:
+            self.store.add_tx_message(message)
@@ -0,0 +1,153 @@
+import bisect
+import hashlib
+import threading
+from typing import Protocol, runtime_checkable
+
+from .wire import Header
+
+
+class BalancingError(ValueError):
+    """Raised for unknown balancing policies."""
+
+
+@runtime_checkable
+class IBalancer(Protocol):
+    def add(self, replica: bytes) -> None:
+        """Start sending requests to a replica."""
+        ...
+
+    def remove(self, replica: bytes) -> None:
+        """Stop sending requests to a replica."""
+        ...
+
+    def choose(self, header: Header, in_flight: dict[bytes, int]) -> bytes:
+        """The replica for a request, given the requests each one is working on."""
+        ...
+
+
+class RoundRobin(IBalancer):
+    """Replicas take turns."""
+
+    def __init__(self):
+        self._replicas: list[bytes] = []
+        self._next = 0
+
+    def add(self, replica: bytes) -> None:
+        if replica not in self._replicas:
+            self._replicas.append(replica)
+
+    def remove(self, replica: bytes) -> None:
+        if replica in self._replicas:
+            self._replicas.remove(replica)
+
+    def choose(self, header: Header, in_flight: dict[bytes, int]) -> bytes:
+        self._next %= len(self._replicas)
+        replica = self._replicas[self._next]
+        self._next += 1
+        return replica
+
+
+class LeastOutstanding(RoundRobin):
+    """The replica with the fewest requests in flight, taking turns on ties."""
+
+    def choose(self, header: Header, in_flight: dict[bytes, int]) -> bytes:
+        count = len(self._replicas)
+        start = self._next % count
+        self._next = start + 1
+        order = self._replicas[start:] + self._replicas[:start]
+        return min(order, key=lambda replica: in_flight.get(replica, 0))
+
+
+class ConsistentHash(IBalancer):
+    """Requests with the same key go to the same replica.
+
+    Each replica owns `VNODES` points on a hash ring and a request goes to
+    the first point after its key, so adding or removing a replica only
+    moves the keys next to its points. Requests without a key are keyed
+    by their source.
+    """
+
+    VNODES: int = 64
+
+    def __init__(self):
+        self._points: list[int] = []
+        self._owners: list[bytes] = []
+
+    @staticmethod
+    def _hash(value: bytes) -> int:
+        return int.from_bytes(hashlib.md5(value).digest()[:8], "big")
+
+    def add(self, replica: bytes) -> None:
+        if replica in self._owners:
+            return
+        for vnode in range(self.VNODES):
+            point = self._hash(replica + vnode.to_bytes(2, "big"))
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, replica)
+
+    def remove(self, replica: bytes) -> None:
+        keep = [i for i, owner in enumerate(self._owners) if owner != replica]
+        self._points = [self._points[i] for i in keep]
+        self._owners = [self._owners[i] for i in keep]
+
+    def choose(self, header: Header, in_flight: dict[bytes, int]) -> bytes:
+        key = (header.key or header.source).encode("utf-8")
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+BALANCERS: dict[str, type[IBalancer]] = {
+    "round_robin": RoundRobin,
+    "least_outstanding": LeastOutstanding,
+    "consistent_hash": ConsistentHash,
+}
+
+
+class ServiceGroup:
+    """Replicas registered under one service name, and their requests in flight.
+
+    `dispatch` counts a request against the replica it picks until it is
+    `release`d by a response or a timeout, which may happen on another
+    thread.
+    """
+
+    def __init__(self, name: str, policy: str = "round_robin"):
+        if policy not in BALANCERS:
+            raise BalancingError(f"Unknown balancing policy: {policy!r}")
+        self.name = name
+        self.policy = policy
+        self.replicas: set[bytes] = set()
+        self.in_flight: dict[bytes, int] = {}
+        self._balancer: IBalancer = BALANCERS[policy]()
+        self._lock = threading.Lock()
+
+    def add(self, replica: bytes) -> None:
+        with self._lock:
+            self.replicas.add(replica)
+            self.in_flight.setdefault(replica, 0)
+            self._balancer.add(replica)
+
+    def remove(self, replica: bytes) -> None:
+        with self._lock:
+            self.replicas.discard(replica)
+            self.in_flight.pop(replica, None)
+            self._balancer.remove(replica)
+
+    def dispatch(self, header: Header) -> bytes | None:
+        """Pick the replica for a request and count it as in flight there."""
+        with self._lock:
+            if not self.replicas:
+                return None
+            replica = self._balancer.choose(header, self.in_flight)
+            self.in_flight[replica] += 1
+            return replica
+
+    def release(self, replica: bytes) -> None:
+        with self._lock:
+            if self.in_flight.get(replica, 0) > 0:
+                self.in_flight[replica] -= 1
+
+    def __repr__(self) -> str:
+        replicas = len(self.replicas)
+        return f"<ServiceGroup(name={self.name!r}, policy={self.policy}, replicas={replicas})>"
@@ -0,0 +1,310 @@
+import datetime
+import json
+import os
+import platform
+import queue
+import subprocess
+import threading
+import time
+from importlib import metadata
+from pathlib import Path
+from typing import Callable, NamedTuple
+
+import zmq
+from zmq import DEALER, ROUTER, Context
+from zmq.auth import CURVE_ALLOW_ANY
+from zmq.auth.thread import ThreadAuthenticator
+
+from .broker import Broker
+from .client import Client
+from .tracing import ITracer
+
+TRANSPORTS: list[str] = ["inproc", "ipc", "tcp", "curve"]
+SCENARIOS: list[str] = ["publish", "fanout", "request", "ping"]
+# Messages in flight at most while measuring throughput.
+WINDOW: int = 500
+# Seconds to wait for any one message before giving up on a run.
+TIMEOUT: float = 10.0
+# Gated by `compare`; p999 is reported only, it is too noisy to gate on.
+_LATENCIES = ("p50", "p99")
+
+
+class BenchError(Exception):
+    """Raised when a run loses messages or cannot be set up."""
+
+
+class Result(NamedTuple):
+    """One scenario on one transport; throughput in messages per second,
+    latencies in microseconds."""
+
+    scenario: str
+    transport: str
+    throughput: float
+    p50: float
+    p99: float
+    p999: float
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of unsorted samples."""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Bus:
+    """A Broker on one transport, and clients connected to it, all traced by `tracer`."""
+
+    def __init__(self, transport: str, tracer: ITracer | None = None):
+        if transport not in TRANSPORTS:
+            raise BenchError(f"Unknown transport: {transport}")
+        self.transport = transport
+        self.tracer = tracer
+        self.context = Context()
+        self.clients: list[Client] = []
+        self._auth: ThreadAuthenticator | None = None
+        router = self.context.socket(ROUTER)
+        if transport == "curve":
+            self._auth = ThreadAuthenticator(self.context)
+            self._auth.start()
+            self._auth.configure_curve(domain="*", location=CURVE_ALLOW_ANY)
+            self._server_public, server_secret = zmq.curve_keypair()
+            router.curve_secretkey = server_secret
+            router.curve_publickey = self._server_public
+            router.curve_server = True
+        if transport == "ipc":
+            self.address = f"ipc:///tmp/pyaduct-bench-{os.getpid()}"
+            router.bind(self.address)
+        else:
+            port = router.bind_to_random_port("tcp://127.0.0.1")
+            self.address = f"tcp://127.0.0.1:{port}"
+        self.broker = Broker(router, tracer=tracer)
+        self.broker.start()
+
+    def client(self, name: str) -> Client:
+        if self.transport == "inproc":
+            client = Client(self.broker, name=name, tracer=self.tracer)
+        else:
+            socket = self.context.socket(DEALER)
+            if self.transport == "curve":
+                public, secret = zmq.curve_keypair()
+                socket.curve_secretkey = secret
+                socket.curve_publickey = public
+                socket.curve_serverkey = self._server_public
+            socket.connect(self.address)
+            client = Client(socket, name=name, codecs=["binary", "json"], tracer=self.tracer)
+        client.start()
+        self.clients.append(client)
+        return client
+
+    def close(self):
+        for client in self.clients:
+            client.stop()
+        self.broker.stop()
+        if self._auth is not None:
+            self._auth.stop()
+        self.context.destroy(linger=0)
+
+
+def _get(source: queue.Queue):
+    try:
+        return source.get(timeout=TIMEOUT)
+    except queue.Empty:
+        raise BenchError("Message lost") from None
+
+
+def _fanout(bus: Bus, messages: int, samples: int, subscribers: int):
+    sender = bus.client("bench_publisher")
+    receivers = [bus.client(f"bench_subscriber_{i}") for i in range(subscribers)]
+    queues = [receiver.subscribe("bench") for receiver in receivers]
+    body = "x" * 64
+    start = time.perf_counter()
+    for offset in range(0, messages, WINDOW):
+        window = min(WINDOW, messages - offset)
+        for _ in range(window):
+            sender.publish(sender.generate_event("bench", body))
+        for events in queues:
+            for _ in range(window):
+                _get(events)
+    throughput = messages * subscribers / (time.perf_counter() - start)
+    latencies = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        sender.publish(sender.generate_event("bench", body))
+        for events in queues:
+            _get(events)
+        latencies.append((time.perf_counter() - start) * 1e6)
+    return throughput, latencies
+
+
+def _publish(bus: Bus, messages: int, samples: int, subscribers: int):
+    _ = subscribers
+    return _fanout(bus, messages, samples, 1)
+
+
+def _responder(bus: Bus) -> tuple[Client, threading.Event, threading.Thread]:
+    server = bus.client("bench_responder")
+    stop = threading.Event()
+
+    def serve():
+        while not stop.is_set():
+            try:
+                request = server.requests.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            server.respond(request, request.body)
+
+    thread = threading.Thread(target=serve, name="bench|Respond")
+    thread.start()
+    return server, stop, thread
+
+
+def _request(bus: Bus, messages: int, samples: int, subscribers: int):
+    _ = subscribers
+    requester = bus.client("bench_requester")
+    _, stop, thread = _responder(bus)
+    body = "x" * 64
+    try:
+        start = time.perf_counter()
+        for offset in range(0, messages, WINDOW):
+            window = min(WINDOW, messages - offset)
+            futures = [
+                requester.submit(requester.generate_request("bench_responder", body))
+                for _ in range(window)
+            ]
+            for future in futures:
+                future.result(timeout=TIMEOUT)
+        throughput = messages / (time.perf_counter() - start)
+        latencies = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            if requester.request(requester.generate_request("bench_responder", body)) is None:
+                raise BenchError("Request lost")
+            latencies.append((time.perf_counter() - start) * 1e6)
+    finally:
+        stop.set()
+        thread.join()
+    return throughput, latencies
+
+
+def _ping(bus: Bus, messages: int, samples: int, subscribers: int):
+    _ = messages, subscribers
+    pinger = bus.client("bench_pinger")
+    bus.client("bench_pinged")
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(samples):
+        sent = time.perf_counter()
+        if not pinger.ping("bench_pinged"):
+            raise BenchError("Ping lost")
+        latencies.append((time.perf_counter() - sent) * 1e6)
+    return samples / (time.perf_counter() - start), latencies
+
+
+_RUNS: dict[str, Callable] = {
+    "publish": _publish,
+    "fanout": _fanout,
+    "request": _request,
+    "ping": _ping,
+}
+
+
+def run(
+    scenario: str,
+    transport: str,
+    messages: int = 20_000,
+    samples: int = 2_000,
+    subscribers: int = 8,
+    tracer: ITracer | None = None,
+) -> Result:
+    """Measure one scenario on one transport, against a fresh Broker.
+
+    Throughput is measured over windows of messages kept below the
+    sockets' high-water marks, so that nothing is dropped, and latency one
+    message at a time over `samples` messages. A `tracer` is handed the
+    stages of the messages of the run, at some cost to its results.
+    """
+    if scenario not in _RUNS:
+        raise BenchError(f"Unknown scenario: {scenario}")
+    bus = Bus(transport, tracer)
+    try:
+        throughput, latencies = _RUNS[scenario](bus, messages, samples, subscribers)
+    finally:
+        bus.close()
+    return Result(
+        scenario,
+        transport,
+        throughput,
+        percentile(latencies, 0.5),
+        percentile(latencies, 0.99),
+        percentile(latencies, 0.999),
+    )
+
+
+def environment() -> dict:
+    """What the results depend on besides the code."""
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "pyaduct": _version(),
+        "python": platform.python_version(),
+        "pyzmq": zmq.__version__,
+        "libzmq": zmq.zmq_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def _version() -> str:
+    """The installed version, or the git revision of a source checkout."""
+    try:
+        return metadata.version("pyaduct")
+    except metadata.PackageNotFoundError:
+        pass
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            timeout=5,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        revision = ""
+    return f"git-{revision}" if revision else "unknown"
+
+
+def save(path: Path, results: list[Result], parameters: dict) -> None:
+    report = {
+        "environment": environment(),
+        "parameters": parameters,
+        "results": [result._asdict() for result in results],
+    }
+    Path(path).write_text(json.dumps(report, indent=2))
+
+
+def load(path: Path) -> list[Result]:
+    report = json.loads(Path(path).read_text())
+    return [Result(**result) for result in report["results"]]
+
+
+def compare(baseline: list[Result], results: list[Result], threshold: float) -> list[str]:
+    """Regressions of more than `threshold`, a fraction, against a baseline.
+
+    Throughput regresses when it drops and p50 and p99 latencies when they
+    grow. Runs missing from either side are not compared.
+    """
+    before = {(result.scenario, result.transport): result for result in baseline}
+    regressions = []
+    for result in results:
+        if (base := before.get((result.scenario, result.transport))) is None:
+            continue
+        name = f"{result.scenario}/{result.transport}"
+        if result.throughput < base.throughput * (1 - threshold):
+            regressions.append(
+                f"{name} throughput {result.throughput:.0f}/s, was {base.throughput:.0f}/s"
+            )
+        for latency in _LATENCIES:
+            now, was = getattr(result, latency), getattr(base, latency)
+            if now > was * (1 + threshold):
+                regressions.append(f"{name} {latency} {now:.0f} us, was {was:.0f} us")
+    return regressions
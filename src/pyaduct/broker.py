@@ -1,28 +1,55 @@
-import datetime
+import functools
+import heapq
+import json
 import random
 import threading
 import time
-from multiprocessing import Queue
+from collections import OrderedDict
+from queue import Full, Queue
 from threading import Thread
 from typing import Callable
 from uuid import UUID
 
 from loguru import logger
-from zmq import NOBLOCK, Again, Socket
+from zmq import NOBLOCK, PAIR, POLLIN, Again, Poller, Socket
 
+from . import compression, profiling, shm, tracing
+from .balancing import BalancingError, ServiceGroup
+from .codec import JSON_CODEC, ICodec, negotiate
+from .consumers import ConsumerGroup, Delivery
+from .log import TopicLog
+from .metrics import MAX_VALUES, Metrics
 from .models import (
     ACK,
     Command,
-    Event,
+    EventAck,
     Message,
-    Ping,
-    Pong,
+    MessageType,
     Register,
-    Request,
+    Release,
     Response,
     Subscribe,
+    Timeout,
+    Unsubscribe,
 )
+from .queues import BoundedQueue
 from .store import IMessageStore
+from .topics import TopicError, TopicTrie
+from .tracing import ITracer, Stage
+from .utils import (
+    BURST_SIZE,
+    POLL_TIMEOUT,
+    THROTTLE_TIMEOUT,
+    drain_queue,
+    generate_random_md5,
+)
+from .wire import GROUP, Envelope, Header, as_buffer, trace_ids, unpack_frames
+
+# How many expired request ids to remember for dropping late responses.
+MAX_EXPIRED: int = 10_000
+# Identities of links start with a byte ROUTER-generated identities never use.
+LINK_PREFIX: bytes = b"\xfflink-"
+INPROC_PREFIX: bytes = b"\xffinproc-"
 
 
 class BrokerError(BaseException):
@@ -37,12 +64,55 @@ class Broker:
         socket: Socket,
         store: IMessageStore | None = None,
         latency: tuple[float, float] | None = None,
+        validate: bool = False,
+        log: TopicLog | None = None,
+        shared_lease: float = shm.SHARED_LEASE,
+        tracer: ITracer | None = None,
+        max_queue: int = 0,
     ):
+        """Route messages between clients connected to a ROUTER socket.
+
+        Requests, responses and events are routed on their header frame
+        alone and their body is forwarded untouched. Set `validate` to
+        decode and validate every body anyway; attaching a `store` also
+        decodes every message so that it can be recorded. With a `log`,
+        every event is appended to it, subscribed or not, and can be
+        replayed by subscribing from an offset or time.
+
+        Clients on the broker's host may send large payloads as handles to
+        shared memory. The broker counts the receivers of each and unlinks
+        it once all of them have mapped it, or after `shared_lease`
+        seconds; receivers on other hosts get the payload inline.
+
+        Compressed bodies are passed along compressed to the clients that
+        declared they can decompress them, and decompressed for the rest.
+
+        With `max_queue`, at most that many messages wait to be handled,
+        and as many to be sent. Once the first queue is full, the broker
+        stops reading its sockets until it drains, so that messages wait in
+        ZMQ's queues and, once those are full too, senders wait in turn.
+
+        A `tracer` is handed a stamp as each sampled message is received,
+        validated, routed and sent, see tracing.
+        """
         assert isinstance(socket, Socket)
+        self._tracer: ITracer | None = tracer
         self._latency = latency
+        self._validate = validate
         self._socket = socket
         self.store: IMessageStore | None = store
+        self.log: TopicLog | None = log
         self.clients: dict[str, bytes] = {}
+        # Requests targeting a service go to one of its replicas.
+        self.services: dict[str, ServiceGroup] = {}
+        self._codecs: dict[bytes, ICodec] = {}
+        self._envelopes: set[bytes] = set()
+        # Whether each client can take a given compressed body.
+        self._accepts: dict[bytes, Callable[[bytes], bool]] = {}
+        # Clients on this host, which can map shared memory payloads.
+        self._host: str = shm.host_id()
+        self._local: set[bytes] = set()
+        self._segments = shm.SharedSegments(shared_lease)
         self._stop = threading.Event()
         self._threads: dict[str, Thread] = {}
         _threads: dict[str, Callable] = {
@@ -54,12 +124,93 @@ class Broker:
         for name, target in _threads.items():
             thread = Thread(target=target, name=name)
             self._threads[name] = thread
-        self._topics: dict[str, list] = {}
-        self._pending: dict[UUID, Request] = {}
-        self._seen: set[UUID] = set()
-        self._tx_queue: Queue[tuple[Event | Request | Response, bytes | None]] = Queue()
-        self._rx_queue: Queue[tuple[bytes | None, str, str]] = Queue()
+        self._topics: TopicTrie = TopicTrie()
+        # Consumer groups, and the patterns bound to each of them.
+        self._groups: dict[str, ConsumerGroup] = {}
+        self._group_topics: TopicTrie = TopicTrie()
+        # Outstanding requests and a heap of their deadlines. Answered requests
+        # leave a stale heap entry behind that the Watch thread skips, so the
+        # heap never holds more than the requests of one timeout window.
+        self._pending: dict[UUID, tuple[Header, float]] = {}
+        # The service replica each pending request was dispatched to.
+        self._dispatched: dict[UUID, tuple[ServiceGroup, bytes]] = {}
+        self._deadlines: list[tuple[float, UUID]] = []
+        self._deadlines_changed = threading.Condition()
+        # Recently expired requests, so that a late response can be dropped.
+        self._expired: OrderedDict[UUID, None] = OrderedDict()
+        # In-process queues: envelopes are shared by reference between the
+        # Handle and Send threads, never pickled, so a fanned-out event keeps
+        # a single body and a single re-encoding per codec.
+        self._tx_queue: BoundedQueue[tuple[Envelope, bytes]] = BoundedQueue(max_queue)
+        self._rx_queue: BoundedQueue[tuple[bytes, list[bytes] | Envelope]] = BoundedQueue(max_queue)
+        # Routed on the header alone.
+        self._routes: dict[MessageType, Callable[[Envelope, bytes], None]] = {
+            MessageType.REQUEST: self._handle_request,
+            MessageType.RESPONSE: self._handle_response,
+            MessageType.EVENT: self._handle_event,
+            MessageType.PING: self._handle_request,
+            MessageType.PONG: self._handle_response,
+        }
+        # Addressed to the broker itself, so the body is always decoded.
+        self._handlers: dict[MessageType, Callable[[Message, bytes], None]] = {
+            MessageType.COMMAND: self._handle_command,
+            MessageType.SUBSCRIBE: self._handle_subscribe,
+            MessageType.UNSUBSCRIBE: self._handle_unsubscribe,
+            MessageType.REGISTER: self._handle_register,
+            MessageType.EVENT_ACK: self._handle_event_ack,
+            MessageType.RELEASE: self._handle_release,
+        }
         self.name: str = "broker"
+        self.metrics = Metrics("pyaduct_broker", {"name": self.name})
+        self._received = self.metrics.counter("received_total", "Messages received", "type")
+        self._sent = self.metrics.counter("sent_total", "Messages sent", "type")
+        self._dropped = self.metrics.counter("dropped_total", "Messages dropped", "reason")
+        self._expirations = self.metrics.counter("expired_total", "Requests that timed out")
+        # Topics and targets are up to the clients, so their series are capped.
+        self._published = self.metrics.counter(
+            "published_total", "Events published", "topic", MAX_VALUES
+        )
+        self._fanout = self.metrics.counter(
+            "delivered_total", "Events queued for subscribers and groups", "topic", MAX_VALUES
+        )
+        self._handle_time = self.metrics.timer(
+            "handle_seconds", "Time spent handling each message received", "type"
+        )
+        self._request_time = self.metrics.timer(
+            "request_seconds", "Time from each request to its response", "target", MAX_VALUES
+        )
+        self.metrics.gauge("rx_queue", "Messages waiting to be handled", self._rx_queue.qsize)
+        self.metrics.gauge("tx_queue", "Messages waiting to be sent", self._tx_queue.qsize)
+        self.metrics.gauge(
+            "queue_high_water",
+            "Most messages ever waiting in each queue",
+            lambda: {"rx": self._rx_queue.high_water, "tx": self._tx_queue.high_water},
+            "queue",
+        )
+        self.metrics.gauge("pending", "Requests waiting for a response", lambda: len(self._pending))
+        self.metrics.gauge("clients", "Registered clients", lambda: len(self.clients))
+        self.metrics.gauge(
+            "shared_segments", "Shared memory payloads in flight", lambda: len(self._segments)
+        )
+        self.metrics.gauge(
+            "group_backlog",
+            "Events waiting for a member of a consumer group",
+            lambda: {name: len(group.backlog) for name, group in list(self._groups.items())},
+            "group",
+        )
+        # The ROUTER socket is only ever touched by the Listen thread. The Send
+        # thread hands finished frames over an inproc pipe, which also wakes up
+        # the Listen thread's poller.
+        outbox = f"inproc://{self.name}-outbox-{generate_random_md5()}"
+        self._outbox_rx: Socket = socket.context.socket(PAIR)
+        self._outbox_rx.bind(outbox)
+        self._outbox_tx: Socket = socket.context.socket(PAIR)
+        self._outbox_tx.connect(outbox)
+        # Extra DEALER sockets polled next to the ROUTER, each known by a
+        # made-up identity that the Send thread addresses like a client's.
+        self._links: dict[bytes, Socket] = {}
+        # Inboxes of clients in this process, which get messages by reference.
+        self._inproc: dict[bytes, Queue[Message]] = {}
 
     def start(self):
         for thread in self._threads.values():
@@ -70,181 +221,576 @@ class Broker:
         self._stop.set()
         for thread in self._threads.values():
             thread.join()
+        self._outbox_tx.close(linger=0)
+        self._outbox_rx.close(linger=0)
+        for link in self._links.values():
+            link.close(linger=0)
         self._socket.close()
+        self._segments.close()
         logger.success("Broker stopped")
 
+    def profile(self, interval: float = profiling.INTERVAL) -> profiling.Profiler:
+        """A profiler of the Listen, Handle, Send and Watch threads, for a `with` block."""
+        return profiling.Profiler(self._threads.values(), interval)
+
+    def add_link(self, socket: Socket) -> bytes:
+        """Poll a connected DEALER socket too, returning the identity to address it by.
+
+        The socket is handed over to the Listen thread and must not be used
+        by the caller afterwards.
+        """
+        link_id = LINK_PREFIX + generate_random_md5().encode("utf-8")
+        self._links[link_id] = socket
+        return link_id
+
+    def connect_inproc(self, inbox: Queue[Message]) -> bytes:
+        """Connect a client in this process, returning the identity it sends as.
+
+        Messages for it are put on `inbox` as they are, without encoding,
+        and it hands its own over with `receive_inproc`. Messages are
+        frozen, so sharing them between receivers is safe.
+        """
+        client_id = INPROC_PREFIX + generate_random_md5().encode("utf-8")
+        self._inproc[client_id] = inbox
+        return client_id
+
+    def disconnect_inproc(self, client_id: bytes):
+        self._inproc.pop(client_id, None)
+
+    def receive_inproc(self, client_id: bytes, message: Message):
+        """Route a message from a client connected with `connect_inproc`."""
+        envelope = Envelope.from_message(message)
+        if self._tracer is not None:
+            self._trace(Stage.BROKER_RX, envelope.header)
+        self._put(self._rx_queue, (client_id, envelope))
+
     def __watch(self):
+        """Sleep until the earliest request deadline, then expire what is due."""
         while not self._stop.is_set():
-            for request_id, request in list(self._pending.items()):
-                if request_id in self._seen:
-                    logger.trace(f"Response for request succeeded: {request_id}")
-                    self._seen.remove(request_id)
-                    del self._pending[request_id]
-                    continue
-                now = datetime.datetime.now(datetime.timezone.utc)
-                delta = datetime.timedelta(seconds=request.timeout)
-                if request.timestamp < now - delta:
-                    logger.warning(f"Response for request timed out: {request_id}")
-                    del self._pending[request_id]
-            time.sleep(0.1)
+            with self._deadlines_changed:
+                delay = POLL_TIMEOUT
+                if self._deadlines:
+                    delay = min(delay, self._deadlines[0][0] - time.time())
+                if delay > 0:
+                    self._deadlines_changed.wait(delay)
+                due = []
+                now = time.time()
+                while self._deadlines and self._deadlines[0][0] <= now:
+                    due.append(heapq.heappop(self._deadlines)[1])
+            for request_id in due:
+                if (pending := self._pending.pop(request_id, None)) is not None:
+                    self._release(request_id)
+                    self._expire(pending[0])
+            for group in list(self._groups.values()):
+                self._deliver(group.expire())
+            self._segments.expire()
+
+    def _expire(self, header: Header):
+        logger.warning(f"Response for request timed out: {header.id}")
+        self._expirations.inc()
+        self._expired[header.id] = None
+        while len(self._expired) > MAX_EXPIRED:
+            self._expired.popitem(last=False)
+        requestor = self.clients.get(header.source)
+        if requestor is None:
+            return
+        timeout = Timeout(source=self.name, requestor=header.source, request_id=header.id)
+        self._reply(timeout, requestor)
 
     def __listen(self):
+        """Sole owner of the ROUTER socket; sleeps until either side has work."""
+        poller = Poller()
+        poller.register(self._socket, POLLIN)
+        poller.register(self._outbox_rx, POLLIN)
+        polled: dict[Socket, bytes] = {}
+        reading = POLLIN
         while not self._stop.is_set():
+            if len(polled) != len(self._links):
+                for link_id, link in list(self._links.items()):
+                    if link not in polled:
+                        poller.register(link, reading)
+                        polled[link] = link_id
+            # Stop reading while the Handle thread is behind, see max_queue.
+            throttled = self._rx_queue.full()
+            if throttled == bool(reading):
+                reading = 0 if throttled else POLLIN
+                for socket in (self._socket, *polled):
+                    poller.register(socket, reading)
+            events = dict(poller.poll((THROTTLE_TIMEOUT if throttled else POLL_TIMEOUT) * 1000))
+            if self._socket in events:
+                self.__receive_burst()
+            if self._outbox_rx in events:
+                self.__transmit_burst()
+            for link, link_id in polled.items():
+                if link in events:
+                    self.__receive_link_burst(link, link_id)
+
+    def __receive_burst(self):
+        for _ in range(BURST_SIZE):
             try:
-                client_id, text = self._socket.recv_multipart(flags=NOBLOCK)
+                client_id, *frames = self._socket.recv_multipart(flags=NOBLOCK, copy=False)
             except Again:
+                return
+            frames = unpack_frames(frames)
+            if not frames:
                 continue
-            if not text:
-                continue
-            text = text.decode("utf-8")
-            message_type, model = text.split(" ", 1)
-            self._rx_queue.put((client_id, message_type, model), block=False)
+            if self._tracer is not None:
+                self._trace_received(frames)
+            self._rx_queue.force((client_id.bytes, frames))
 
-    def __handle(self):
+    def __transmit_burst(self):
+        for _ in range(BURST_SIZE):
+            try:
+                frames = self._outbox_rx.recv_multipart(flags=NOBLOCK, copy=False)
+            except Again:
+                return
+            if self._links and (link := self._links.get(frames[0].bytes)) is not None:
+                link.send_multipart(frames[2:], copy=False)
+            else:
+                self._socket.send_multipart(frames, copy=False)
+
+    def __receive_link_burst(self, link: Socket, link_id: bytes):
+        for _ in range(BURST_SIZE):
+            try:
+                frames = link.recv_multipart(flags=NOBLOCK, copy=False)
+            except Again:
+                return
+            frames = unpack_frames(frames)
+            if frames:
+                if self._tracer is not None:
+                    self._trace_received(frames)
+                self._rx_queue.force((link_id, frames))
+
+    def _trace(self, stage: Stage, header: Header):
+        tracing.stamp(self._tracer, stage, self.name, header.id, header.ref)
+
+    def _trace_received(self, frames: list[bytes]):
+        """Stamp a message read by the Listen thread from its header frame alone.
+
+        Legacy single-frame messages are only stamped from validation on.
+        """
+        if len(frames) < 2:
+            return
+        try:
+            message_id, ref = trace_ids(frames[0])
+        except Exception:
+            return
+        tracing.stamp(self._tracer, Stage.BROKER_RX, self.name, message_id, ref)
+
+    def _put(self, queue: BoundedQueue, item):
+        """Wait for room in a queue, unless the broker stops first."""
         while not self._stop.is_set():
-            if self._rx_queue.empty():
-                continue
-            client_id, message_type, rx_model = self._rx_queue.get(block=False)
-            assert isinstance(client_id, bytes)
-            message_types = {
-                "COMMAND": (Command, self._handle_command),
-                "REQUEST": (Request, self._handle_request),
-                "RESPONSE": (Response, self._handle_response),
-                "EVENT": (Event, self._handle_event),
-                "SUBSCRIBE": (Subscribe, self._handle_subscribe),
-                "REGISTER": (Register, self._handle_register),
-                "PING": (Ping, self._handle_request),
-                "PONG": (Pong, self._handle_response),
-            }
-            assert message_type in message_types, f"Unknown message type: {message_type}"
-            model, function = message_types[message_type]
-            assert issubclass(model, Message)
-            assert isinstance(function, Callable)
             try:
-                message = model.model_validate_json(rx_model)
-                assert isinstance(message, Message)
-            except Exception as e:
-                logger.error(f"Error validating message: {e}")
+                queue.put(item, timeout=POLL_TIMEOUT)
                 return
+            except Full:
+                continue
+
+    def __handle(self):
+        while not self._stop.is_set():
+            for item in drain_queue(self._rx_queue):
+                self._handle_frame(*item)
+
+    def _handle_frame(self, client_id: bytes, frames: list[bytes] | Envelope):
+        assert isinstance(client_id, bytes)
+        started = time.perf_counter()
+        try:
+            envelope = frames if isinstance(frames, Envelope) else Envelope.from_frames(frames)
+            message_type = envelope.header.type
+            if self._validate or self.store is not None or message_type in self._handlers:
+                # Decodes and validates the body, which raises if it is invalid.
+                _ = envelope.message
+        except Exception as e:
+            logger.error(f"Error validating message: {e}")
+            self._dropped.inc("invalid")
+            return
+        if self._tracer is not None:
+            self._trace(Stage.VALIDATE, envelope.header)
+        self._received.inc(message_type.value)
+        try:
+            if self.store is not None:
+                self.store.add_rx_message(envelope.message)
+            if message_type in self._routes:
+                if (segment := envelope.shared) is not None:
+                    self._route_shared(envelope, client_id, segment)
+                else:
+                    self._routes[message_type](envelope, client_id)
+            elif message_type in self._handlers:
+                self._handlers[message_type](envelope.message, client_id)
             else:
-                if self.store is not None:
-                    self.store.add_rx_message(message)
-            function(message, client_id)
-            log = f"\n# {self.name} | RX: {message.type.value}\n"
-            log += f"{message.model_dump_json(indent=2)}"
-            logger.trace(log)
+                logger.error(f"Unknown message type: {message_type}")
+                self._dropped.inc("unknown_type")
+                return
+        except Exception as e:
+            # One bad message must not take the Handle thread down with it.
+            logger.error(f"Error handling {message_type.value} {envelope.header.id}: {e}")
+            self._dropped.inc("handler_error")
+            return
+        if self._tracer is not None:
+            self._trace(Stage.ROUTE, envelope.header)
+        self._handle_time.observe(time.perf_counter() - started, message_type.value)
+        logger.opt(lazy=True).trace(
+            "\n# {} | RX: {}\n{}",
+            lambda: self.name,
+            lambda: message_type.value,
+            lambda: envelope.message.model_dump_json(indent=2),
+        )
+
+    def _route_shared(self, envelope: Envelope, client_id: bytes, segment: str):
+        if client_id not in self._local:
+            logger.error(f"Dropping {envelope.header.id}: its sender cannot share memory with us")
+            self._dropped.inc("not_local")
+            return
+        # Held while routing, so that early releases cannot unlink it.
+        self._segments.open(segment)
+        try:
+            self._routes[envelope.header.type](envelope, client_id)
+        finally:
+            self._segments.release(segment)
+
+    def _reply(self, response: Response, client_id: bytes):
+        self._put(self._tx_queue, (Envelope.from_message(response), client_id))
 
     def _handle_register(self, register: Register, client_id: bytes):
-        if register.source not in self.clients:
-            self.clients[register.source] = client_id
+        previous = self.clients.get(register.source)
+        if previous is not None and previous != client_id:
+            logger.warning(f"Client {register.source} registered again from a new identity")
+            for group in self.services.values():
+                group.remove(previous)
+        self.clients[register.source] = client_id
+        if register.service is not None:
+            self._join_service(register, client_id)
+        codec = negotiate(register.codecs)
+        self._codecs[client_id] = codec
+        if register.envelope:
+            self._envelopes.add(client_id)
+        else:
+            self._envelopes.discard(client_id)
+        # Inproc clients get messages by reference, with payloads inline.
+        self._accepts[client_id] = functools.partial(
+            compression.accepts,
+            compressors=set(register.compression),
+            dictionaries=set(register.dictionaries),
+        )
+        local = register.host == self._host and register.envelope and client_id not in self._inproc
+        if local:
+            self._local.add(client_id)
+        else:
+            self._local.discard(client_id)
+        # The ACK body tells the client which of its offered codecs to use.
         ack = ACK(
             source="broker",
             requestor=register.source,
             request_id=register.id,
+            body=codec.name,
+            shared_memory=local,
         )
-        self._tx_queue.put((ack, None), block=False)
+        self._reply(ack, client_id)
+
+    def _join_service(self, register: Register, client_id: bytes):
+        group = self.services.get(register.service)
+        if group is None:
+            try:
+                group = ServiceGroup(register.service, register.balance)
+            except BalancingError as e:
+                logger.error(f"Rejected service {register.service} of {register.source}: {e}")
+                return
+            self.services[register.service] = group
+        elif group.policy != register.balance:
+            logger.warning(
+                f"Service {group.name} balances by {group.policy}, not {register.balance}"
+            )
+        group.add(client_id)
+        logger.info(f"Client {register.source} joined service {group.name}")
+
+    def _release(self, request_id: UUID):
+        if (dispatched := self._dispatched.pop(request_id, None)) is not None:
+            group, replica = dispatched
+            group.release(replica)
 
     def _handle_subscribe(self, subscribe: Subscribe, client_id: bytes):
-        _ = client_id
-        if subscribe.topic not in self._topics:
-            self._topics[subscribe.topic] = []
-        self._topics[subscribe.topic].append(subscribe.source)
+        try:
+            if subscribe.group is not None:
+                self._group_topics.subscribe(subscribe.topic, subscribe.group)
+            else:
+                self._topics.subscribe(subscribe.topic, subscribe.source)
+        except TopicError as e:
+            logger.error(f"Rejected subscription from {subscribe.source}: {e}")
+            return
         response = ACK(
             source="broker",
             requestor=subscribe.source,
             request_id=subscribe.id,
         )
-        self._tx_queue.put((response, None), block=False)
+        self._reply(response, client_id)
+        if subscribe.group is not None:
+            self._join_group(subscribe, client_id)
+        elif subscribe.offset is not None or subscribe.since is not None:
+            self._replay(subscribe, client_id)
+
+    def _join_group(self, subscribe: Subscribe, client_id: bytes):
+        if (group := self._groups.get(subscribe.group)) is None:
+            group = self._groups[subscribe.group] = ConsumerGroup(subscribe.group)
+            logger.info(f"Consumer group {group.name} created on {subscribe.topic}")
+        deliveries = group.join(
+            subscribe.source, client_id, subscribe.prefetch, subscribe.ack_timeout
+        )
+        self._deliver(deliveries)
 
-    def _handle_event(self, event: Event, client_id: bytes):
+    def _leave_group(self, unsubscribe: Unsubscribe):
+        if (group := self._groups.get(unsubscribe.group)) is None:
+            return
+        self._deliver(group.leave(unsubscribe.source))
+        if not group.members:
+            # The last member took the group, its patterns and backlog along.
+            del self._groups[group.name]
+            self._group_topics.remove(group.name)
+            if group.backlog:
+                logger.warning(f"Dropped {len(group.backlog)} events of group {group.name}")
+                self._dropped.inc("group_backlog", len(group.backlog))
+
+    def _handle_event_ack(self, event_ack: EventAck, client_id: bytes):
         _ = client_id
-        if event.topic in self._topics:
-            for client in self._topics[event.topic]:
-                client_id = self.clients[client]
-                self._tx_queue.put((event, client_id), block=False)
-        else:
-            logger.warning(f"No subscribers for topic: {event.topic}")
+        for group in list(self._groups.values()):
+            if event_ack.source in group.members:
+                self._deliver(group.ack(event_ack.source, event_ack.events))
+
+    def _handle_release(self, release: Release, client_id: bytes):
+        _ = client_id
+        for segment in release.segments:
+            self._segments.release(segment)
+
+    def _deliver(self, deliveries: list[Delivery]):
+        for envelope, client_id in deliveries:
+            self._queue(envelope, client_id)
+
+    def _queue(self, envelope: Envelope, client_id: bytes):
+        """Queue a routed message for sending, holding its shared payload if any."""
+        if (segment := envelope.shared) is not None:
+            self._segments.hold(segment)
+        self._put(self._tx_queue, (envelope, client_id))
+
+    def _replay(self, subscribe: Subscribe, client_id: bytes):
+        """Queue logged events ahead of any live event for the new subscriber."""
+        if self.log is None:
+            logger.warning(f"No event log to replay {subscribe.topic} for {subscribe.source}")
+            return
+        since = subscribe.since.timestamp() if subscribe.since is not None else None
+        count = 0
+        for record in self.log.read(subscribe.topic, subscribe.offset, since):
+            header = Header.decode(record.header)
+            envelope = Envelope(
+                header, record.body, header_frame=record.header, payload=record.payload
+            )
+            self._put(self._tx_queue, (envelope, client_id))
+            count += 1
+        logger.debug(f"Replayed {count} events on {subscribe.topic} to {subscribe.source}")
+
+    def _log_event(self, topic: str, envelope: Envelope):
+        """Append an event to the log, with a shared payload copied in."""
+        if envelope.shared is not None:
+            try:
+                envelope = envelope.inline()
+            except FileNotFoundError:
+                logger.error(f"Logging {envelope.header.id} without its shared payload: it is gone")
+                envelope = Envelope(envelope.header._replace(flags=0), envelope.raw_body)
+        payload = as_buffer(envelope.payload) if envelope.payload is not None else None
+        self.log.append(topic, envelope.header_frame, envelope.raw_body, payload)
+
+    def _handle_unsubscribe(self, unsubscribe: Unsubscribe, client_id: bytes):
+        try:
+            if unsubscribe.group is not None:
+                TopicTrie.validate(unsubscribe.topic)
+                self._leave_group(unsubscribe)
+            else:
+                self._topics.unsubscribe(unsubscribe.topic, unsubscribe.source)
+        except TopicError as e:
+            logger.error(f"Rejected unsubscribe from {unsubscribe.source}: {e}")
+            return
+        response = ACK(
+            source="broker",
+            requestor=unsubscribe.source,
+            request_id=unsubscribe.id,
+        )
+        self._reply(response, client_id)
 
-    def _handle_request(self, request: Request, client_id: bytes):
+    def _handle_event(self, envelope: Envelope, client_id: bytes):
         _ = client_id
-        self._tx_queue.put((request, None), block=False)
+        topic = envelope.header.route
+        if self.log is not None:
+            try:
+                self._log_event(topic, envelope)
+            except TopicError as e:
+                logger.error(f"Rejected event from {envelope.header.source}: {e}")
+                self._dropped.inc("invalid_topic")
+                return
+        self._published.inc(topic)
+        subscribers = self._topics.match(topic)
+        # Once per socket: a Session hosting several subscribers fans out itself.
+        receivers = {self.clients[client] for client in subscribers}
+        for client_id in receivers:
+            # Every subscriber shares the same envelope, and with it the body.
+            self._queue(envelope, client_id)
+        groups = self._group_topics.match(topic) if self._groups else ()
+        if receivers or groups:
+            self._fanout.inc(topic, len(receivers) + len(groups))
+        if groups and (segment := envelope.shared) is not None:
+            # Groups may redeliver it until the lease is up, so never released.
+            self._segments.hold(segment)
+        for name in groups:
+            if (group := self._groups.get(name)) is not None:
+                self._deliver(group.offer(envelope))
+        if not subscribers and not groups and self.log is None:
+            logger.warning(f"No subscribers for topic: {topic}")
+            self._dropped.inc("no_subscribers")
+
+    def _handle_request(self, envelope: Envelope, client_id: bytes):
+        header = envelope.header
+        if (group := self.services.get(header.route)) is not None:
+            target = group.dispatch(header)
+        else:
+            target = self._route_to(header.route)
+        if target is None:
+            # Nobody could ever answer it, so fail it now rather than at its deadline.
+            logger.error(f"Unknown target: {header.route}")
+            self._dropped.inc("unknown_target")
+            timeout = Timeout(
+                source=self.name,
+                requestor=header.source,
+                request_id=header.id,
+                body="UNKNOWN_TARGET",
+            )
+            self._reply(timeout, client_id)
+            return
+        if group is not None:
+            # Released once answered or expired.
+            self._dispatched[header.id] = (group, target)
+        self._pending[header.id] = (header, time.perf_counter())
+        with self._deadlines_changed:
+            heapq.heappush(self._deadlines, (header.deadline, header.id))
+            if self._deadlines[0][1] == header.id:
+                self._deadlines_changed.notify()
+        self._queue(envelope, target)
+
+    def _route_to(self, name: str) -> bytes | None:
+        """The identity to send a message for the named client to."""
+        return self.clients.get(name)
+
+    def _client_names(self) -> list[str]:
+        return [*self.clients, *(name for name in self.services if name not in self.clients)]
 
     def _handle_command(self, command: Command, client_id: bytes):
-        _ = client_id  # We don't use client_id for commands
         current_client = command.source
         if command.body == "GET_CLIENTS":
-            clients = ",".join([name for name in self.clients.keys() if name != current_client])
-            response = Response(
-                body=clients,
-                requestor=command.source,
-                request_id=command.id,
-                source="broker",
-            )
-            self._tx_queue.put((response, None), block=False)
+            body = ",".join([name for name in self._client_names() if name != current_client])
+        elif command.body == "STATS":
+            body = json.dumps(self.metrics.snapshot())
+        else:
+            logger.error(f"Unknown command from {command.source}: {command.body}")
+            self._dropped.inc("unknown_command")
+            return
+        response = Response(
+            body=body,
+            requestor=command.source,
+            request_id=command.id,
+            source="broker",
+        )
+        self._reply(response, client_id)
 
-    def _handle_response(self, response: Response, client_id: bytes):
+    def _handle_response(self, envelope: Envelope, client_id: bytes):
         _ = client_id
-        self._seen.add(response.request_id)
-        self._send_response(response)
+        header = envelope.header
+        if (pending := self._pending.pop(header.ref, None)) is not None:
+            self._release(header.ref)
+            request, started = pending
+            self._request_time.observe(time.perf_counter() - started, request.route)
+        elif header.ref in self._expired:
+            logger.warning(f"Dropping response after timeout: {header.ref}")
+            self._dropped.inc("late_response")
+            return
+        logger.trace(f"Response for request succeeded: {header.ref}")
+        requestor = self._route_to(header.route)
+        if requestor is None:
+            logger.error(f"Unknown requestor: {header.route}")
+            self._dropped.inc("unknown_requestor")
+            return
+        self._queue(envelope, requestor)
 
     def __send(self):
         while not self._stop.is_set():
-            if self._tx_queue.empty():
-                continue
-            message, client_id = self._tx_queue.get(block=False)
-            assert isinstance(message, (Request, Response, Event, Ping, Pong, ACK))
-            if isinstance(message, Request):
-                self._send_request(message)
-            elif isinstance(message, Response):
-                self._send_response(message)
-            elif isinstance(message, Event):
-                assert isinstance(client_id, bytes)
-                self._send_event(message, client_id)
-            elif isinstance(message, Ping):
-                assert isinstance(client_id, bytes)
-                self._send_request(message)
-            elif isinstance(message, Pong):
-                assert isinstance(client_id, bytes)
-                self._send_response(message)
-            elif isinstance(message, ACK):
-                assert isinstance(client_id, bytes)
-                self._send_response(message)
+            for envelope, client_id in drain_queue(self._tx_queue):
+                try:
+                    self._send_message(envelope, client_id)
+                except Exception as e:
+                    logger.error(f"Failed to send {envelope.header.id}: {e}")
+                    self._dropped.inc("send_error")
+
+    def _send_message(self, envelope: Envelope, client_id: bytes):
+        assert isinstance(envelope, Envelope)
+        assert isinstance(client_id, bytes)
+        if (segment := envelope.shared) is not None and client_id not in self._local:
+            envelope = self._inline(envelope, segment)
+        inbox = self._inproc.get(client_id) if self._inproc else None
+        codec = self._codecs.get(client_id, JSON_CODEC)
+        framed = client_id in self._envelopes
+        try:
+            if inbox is not None:
+                message = envelope.message
+                if envelope.header.flags & GROUP:
+                    message = message.model_copy(update={"member": envelope.header.key})
             else:
-                logger.error(f"Unknown message type: {type(message)}")
-                raise BrokerError(f"Unknown message type: {type(message)}")
-            log = f"\n# {self.name} | TX: {message.type.value}\n"
-            log += f"{message.model_dump_json(indent=2)}"
-            logger.trace(log)
+                frames = envelope.frames(codec, framed, self._accepts.get(client_id))
+        except compression.CompressionError as e:
+            logger.error(f"Cannot decompress {envelope.header.id} for a client: {e}")
+            self._dropped.inc("decompression")
+            return
+        if inbox is not None:
+            self._delay()
+            if self._tracer is not None:
+                self._trace(Stage.BROKER_TX, envelope.header)
+            try:
+                inbox.put(message, block=False)
+            except Full:
+                # Like the ROUTER socket at its high-water mark: never wait on one client.
+                logger.warning(f"Dropping {envelope.header.id}: an inproc client's inbox is full")
+                self._dropped.inc("inbox_full")
+                return
+            self._sent.inc(envelope.header.type.value)
             if self.store is not None:
-                self.store.add_rx_message(message)
-
-    def _send_request(self, request: Request):
-        self._pending[request.id] = request
-        text = f"{request.type.value} {request.model_dump_json()}"
-        target = self.clients.get(request.target)
-        if target is None:
-            logger.error(f"Unknown target: {request.target}")
+                self.store.add_tx_message(message)
             return
-        client_id = self.clients[request.target]
-        # self._socket.send_multipart([self.clients[request.target], b"", text.encode("utf-8")])
-        self._send_multipart(client_id, text)
-
-    def _send_response(self, response: Response):
-        text = f"{response.type.value} {response.model_dump_json()}"
-        client_id = self.clients[response.requestor]
-        # self._socket.send_multipart([client_id, b"", text.encode("utf-8")])
-        self._send_multipart(client_id, text)
+        if envelope.payload is not None and not framed:
+            logger.warning(f"Dropping payload of {envelope.header.id} for a client without framing")
+            self._dropped.inc("payload")
+        self._sent.inc(envelope.header.type.value)
+        if self._tracer is not None:
+            self._trace(Stage.BROKER_TX, envelope.header)
+        self._send_multipart(client_id, frames)
+        logger.opt(lazy=True).trace(
+            "\n# {} | TX: {}\n{}",
+            lambda: self.name,
+            lambda: envelope.header.type.value,
+            lambda: envelope.message.model_dump_json(indent=2),
+        )
+        if self.store is not None:
+            self.store.add_tx_message(envelope.message)
 
-    def _send_event(self, event: Event, client_id: bytes):
-        text = f"{event.type.value} {event.model_dump_json()}"
-        # self._socket.send_multipart([client_id, b"", text.encode("utf-8")])
-        self._send_multipart(client_id, text)
+    def _inline(self, envelope: Envelope, segment: str) -> Envelope:
+        """The envelope with its shared payload inline, for receivers that cannot map it."""
+        try:
+            return envelope.inline()
+        except FileNotFoundError:
+            logger.error(f"Shared payload of {envelope.header.id} is gone")
+            return Envelope(envelope.header._replace(flags=0), envelope.raw_body)
+        finally:
+            self._segments.release(segment)
 
-    def _send_multipart(self, client_id: bytes, text: str):
+    def _delay(self):
         if self._latency:
             lower, upper = self._latency
             random_sleep = random.uniform(lower, upper)
             time.sleep(random_sleep)
-        assert isinstance(client_id, bytes)
-        assert isinstance(text, str)
-        self._socket.send_multipart([client_id, b"", text.encode("utf-8")])
+
+    def _send_multipart(self, client_id: bytes, frames: list[bytes]):
+        self._delay()
+        self._outbox_tx.send_multipart([client_id, b"", *frames], copy=False)
@@ -1,76 +1,208 @@
 from __future__ import annotations
 
+import datetime
+import functools
+import heapq
+import json
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor
-from multiprocessing import Queue
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from queue import Full, Queue
 from threading import Thread
 from typing import Callable
 from uuid import UUID
 
 from loguru import logger
-from zmq import NOBLOCK, Again, Socket
+from zmq import NOBLOCK, PAIR, POLLIN, Again, Poller, Socket
 
 from pyaduct.store import IMessageStore
 
+from . import profiling, shm, tracing
+from .broker import Broker
+from .codec import CODECS, JSON_CODEC, ICodec, decode
+from .compression import COMPRESSORS, DICTIONARIES, Compression
+from .metrics import Metrics
 from .models import (
-    ACK,
     Command,
     Event,
+    EventAck,
     Message,
     MessageType,
     Ping,
     Pong,
     Register,
+    Release,
     Request,
     Response,
     Subscribe,
+    Timeout,
+    Unsubscribe,
 )
-from .utils import generate_random_md5
+from .queues import POLICIES, Backpressure, BoundedQueue
+from .topics import TopicTrie
+from .tracing import ITracer, Stage
+from .utils import (
+    BURST_SIZE,
+    POLL_TIMEOUT,
+    THROTTLE_TIMEOUT,
+    drain_queue,
+    generate_random_md5,
+)
+from .wire import Header, member_of, receive_payload, share_payload, unpack_frames
+
+# Most event ids acknowledged in one EventAck.
+ACK_BATCH: int = 64
 
 
 class ClientException(Exception): ...
 
 
-class ResponseTimeout(ClientException): ...
+class ResponseTimeout(ClientException, TimeoutError): ...
+
+
+class BackpressureError(ClientException, Full): ...
 
 
 class Client:
     def __init__(
         self,
-        socket: Socket,
+        socket: Socket | Broker,
         store: IMessageStore | None = None,
         name: str | None = None,
+        codecs: list[str] | None = None,
+        envelope: bool = True,
+        service: str | None = None,
+        balance: str = "round_robin",
+        shared_memory: int | None = None,
+        compression: Compression | None = None,
+        tracer: ITracer | None = None,
+        max_queue: int = 0,
+        backpressure: Backpressure | None = None,
     ):
-        assert isinstance(socket, Socket), "Socket must be of type zmq.Socket"
-        self._socket = socket
-        self.store: IMessageStore | None = store
-        if name:
-            _name = name
-        else:
-            _name = generate_random_md5()
-        assert isinstance(_name, str), "Name must be of type str"
-        self.name: str = _name
-        self.registered: bool = False
+        """A named client of a Broker.
+
+        Pass a DEALER socket connected to the broker, or, in the broker's
+        own process, the Broker itself: messages are then handed over by
+        reference, without encoding, sockets or validation on the way.
+
+        With `shared_memory`, payloads of at least that many bytes are
+        handed to a broker on the same host in shared memory, and payloads
+        from other clients doing so are mapped rather than copied.
+
+        With `compression`, large bodies are compressed before they are
+        sent. Any client can decompress them.
+
+        With `max_queue`, each of the client's queues holds at most that
+        many messages. When the send queue is full, publish, respond and
+        requests follow `backpressure`: they block by default, or fail
+        with BackpressureError. Received events and requests that find
+        their queue full are dropped, and the client stops reading its
+        socket while its own receive queue is full. Every queue's
+        high-water mark is in `metrics` and `high_water()`.
+
+        A `tracer` is handed a stamp as each sampled message is queued,
+        sent, received and handled, see tracing.
+        """
+        assert isinstance(socket, (Socket, Broker)), "Socket must be of type zmq.Socket"
+        self._broker: Broker | None = socket if isinstance(socket, Broker) else None
+        self._socket: Socket | None = socket if self._broker is None else None
+        self._inproc_id: bytes | None = None
+        self._init_name(name or generate_random_md5(), store, service, balance, max_queue)
+        # Offered to the broker in preference order; JSON until it answers.
+        self._offered_codecs: list[str] = codecs or [JSON_CODEC.name]
+        self._codec: ICodec = JSON_CODEC
+        # Header + body framing lets the broker route without decoding. It is
+        # only used once the broker has answered in that framing itself.
+        self._offer_envelope: bool = envelope
+        self._envelope: bool = False
+        self._broker_envelope: bool = False
+        self._shared_memory: int | None = shared_memory
+        self._shared: bool = False
+        self._compression: Compression | None = compression
+        self._tracer: ITracer | None = tracer
+        self._max_queue: int = max_queue
+        self._backpressure: Backpressure = backpressure or Backpressure()
+        assert self._backpressure.policy in POLICIES, f"Policy must be one of {POLICIES}"
         self._stop = threading.Event()
         self._threads: dict[str, Thread] = {}
         _threads: dict[str, Callable] = {
-            f"{self.name}|Listen": self.__listen,
             f"{self.name}|Handle": self.__handle,
             f"{self.name}|Send": self.__send,
         }
+        if self._socket is not None:
+            _threads[f"{self.name}|Listen"] = self.__listen
         for name, target in _threads.items():
             thread = Thread(target=target, name=name)
             self._threads[name] = thread
-        self._topics: dict[str, Queue] = {}
-        self._pending_requests: dict[UUID, Message] = {}
-        self._tx_queue: Queue[Message] = Queue()
-        self._rx_queue: Queue[Message] = Queue()
-        self.requests: Queue[Request] = Queue()
-        self.responses: dict[UUID, Response] = {}
-        self._executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=10)
+        # Correlation table: the Handle thread completes these directly when a
+        # Response, Pong or ACK arrives. Deadlines are kept in a heap so that
+        # abandoned entries can be expired without scanning the table.
+        self._pending_requests: dict[UUID, Future[Response]] = {}
+        self._deadlines: list[tuple[float, UUID]] = []
+        self._deadlines_lock = threading.Lock()
+        self._tx_queue: BoundedQueue[Message] = BoundedQueue(max_queue)
+        self._rx_queue: BoundedQueue[Message] = BoundedQueue(max_queue)
+        self.metrics = Metrics("pyaduct_client", {"name": self.name})
+        self._received = self.metrics.counter("received_total", "Messages received", "type")
+        self._sent = self.metrics.counter("sent_total", "Messages sent", "type")
+        self._dropped = self.metrics.counter("dropped_total", "Messages dropped", "reason")
+        self._timeouts = self.metrics.counter("timeouts_total", "Requests that timed out")
+        self._request_time = self.metrics.timer(
+            "request_seconds", "Time from each request to its response", "type"
+        )
+        self.metrics.gauge("rx_queue", "Messages waiting to be handled", self._rx_queue.qsize)
+        self.metrics.gauge("tx_queue", "Messages waiting to be sent", self._tx_queue.qsize)
+        self.metrics.gauge("requests", "Requests waiting to be answered", self.requests.qsize)
+        self.metrics.gauge(
+            "pending", "Requests waiting for a response", lambda: len(self._pending_requests)
+        )
+        self.metrics.gauge(
+            "subscription_queue",
+            "Events waiting to be taken from each subscription",
+            lambda: {topic: queue.qsize() for topic, queue in list(self._topics.items())},
+            "topic",
+        )
+        self.metrics.gauge(
+            "queue_high_water", "Most messages ever waiting in each queue", self.high_water, "queue"
+        )
+        # The socket is only ever touched by the Listen thread, see Broker.
+        if self._socket is not None:
+            outbox = f"inproc://{self.name}-outbox-{generate_random_md5()}"
+            self._outbox_rx: Socket = self._socket.context.socket(PAIR)
+            self._outbox_rx.bind(outbox)
+            self._outbox_tx: Socket = self._socket.context.socket(PAIR)
+            self._outbox_tx.connect(outbox)
+
+    def _init_name(
+        self,
+        name: str,
+        store: IMessageStore | None,
+        service: str | None,
+        balance: str,
+        max_queue: int,
+    ):
+        """The state of one client name, which a Session's clients keep for themselves."""
+        assert isinstance(name, str), "Name must be of type str"
+        self.name: str = name
+        self.store: IMessageStore | None = store
+        self.registered: bool = False
+        # Requests for the service are balanced over every client joining it.
+        self.service: str | None = service
+        self._balance: str = balance
+        # One queue per subscribed pattern; the trie maps incoming topics to them.
+        self._topics: dict[str, BoundedQueue] = {}
+        self._subscriptions: TopicTrie = TopicTrie()
+        self._subscriptions_lock = threading.Lock()
+        # Consumer group acks, sent in batches by ack() and the Handle thread.
+        self._acks: list[UUID] = []
+        self._acks_lock = threading.Lock()
+        self._ack_batch: int = ACK_BATCH
+        self.requests: BoundedQueue[Request] = BoundedQueue(max_queue)
 
     def start(self):
+        if self._broker is not None:
+            self._inproc_id = self._broker.connect_inproc(self._rx_queue)
         for thread in self._threads.values():
             thread.start()
         self._register()
@@ -82,24 +214,90 @@ class Client:
         self._stop.set()
         for thread in self._threads.values():
             thread.join()
+        for future in self._pending_requests.values():
+            future.cancel()
+        self._pending_requests.clear()
+        if self._broker is not None:
+            self._broker.disconnect_inproc(self._inproc_id)
+            return
+        self._outbox_tx.close(linger=0)
+        self._outbox_rx.close(linger=0)
         self._socket.close()
 
-    def subscribe(self, topic: str) -> Queue[Event]:
+    def profile(self, interval: float = profiling.INTERVAL) -> profiling.Profiler:
+        """A profiler of the client's threads, for a `with` block."""
+        return profiling.Profiler(self._threads.values(), interval)
+
+    def subscribe(
+        self,
+        topic: str,
+        offset: int | None = None,
+        since: datetime.datetime | None = None,
+        group: str | None = None,
+        prefetch: int = 100,
+        ack_timeout: float = 30.0,
+    ) -> Queue[Event]:
+        """Subscribe to a topic or a `*`/`#` wildcard pattern.
+
+        Subscribing to the same pattern again returns the existing queue.
+        If the broker keeps an event log, pass `offset` or `since` to have
+        the logged events replayed into the queue ahead of live ones.
+
+        Joining a consumer `group` shares the events with the other members:
+        each event arrives at only one of them and must be passed to ack()
+        once handled. At most `prefetch` events are held unacknowledged,
+        and events not acknowledged within `ack_timeout` seconds are
+        delivered again, possibly to another member.
+        """
         logger.info(f"{self.name} | Subscribing to topic: {topic}")
-        subscribe = Subscribe(source=self.name, topic=topic)
+        TopicTrie.validate(topic)
+        subscribe = Subscribe(
+            source=self.name,
+            topic=topic,
+            offset=offset,
+            since=since,
+            group=group,
+            prefetch=prefetch,
+            ack_timeout=ack_timeout,
+        )
+        if group is not None:
+            # Ack well before the window fills up, so that it never runs dry.
+            self._ack_batch = min(self._ack_batch, max(1, prefetch // 2))
+        if topic in self._topics:
+            self._sync_send(subscribe, 2)
+            return self._topics[topic]
+        # Create the queue first, events may follow the ACK immediately.
+        self._topics[topic] = BoundedQueue(self._max_queue)
+        with self._subscriptions_lock:
+            self._subscriptions.subscribe(topic, topic)
         try:
-            thread = Thread(target=self._sync_send, args=(subscribe, 2))
-            thread.start()
+            self._sync_send(subscribe, 2)
         except Exception as e:
             logger.error(f"{self.name} | Failed to subscribe: {e}")
+            with self._subscriptions_lock:
+                self._subscriptions.unsubscribe(topic, topic)
+            del self._topics[topic]
             raise e
-        self._topics[topic] = Queue()
         return self._topics[topic]
 
+    def unsubscribe(self, topic: str, group: str | None = None) -> None:
+        """Stop receiving events for a pattern previously passed to subscribe()."""
+        logger.info(f"{self.name} | Unsubscribing from topic: {topic}")
+        self._flush_acks()
+        unsubscribe = Unsubscribe(source=self.name, topic=topic, group=group)
+        self._sync_send(unsubscribe, 2)
+        with self._subscriptions_lock:
+            self._subscriptions.unsubscribe(topic, topic)
+        self._topics.pop(topic, None)
+
     def ping(self, target: str) -> bool:
         """Ping a target and wait for a PONG response."""
         ping = Ping(source=self.name, target=target)
-        if response := self._sync_send(ping, 2):
+        try:
+            response = self._sync_send(ping, 2)
+        except ResponseTimeout:
+            response = None
+        if response:
             if response.type == MessageType.PONG:
                 logger.success(f"{self.name} | PING successful to : {target}")
                 return True
@@ -119,20 +317,60 @@ class Client:
             logger.success(f"{self.name} | Found clients: {clients}")
             return [client.strip() for client in clients if client.strip()]
 
+    def get_stats(self) -> dict | None:
+        """The broker's metrics, as from `Metrics.snapshot`."""
+        command = Command(source=self.name, target="broker", body="STATS")
+        response = self._sync_send(command, 2)
+        if response and response.type == MessageType.RESPONSE:
+            return json.loads(response.body)
+
     def publish(self, event: Event):
         assert isinstance(event, Event), "Event must be of type Event"
-        self._tx_queue.put(event, block=False)
+        if self._tracer is not None:
+            self._trace(Stage.CLIENT_ENQUEUE, event)
+        self._offer(event)
+
+    def ack(self, *events: Event) -> None:
+        """Acknowledge events received through a consumer group.
+
+        Acks are batched: they are sent once enough have gathered, or
+        otherwise by the Handle thread within one poll interval.
+        """
+        with self._acks_lock:
+            self._acks.extend(event.id for event in events)
+            full = len(self._acks) >= self._ack_batch
+        if full:
+            self._flush_acks()
+
+    def _flush_acks(self):
+        if not self._acks:
+            return
+        with self._acks_lock:
+            acks, self._acks = self._acks, []
+        if acks:
+            self._tx_queue.force(EventAck(source=self.name, events=acks))
 
     def request(self, request: Request, timeout: int = 5) -> Response | None:
         assert isinstance(request, Request), "Request must be of type Request"
         if response := self._sync_send(request, timeout):
             return response
 
+    def submit(self, request: Request, timeout: int | None = None) -> Future[Response]:
+        """Send a request without blocking and return a Future for its Response.
+
+        The Future fails with ResponseTimeout once `timeout` (by default the
+        request's own timeout) has elapsed without a response.
+        """
+        assert isinstance(request, Request), "Request must be of type Request"
+        return self._submit(request, request.timeout if timeout is None else timeout)
+
     def generate_request(
         self,
         target: str,
         body: str,
         timeout: int = 5,
+        key: str | None = None,
+        payload: bytes | memoryview | None = None,
     ) -> Request:
         """Builds a Request so that the source is already populated."""
         return Request(
@@ -140,125 +378,270 @@ class Client:
             target=target,
             body=body,
             timeout=timeout,
+            key=key,
+            payload=payload,
         )
 
-    def generate_event(self, topic: str, body: str) -> Event:
-        """Builds an Event so that the source is already populated."""
-        return Event(source=self.name, topic=topic, body=body)
+    def generate_event(
+        self, topic: str, body: str, payload: bytes | memoryview | None = None
+    ) -> Event:
+        """Builds an Event so that the source is already populated.
+
+        A binary `payload` is sent as a frame of its own, without copies.
+        """
+        return Event(source=self.name, topic=topic, body=body, payload=payload)
 
-    def respond(self, request: Request, message: str) -> None:
+    def respond(
+        self, request: Request, message: str, payload: bytes | memoryview | None = None
+    ) -> None:
         response = Response(
             source=self.name,
             requestor=request.source,
             body=message,
             request_id=request.id,
+            payload=payload,
         )
-        self._tx_queue.put(response, block=False)
+        if self._tracer is not None:
+            self._trace(Stage.CLIENT_ENQUEUE, response)
+        self._offer(response)
 
     def _register(self):
         """Register with the broker."""
         timeout: int = 2
-        register = Register(source=self.name)
+        register = Register(
+            source=self.name,
+            codecs=self._offered_codecs,
+            envelope=self._offer_envelope,
+            service=self.service,
+            balance=self._balance,
+            host=shm.host_id() if self._shared_memory is not None else None,
+            compression=list(COMPRESSORS),
+            dictionaries=list(DICTIONARIES),
+        )
         if response := self._sync_send(register, timeout):
             if response.type == MessageType.ACK:
+                self._negotiated(response)
                 self.registered = True
                 logger.success(f"{self.name} | Registered with broker: {response.body}")
             else:
                 logger.error(f"{self.name} | Failed to register with broker: {response.body}")
                 raise ClientException("Failed to register with broker")
 
+    def _negotiated(self, ack: Response):
+        """Switch to the codec and framing the broker answered the Register with."""
+        # Brokers that predate codec negotiation answer with a plain "ACK".
+        if ack.body in self._offered_codecs and ack.body in CODECS:
+            self._codec = CODECS[ack.body]
+        self._envelope = self._offer_envelope and self._broker_envelope
+        self._shared = self._shared_memory is not None and getattr(ack, "shared_memory", False)
+
     def _sync_send(
-        self, message: Ping | Register | Request | Subscribe, timeout: int
+        self, message: Ping | Register | Request | Subscribe | Unsubscribe, timeout: int
     ) -> Response | None:
         """Synchronous send. Waits for response."""
-        future = self._executor.submit(self._sync_send_check, message)
-        response: Response | None = None
+        future = self._submit(message, timeout)
         try:
             response = future.result(timeout=timeout)
-            logger.success(f"{self.name} | Synchronous send successful: {message.id}")
+        except FutureTimeout:
+            self._pending_requests.pop(message.id, None)
+            logger.error(f"{self.name} | No response to {message.type.value}: {message.id}")
+            raise ResponseTimeout(f"No response to {message.id} within {timeout}s") from None
         except Exception as e:
-            logger.error(f"{self.name} | Failed to register: {e}")
+            logger.error(f"{self.name} | Synchronous send failed: {e}")
             raise e
+        logger.success(f"{self.name} | Synchronous send successful: {message.id}")
+        return response
+
+    def _submit(self, message: Message, timeout: float) -> Future[Response]:
+        """Register a Future for the message's reply, then queue the message."""
+        future: Future[Response] = Future()
+        self._pending_requests[message.id] = future
+        future.add_done_callback(
+            functools.partial(self._timed, message.type.value, time.perf_counter())
+        )
+        with self._deadlines_lock:
+            heapq.heappush(self._deadlines, (time.monotonic() + timeout, message.id))
+        if self._tracer is not None:
+            self._trace(Stage.CLIENT_ENQUEUE, message)
+        try:
+            self._offer(message)
+        except BackpressureError:
+            self._pending_requests.pop(message.id, None)
+            raise
+        return future
+
+    def _timed(self, kind: str, started: float, future: Future[Response]):
+        """Time an answered request; called by whichever thread completes it."""
+        if not future.cancelled() and future.exception() is None:
+            self._request_time.observe(time.perf_counter() - started, kind)
+
+    def _resolve(self, response: Response):
+        """Complete the Future waiting on this response, if there still is one."""
+        future = self._pending_requests.pop(response.request_id, None)
+        if future is None:
+            logger.debug(f"{self.name} | Dropping late response: {response.request_id}")
+            self._dropped.inc("late_response")
+            return
+        if response.type == MessageType.TIMEOUT:
+            self._timeouts.inc()
+            future.set_exception(ResponseTimeout(f"Broker timed out {response.request_id}"))
         else:
-            return response
-        finally:
-            # Cancel the future to avoid resource leaks
-            future.cancel()
+            future.set_result(response)
 
-    def _sync_send_check(self, message: Message) -> Response:
-        self._tx_queue.put(message, block=False)
-        while True:
-            if message.id in self.responses:
-                return self.responses.pop(message.id)
+    def _expire(self):
+        """Fail and forget correlation entries whose deadline has passed."""
+        now = time.monotonic()
+        with self._deadlines_lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, message_id = heapq.heappop(self._deadlines)
+                future = self._pending_requests.pop(message_id, None)
+                if future is not None and not future.done():
+                    self._timeouts.inc()
+                    future.set_exception(ResponseTimeout(f"No response to {message_id}"))
 
     def __listen(self):
-        """Listen for messages from the broker."""
+        """Sole owner of the socket; sleeps until either side has work."""
+        poller = Poller()
+        poller.register(self._socket, POLLIN)
+        poller.register(self._outbox_rx, POLLIN)
+        reading = True
         while not self._stop.is_set():
+            # Stop reading while the Handle thread is behind, see max_queue.
+            throttled = self._rx_queue.full()
+            if throttled == reading:
+                reading = not throttled
+                poller.register(self._socket, POLLIN if reading else 0)
+            events = dict(poller.poll((THROTTLE_TIMEOUT if throttled else POLL_TIMEOUT) * 1000))
+            if self._socket in events:
+                self.__receive_burst()
+            if self._outbox_rx in events:
+                self.__transmit_burst()
+
+    def __receive_burst(self):
+        """Listen for messages from the broker."""
+        for _ in range(BURST_SIZE):
             try:
-                text = self._socket.recv(flags=NOBLOCK)
+                frames = self._socket.recv_multipart(flags=NOBLOCK, copy=False)
             except Again:
+                return
+            frames = unpack_frames(frames)
+            if not frames:
                 continue
-            if not text:
-                continue
-            text = text.decode("utf-8")
-            message_type, model = text.split(" ", 1)
-            message = self.__cast_model(message_type, model)
-            self._rx_queue.put(message, block=False)
-            log = f"\n# {self.name} | RX: {message_type}\n"
-            log += f"{message.model_dump_json(indent=2)}"
-            logger.debug(log)
-
-    def __cast_model(self, message_type: str, model: str) -> Message:
-        if message_type == "RESPONSE":
-            return Response.model_validate_json(model)
-        elif message_type == "PONG":
-            return Pong.model_validate_json(model)
-        elif message_type == "EVENT":
-            return Event.model_validate_json(model)
-        elif message_type == "PING":
-            return Ping.model_validate_json(model)
-        elif message_type == "REQUEST":
-            return Request.model_validate_json(model)
-        elif message_type == "REGISTER":
-            return Register.model_validate_json(model)
-        elif message_type == "SUBSCRIBE":
-            return Subscribe.model_validate_json(model)
-        elif message_type == "ACK":
-            return ACK.model_validate_json(model)
-        else:
-            raise Exception(f"Client does not support message type: {type}")
+            if len(frames) > 1:
+                # [header, body, payload?]; the header only matters to the broker.
+                self._broker_envelope = True
+                message = decode(frames[1])
+                if (member := member_of(frames[0])) is not None:
+                    message = message.model_copy(update={"member": member})
+                if len(frames) > 2:
+                    payload, segment = receive_payload(frames)
+                    message = message.model_copy(update={"payload": payload})
+                    if segment is not None:
+                        release = Release(source=self.name, segments=[segment])
+                        self._tx_queue.force(release)
+            else:
+                message = decode(frames[0])
+            if self._tracer is not None:
+                self._trace(Stage.CLIENT_RX, message)
+            self._rx_queue.force(message)
+            logger.opt(lazy=True).debug(
+                "\n# {} | RX: {}\n{}",
+                lambda: self.name,
+                lambda m=message: m.type.value,
+                lambda m=message: m.model_dump_json(indent=2),
+            )
+
+    def __transmit_burst(self):
+        for _ in range(BURST_SIZE):
+            try:
+                frames = self._outbox_rx.recv_multipart(flags=NOBLOCK, copy=False)
+            except Again:
+                return
+            self._socket.send_multipart(frames, copy=False)
 
     def __handle(self):
         """Handle incoming messages."""
         while not self._stop.is_set():
-            if self._rx_queue.empty():
-                continue
-            message = self._rx_queue.get(block=False)
-            assert isinstance(message, Message)
-            if message.type == MessageType.PONG:
-                assert isinstance(message, Pong)
-                self.responses[message.request_id] = message
-            elif message.type == MessageType.EVENT:
-                assert isinstance(message, Event)
-                if message.topic in self._topics:
-                    self._topics[message.topic].put(message, block=False)
-            elif message.type == MessageType.PING:
-                assert isinstance(message, Ping)
-                pong = self._generate_pong(message)
-                self._tx_queue.put(pong, block=False)
-            elif message.type == MessageType.REQUEST:
-                assert isinstance(message, Request)
-                self.requests.put(message, block=False)
-            elif message.type == MessageType.RESPONSE:
-                assert isinstance(message, Response)
-                self.responses[message.request_id] = message
-            elif message.type == MessageType.ACK:
-                assert isinstance(message, Response)
-                self.responses[message.request_id] = message
-            else:
-                raise Exception(f"Client does not support message type: {message.type}")
-            if self.store is not None:
-                self.store.add_rx_message(message)
+            for message in drain_queue(self._rx_queue):
+                self._received.inc(message.type.value)
+                if self._tracer is None:
+                    self._handle_message(message)
+                    continue
+                # Inproc clients have no Listen thread to stamp what they receive.
+                if self._broker is not None:
+                    self._trace(Stage.CLIENT_RX, message)
+                self._handle_message(message)
+                self._trace(Stage.HANDLED, message)
+            if self._deadlines:
+                self._expire()
+            self._flush_acks()
+
+    def _trace(self, stage: Stage, message: Message):
+        ref = getattr(message, "request_id", None)
+        tracing.stamp(self._tracer, stage, self.name, message.id, ref)
+
+    def _handle_message(self, message: Message):
+        assert isinstance(message, Message)
+        if message.type == MessageType.PONG:
+            assert isinstance(message, Pong)
+            self._resolve(message)
+        elif message.type == MessageType.EVENT:
+            assert isinstance(message, Event)
+            with self._subscriptions_lock:
+                patterns = self._subscriptions.match(message.topic)
+            for pattern in patterns:
+                if (queue := self._topics.get(pattern)) is not None:
+                    self._deliver(queue, message, "subscription_full")
+        elif message.type == MessageType.PING:
+            assert isinstance(message, Ping)
+            pong = self._generate_pong(message)
+            self._tx_queue.force(pong)
+        elif message.type == MessageType.REQUEST:
+            assert isinstance(message, Request)
+            self._deliver(self.requests, message, "requests_full")
+        elif message.type == MessageType.RESPONSE:
+            assert isinstance(message, Response)
+            self._resolve(message)
+        elif message.type == MessageType.ACK:
+            assert isinstance(message, Response)
+            self._resolve(message)
+        elif message.type == MessageType.TIMEOUT:
+            assert isinstance(message, Timeout)
+            self._resolve(message)
+        else:
+            raise Exception(f"Client does not support message type: {message.type}")
+        if self.store is not None:
+            self.store.add_rx_message(message)
+
+    def _deliver(self, queue: Queue, message: Message, reason: str):
+        """Hand a message to the application, dropping it if its queue is full."""
+        try:
+            queue.put(message, block=False)
+        except Full:
+            logger.warning(f"{self.name} | Dropping {message.id}: its queue is full")
+            self._dropped.inc(reason)
+
+    def _offer(self, message: Message):
+        """Queue a message to send, as the backpressure policy says when the queue is full."""
+        try:
+            self._tx_queue.offer(message, self._backpressure)
+        except Full:
+            limit = self._tx_queue.maxsize
+            raise BackpressureError(
+                f"Send queue is full at {limit} messages: {message.id}"
+            ) from None
+
+    def high_water(self) -> dict[str, int]:
+        """The most messages each queue has held: rx, tx, requests and each subscription."""
+        marks = {"rx": self._rx_queue.high_water, "tx": self._tx_queue.high_water}
+        marks["requests"] = self.requests.high_water
+        for topic, queue in list(self._topics.items()):
+            marks[topic] = queue.high_water
+        return marks
+
+    def _shares(self, payload: bytes | memoryview) -> bool:
+        """Whether to send a payload through shared memory."""
+        return self._shared and memoryview(payload).nbytes >= self._shared_memory
 
     def _generate_pong(self, ping: Ping) -> Pong:
         """Generate a PONG message from a PING message."""
@@ -271,14 +654,53 @@ class Client:
     def __send(self):
         """Send messages to the broker."""
         while not self._stop.is_set():
-            if self._tx_queue.empty():
-                continue
-            message = self._tx_queue.get(block=False)
-            assert isinstance(message, Message)
-            frame = f"{message.type.value} {message.model_dump_json()}"
-            self._socket.send_string(frame)
-            log = f"\n# {self.name} | TX: {message.type.value}\n"
-            log += f"{message.model_dump_json(indent=2)}"
-            logger.debug(log)
+            for message in drain_queue(self._tx_queue):
+                try:
+                    self._send_message(message)
+                except Exception as e:
+                    # One message that cannot be sent must not stop the thread.
+                    logger.error(f"{self.name} | Failed to send {message.id}: {e}")
+                    self._dropped.inc("send_error")
+                    if (future := self._pending_requests.pop(message.id, None)) is not None:
+                        future.set_exception(ClientException(f"Failed to send {message.id}: {e}"))
+
+    def _send_message(self, message: Message):
+        assert isinstance(message, Message)
+        if self._broker is not None:
+            if self._tracer is not None:
+                self._trace(Stage.CLIENT_TX, message)
+            self._broker.receive_inproc(self._inproc_id, message)
+            self._sent.inc(message.type.value)
             if self.store is not None:
                 self.store.add_tx_message(message)
+            return
+        body = self._codec.encode(message)
+        if self._envelope:
+            if self._compression is not None:
+                body = self._compression.compress(body, getattr(message, "topic", None))
+            header, payload = Header.from_message(message), message.payload
+            if payload is not None and self._shares(payload):
+                header, payload = share_payload(header, payload)
+            frames = [header.encode(), body]
+            if payload is not None:
+                frames.append(payload)
+            if self._tracer is not None:
+                self._trace(Stage.CLIENT_TX, message)
+            self._outbox_tx.send_multipart(frames, copy=False)
+        elif message.payload is not None:
+            logger.error(f"{self.name} | Payloads need the header framing: {message.id}")
+            self._dropped.inc("payload")
+            return
+        else:
+            if self._tracer is not None:
+                self._trace(Stage.CLIENT_TX, message)
+            self._outbox_tx.send(body)
+        self._sent.inc(message.type.value)
+        logger.opt(lazy=True).debug(
+            "\n# {} | TX: {}\n{}",
+            lambda: self.name,
+            lambda: message.type.value,
+            lambda: message.model_dump_json(indent=2),
+        )
+        if self.store is not None:
+            self.store.add_tx_message(message)
@@ -0,0 +1,282 @@
+import datetime
+import struct
+import types
+from typing import Callable, Protocol, Union, get_args, get_origin, runtime_checkable
+from uuid import UUID
+
+from .compression import decompress, is_compressed
+from .models import MESSAGE_MODELS, Message, MessageType
+
+
+class CodecError(Exception):
+    """Raised when a frame cannot be encoded or decoded."""
+
+
+@runtime_checkable
+class ICodec(Protocol):
+    name: str
+
+    def encode(self, message: Message) -> bytes:
+        """Serialize a message into a single wire frame."""
+        ...
+
+    def decode(self, frame: bytes) -> Message:
+        """Deserialize a wire frame produced by `encode`."""
+        ...
+
+
+class JsonCodec(ICodec):
+    """The original `TYPE {json}` text frame, understood by every client."""
+
+    name: str = "json"
+
+    def encode(self, message: Message) -> bytes:
+        return f"{message.type.value} {message.model_dump_json()}".encode("utf-8")
+
+    def decode(self, frame: bytes) -> Message:
+        message_type, model = frame.split(b" ", 1)
+        try:
+            cls = MESSAGE_MODELS[MessageType(message_type.decode("utf-8"))]
+        except ValueError:
+            raise CodecError(f"Unknown message type: {message_type!r}") from None
+        return cls.model_validate_json(model)
+
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+_PREFIX = struct.Struct("<cB")
+_U32 = struct.Struct("<I")
+
+# Fixed-size fields are packed together with a single struct per model.
+_FIXED: dict[type, str] = {
+    int: "q",
+    float: "d",
+    bool: "?",
+    UUID: "16s",
+    datetime.datetime: "q",
+}
+
+# (encode(value, parts), decode(frame, offset) -> (value, offset)) for
+# the rare optional and list fields that do not fit the fixed layout.
+_FieldCodec = tuple[Callable[[object, list], None], Callable[[bytes, int], tuple[object, int]]]
+
+
+def _encode_str(value, parts: list):
+    data = value.encode("utf-8")
+    parts.append(_U32.pack(len(data)))
+    parts.append(data)
+
+
+def _decode_str(frame: bytes, offset: int):
+    (size,) = _U32.unpack_from(frame, offset)
+    offset += 4
+    return str(frame[offset : offset + size], "utf-8"), offset + size
+
+
+def _scalar(annotation) -> _FieldCodec:
+    if annotation is str:
+        return _encode_str, _decode_str
+    if annotation not in _FIXED:
+        raise CodecError(f"Binary codec cannot encode fields of type {annotation}")
+    packer = struct.Struct("<" + _FIXED[annotation])
+    to_wire = _to_wire(annotation)
+    from_wire = _from_wire(annotation)
+
+    def encode(value, parts: list):
+        parts.append(packer.pack(to_wire(value)))
+
+    def decode(frame: bytes, offset: int):
+        return from_wire(packer.unpack_from(frame, offset)[0]), offset + packer.size
+
+    return encode, decode
+
+
+def _to_wire(annotation) -> Callable:
+    if annotation is UUID:
+        return lambda value: value.bytes
+    if annotation is datetime.datetime:
+        return _micros
+    return lambda value: value
+
+
+def _micros(value: datetime.datetime) -> int:
+    # Naive datetimes are local time, as datetime.timestamp() takes them.
+    if value.tzinfo is None:
+        value = value.astimezone(datetime.timezone.utc)
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def _from_wire(annotation) -> Callable:
+    if annotation is UUID:
+        return lambda value: UUID(bytes=value)
+    if annotation is datetime.datetime:
+        return lambda value: _EPOCH + datetime.timedelta(microseconds=value)
+    return lambda value: value
+
+
+def _optional(inner: _FieldCodec) -> _FieldCodec:
+    encode, decode = inner
+
+    def encode_optional(value, parts: list):
+        if value is None:
+            parts.append(b"\x00")
+        else:
+            parts.append(b"\x01")
+            encode(value, parts)
+
+    def decode_optional(frame: bytes, offset: int):
+        if frame[offset] == 0:
+            return None, offset + 1
+        return decode(frame, offset + 1)
+
+    return encode_optional, decode_optional
+
+
+def _sequence(inner: _FieldCodec) -> _FieldCodec:
+    encode, decode = inner
+
+    def encode_sequence(value, parts: list):
+        parts.append(_U32.pack(len(value)))
+        for item in value:
+            encode(item, parts)
+
+    def decode_sequence(frame: bytes, offset: int):
+        (count,) = _U32.unpack_from(frame, offset)
+        offset += 4
+        items = []
+        for _ in range(count):
+            item, offset = decode(frame, offset)
+            items.append(item)
+        return items, offset
+
+    return encode_sequence, decode_sequence
+
+
+def _field_codec(annotation) -> _FieldCodec:
+    origin = get_origin(annotation)
+    args = get_args(annotation)
+    if origin in (Union, types.UnionType) and len(args) == 2 and type(None) in args:
+        inner = args[0] if args[1] is type(None) else args[1]
+        return _optional(_field_codec(inner))
+    if origin in (list, tuple, set) and args:
+        return _sequence(_field_codec(args[0]))
+    return _scalar(annotation)
+
+
+class _Plan:
+    """Field layout of one message model: fixed struct, strings, then the rest."""
+
+    def __init__(self, code: int, model: type[Message]):
+        self.code = code
+        self.model = model
+        self.fixed: list[str] = []
+        self.strings: list[str] = []
+        self.other: list[tuple[str, _FieldCodec]] = []
+        for name, field in model.model_fields.items():
+            # Excluded fields, like the payload, travel outside the body.
+            if name == "type" or field.exclude:
+                continue
+            if field.annotation in _FIXED:
+                self.fixed.append(name)
+            elif field.annotation is str:
+                self.strings.append(name)
+            else:
+                self.other.append((name, _field_codec(field.annotation)))
+        annotations = [model.model_fields[name].annotation for name in self.fixed]
+        self.fixed_struct = struct.Struct("<" + "".join(_FIXED[a] for a in annotations))
+        self.to_wire = [_to_wire(a) for a in annotations]
+        self.datetimes = [
+            name
+            for name, annotation in zip(self.fixed, annotations, strict=True)
+            if annotation is datetime.datetime
+        ]
+        self.lengths_struct = struct.Struct(f"<{len(self.strings)}I")
+
+
+class BinaryCodec(ICodec):
+    """Compact struct framing.
+
+    After a two byte prefix (magic, type code) come the model's fixed-size
+    fields packed with one struct, the lengths of its string fields, the
+    UTF-8 string data and finally any optional or list fields. Strings are
+    therefore sliced out without per-field parsing, and pydantic only has
+    to check already-typed values.
+    """
+
+    name: str = "binary"
+    MAGIC: bytes = b"\xb1"
+
+    def __init__(self):
+        # Type codes follow MessageType declaration order; new types are appended.
+        self._plans: dict[MessageType, _Plan] = {}
+        self._by_code: dict[int, _Plan] = {}
+        for code, message_type in enumerate(MessageType):
+            if message_type in MESSAGE_MODELS:
+                plan = _Plan(code, MESSAGE_MODELS[message_type])
+                self._plans[message_type] = plan
+                self._by_code[code] = plan
+
+    def encode(self, message: Message) -> bytes:
+        plan = self._plans[message.type]
+        fixed = [f(getattr(message, n)) for f, n in zip(plan.to_wire, plan.fixed, strict=True)]
+        strings = [getattr(message, name).encode("utf-8") for name in plan.strings]
+        parts = [
+            _PREFIX.pack(self.MAGIC, plan.code),
+            plan.fixed_struct.pack(*fixed),
+            plan.lengths_struct.pack(*map(len, strings)),
+            *strings,
+        ]
+        for name, (encode, _) in plan.other:
+            encode(getattr(message, name), parts)
+        return b"".join(parts)
+
+    def decode(self, frame: bytes) -> Message:
+        magic, code = _PREFIX.unpack_from(frame, 0)
+        if magic != self.MAGIC or code not in self._by_code:
+            raise CodecError("Frame is not a binary encoded message")
+        plan = self._by_code[code]
+        offset = _PREFIX.size
+        fields: dict[str, object] = dict(
+            zip(plan.fixed, plan.fixed_struct.unpack_from(frame, offset), strict=True)
+        )
+        # UUIDs are handed to pydantic as raw bytes, it converts them natively.
+        for name in plan.datetimes:
+            fields[name] = _EPOCH + datetime.timedelta(microseconds=fields[name])
+        offset += plan.fixed_struct.size
+        lengths = plan.lengths_struct.unpack_from(frame, offset)
+        offset += plan.lengths_struct.size
+        for name, size in zip(plan.strings, lengths, strict=True):
+            fields[name] = str(frame[offset : offset + size], "utf-8")
+            offset += size
+        for name, (_, decode) in plan.other:
+            fields[name], offset = decode(frame, offset)
+        return plan.model.model_validate(fields)
+
+
+JSON_CODEC = JsonCodec()
+BINARY_CODEC = BinaryCodec()
+
+CODECS: dict[str, ICodec] = {
+    JSON_CODEC.name: JSON_CODEC,
+    BINARY_CODEC.name: BINARY_CODEC,
+}
+
+
+def negotiate(offered: list[str]) -> ICodec:
+    """Pick the first codec in the client's preference list that we support."""
+    for name in offered:
+        if name in CODECS:
+            return CODECS[name]
+    return JSON_CODEC
+
+
+def decode(frame: bytes) -> Message:
+    """Decode a frame from any supported codec; binary frames start with a magic byte.
+
+    Compressed frames are decompressed first.
+    """
+    if is_compressed(frame):
+        frame = decompress(frame)
+    if frame[:1] == BinaryCodec.MAGIC:
+        return BINARY_CODEC.decode(frame)
+    return JSON_CODEC.decode(frame)
@@ -0,0 +1,191 @@
+import lzma
+import struct
+import zlib
+from typing import Iterable, Protocol, runtime_checkable
+
+from .topics import TopicTrie
+
+
+class CompressionError(ValueError):
+    """Raised for unknown compressors or dictionaries."""
+
+
+@runtime_checkable
+class ICompressor(Protocol):
+    name: str
+    code: int
+    # Whether `compress` uses a preset dictionary when given one.
+    dictionaries: bool
+
+    def compress(self, data: bytes, dictionary: bytes | None, level: int | None) -> bytes:
+        """Compress data, with a preset dictionary if the compressor supports one."""
+        ...
+
+    def decompress(self, data: bytes, dictionary: bytes | None) -> bytes:
+        """Undo `compress` with the same dictionary."""
+        ...
+
+
+class ZlibCompressor(ICompressor):
+    """Fast, with preset dictionaries for small bodies."""
+
+    name: str = "zlib"
+    code: int = 1
+    dictionaries: bool = True
+    # Compressors already primed with a dictionary, copied for each body:
+    # priming one costs more than compressing a small body. The smaller
+    # memLevel keeps each copy cheap to allocate, at no measurable cost in
+    # size for small bodies.
+    _MEM_LEVEL: int = 6
+
+    def __init__(self):
+        self._primed: dict[tuple[bytes, int], "zlib._Compress"] = {}
+
+    def compress(self, data: bytes, dictionary: bytes | None, level: int | None) -> bytes:
+        level = -1 if level is None else level
+        if dictionary is None:
+            return zlib.compress(data, level)
+        primed = self._primed.get((dictionary, level))
+        if primed is None:
+            primed = zlib.compressobj(
+                level, zlib.DEFLATED, zlib.MAX_WBITS, self._MEM_LEVEL, zdict=dictionary
+            )
+            self._primed[(dictionary, level)] = primed
+        compressor = primed.copy()
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data: bytes, dictionary: bytes | None) -> bytes:
+        if dictionary is None:
+            decompressor = zlib.decompressobj()
+        else:
+            decompressor = zlib.decompressobj(zdict=dictionary)
+        return decompressor.decompress(data) + decompressor.flush()
+
+
+class LzmaCompressor(ICompressor):
+    """Smaller and much slower; has no preset dictionaries."""
+
+    name: str = "lzma"
+    code: int = 2
+    dictionaries: bool = False
+
+    def compress(self, data: bytes, dictionary: bytes | None, level: int | None) -> bytes:
+        return lzma.compress(data, format=lzma.FORMAT_XZ, preset=level)
+
+    def decompress(self, data: bytes, dictionary: bytes | None) -> bytes:
+        return lzma.decompress(data, format=lzma.FORMAT_XZ)
+
+
+COMPRESSORS: dict[str, ICompressor] = {
+    compressor.name: compressor for compressor in (ZlibCompressor(), LzmaCompressor())
+}
+_BY_CODE: dict[int, ICompressor] = {c.code: c for c in COMPRESSORS.values()}
+
+# A compressed body frame: magic, compressor code, dictionary id (0 for
+# none), then the compressed body in its codec.
+MAGIC: bytes = b"\xc7"
+_FRAME = struct.Struct("<cBI")
+
+# Preset dictionaries known to this process, by id. Every party that
+# compresses or decompresses with one must have added it.
+DICTIONARIES: dict[int, bytes] = {}
+# zlib only looks this far back.
+MAX_DICTIONARY: int = 32 * 1024
+
+
+def add_dictionary(dictionary: bytes) -> int:
+    """Make a preset dictionary known, returning its id."""
+    dictionary_id = zlib.crc32(dictionary) or 1
+    DICTIONARIES[dictionary_id] = dictionary
+    return dictionary_id
+
+
+def train(samples: Iterable[bytes], size: int = MAX_DICTIONARY) -> bytes:
+    """A preset dictionary from sample bodies.
+
+    Distinct samples are concatenated, latest last, keeping the last
+    `size` bytes: zlib matches nearer the end of the dictionary with
+    fewer bits, and repetitive bodies share most of their bytes with any
+    recent sample.
+    """
+    distinct = dict.fromkeys(samples)
+    return b"".join(distinct)[-size:]
+
+
+def is_compressed(frame: bytes) -> bool:
+    return frame[:1] == MAGIC
+
+
+def compression_of(frame: bytes) -> tuple[str, int]:
+    """Compressor name and dictionary id of a compressed body frame."""
+    _, code, dictionary_id = _FRAME.unpack_from(frame)
+    if code not in _BY_CODE:
+        raise CompressionError(f"Unknown compressor code: {code}")
+    return _BY_CODE[code].name, dictionary_id
+
+
+def compress(
+    body: bytes, compressor: ICompressor, dictionary_id: int = 0, level: int | None = None
+) -> bytes:
+    dictionary = DICTIONARIES[dictionary_id] if dictionary_id else None
+    header = _FRAME.pack(MAGIC, compressor.code, dictionary_id)
+    return header + compressor.compress(body, dictionary, level)
+
+
+def decompress(frame: bytes) -> bytes:
+    """The body inside a compressed body frame."""
+    name, dictionary_id = compression_of(frame)
+    dictionary = None
+    if dictionary_id:
+        if dictionary_id not in DICTIONARIES:
+            raise CompressionError(f"Unknown compression dictionary: {dictionary_id}")
+        dictionary = DICTIONARIES[dictionary_id]
+    return COMPRESSORS[name].decompress(frame[_FRAME.size :], dictionary)
+
+
+class Compression:
+    """How a client compresses the bodies it sends.
+
+    Bodies of at least `threshold` bytes are compressed with `algorithm`,
+    unless that does not make them smaller. `dictionaries` maps topic
+    patterns to preset dictionaries, see `train`, for events on matching
+    topics; they only apply to zlib.
+    """
+
+    def __init__(
+        self,
+        algorithm: str = "zlib",
+        threshold: int = 1024,
+        level: int | None = None,
+        dictionaries: dict[str, bytes] | None = None,
+    ):
+        if algorithm not in COMPRESSORS:
+            raise CompressionError(f"Unknown compressor: {algorithm!r}")
+        self.compressor: ICompressor = COMPRESSORS[algorithm]
+        self.threshold = threshold
+        self.level = level
+        self._dictionaries: dict[str, int] = {}
+        self._topics = TopicTrie()
+        for pattern, dictionary in (dictionaries or {}).items():
+            self._dictionaries[pattern] = add_dictionary(dictionary)
+            self._topics.subscribe(pattern, pattern)
+
+    def dictionary_for(self, topic: str | None) -> int:
+        """The id of the dictionary for a topic, 0 if there is none."""
+        if topic is None or not self._dictionaries:
+            return 0
+        patterns = self._topics.match(topic)
+        return self._dictionaries[min(patterns)] if patterns else 0
+
+    def compress(self, body: bytes, topic: str | None = None) -> bytes:
+        if len(body) < self.threshold:
+            return body
+        dictionary_id = self.dictionary_for(topic) if self.compressor.dictionaries else 0
+        compressed = compress(body, self.compressor, dictionary_id, self.level)
+        return compressed if len(compressed) < len(body) else body
+
+
+def accepts(frame: bytes, compressors: set[str], dictionaries: set[int]) -> bool:
+    """Whether a receiver that declared these can take a compressed body frame."""
+    name, dictionary_id = compression_of(frame)
+    return name in compressors and (not dictionary_id or dictionary_id in dictionaries)
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from uuid import UUID
+
+from loguru import logger
+
+from .wire import Envelope
+
+# Events a group holds while every member's window is full; the oldest are
+# dropped beyond this.
+MAX_BACKLOG: int = 100_000
+
+Delivery = tuple[Envelope, bytes]
+
+
+class _Member:
+    __slots__ = ("name", "client_id", "prefetch", "ack_timeout", "unacked")
+
+    def __init__(self, name: str, client_id: bytes, prefetch: int, ack_timeout: float):
+        self.name = name
+        self.client_id = client_id
+        self.prefetch = prefetch
+        self.ack_timeout = ack_timeout
+        # Delivered and not yet acknowledged, oldest first, with their deadlines.
+        self.unacked: OrderedDict[UUID, tuple[Envelope, float]] = OrderedDict()
+
+    @property
+    def credit(self) -> int:
+        return self.prefetch - len(self.unacked)
+
+
+class ConsumerGroup:
+    """Competing consumers sharing the events of the patterns bound to a group.
+
+    Each event goes to one member with room in its prefetch window, taking
+    turns, and counts against that window until the member acknowledges
+    it. Events that are not acknowledged within the member's `ack_timeout`,
+    or that a leaving member still holds, are delivered again to another
+    member, so delivery is at least once. Methods return the deliveries
+    to send; they may be called from the Handle and Watch threads.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.members: dict[str, _Member] = {}
+        self.backlog: deque[Envelope] = deque()
+        self._turn = 0
+        self._lock = threading.Lock()
+
+    def join(
+        self, name: str, client_id: bytes, prefetch: int, ack_timeout: float
+    ) -> list[Delivery]:
+        """Add a member, or replace one that came back under a new identity."""
+        with self._lock:
+            member = self.members.get(name)
+            if member is not None and member.client_id != client_id:
+                # It restarted, and lost whatever it held.
+                self._requeue(member, list(member.unacked))
+                member = None
+            if member is None:
+                member = self.members[name] = _Member(name, client_id, prefetch, ack_timeout)
+            member.prefetch = max(1, prefetch)
+            member.ack_timeout = ack_timeout
+            return self._dispatch()
+
+    def leave(self, name: str) -> list[Delivery]:
+        with self._lock:
+            if (member := self.members.pop(name, None)) is None:
+                return []
+            self._requeue(member, list(member.unacked))
+            return self._dispatch()
+
+    def offer(self, envelope: Envelope) -> list[Delivery]:
+        with self._lock:
+            self.backlog.append(envelope)
+            if len(self.backlog) > MAX_BACKLOG:
+                dropped = self.backlog.popleft()
+                logger.warning(f"Group {self.name} backlog full, dropped {dropped.header.id}")
+            return self._dispatch()
+
+    def ack(self, name: str, event_ids: list[UUID]) -> list[Delivery]:
+        with self._lock:
+            if (member := self.members.get(name)) is None:
+                return []
+            for event_id in event_ids:
+                member.unacked.pop(event_id, None)
+            return self._dispatch()
+
+    def expire(self) -> list[Delivery]:
+        """Take back events whose acknowledgement is overdue."""
+        now = time.monotonic()
+        with self._lock:
+            for member in self.members.values():
+                overdue = []
+                for event_id, (_, deadline) in member.unacked.items():
+                    if deadline > now:
+                        break
+                    overdue.append(event_id)
+                if overdue:
+                    logger.warning(f"{member.name} did not ack {len(overdue)} events in time")
+                    self._requeue(member, overdue)
+            return self._dispatch() if self.backlog else []
+
+    def _requeue(self, member: _Member, event_ids: list[UUID]):
+        # Redeliveries go first, ahead of events that were never delivered.
+        for event_id in reversed(event_ids):
+            envelope, _ = member.unacked.pop(event_id)
+            self.backlog.appendleft(envelope)
+
+    def _dispatch(self) -> list[Delivery]:
+        deliveries = []
+        members = list(self.members.values())
+        now = time.monotonic()
+        while self.backlog and members:
+            ready = [m for m in members if m.credit > 0]
+            if not ready:
+                break
+            for member in ready[self._turn % len(ready) :] + ready[: self._turn % len(ready)]:
+                if not self.backlog:
+                    break
+                envelope = self.backlog.popleft()
+                member.unacked[envelope.header.id] = (envelope, now + member.ack_timeout)
+                deliveries.append((envelope.for_member(member.name), member.client_id))
+            self._turn += 1
+        return deliveries
+
+    def __len__(self) -> int:
+        return len(self.backlog) + sum(len(m.unacked) for m in self.members.values())
+
+    def __repr__(self) -> str:
+        members = len(self.members)
+        return f"<ConsumerGroup(name={self.name!r}, members={members}, events={len(self)})>"
@@ -2,6 +2,7 @@ from zmq import DEALER, ROUTER, Context
 
 from .broker import Broker
 from .client import Client
+from .session import Session
 from .store import InmemMessageStore
 
 
@@ -20,16 +21,43 @@ class BrokerFactory:
 
 class ClientFactory:
     @classmethod
-    def generate_ipc_client(cls, client_name: str) -> Client:
-        """Generate an IPC client with the given name."""
+    def generate_ipc_client(
+        cls,
+        client_name: str,
+        address: str = "ipc://pyaduct",
+        context: Context | None = None,
+        store: bool = True,
+    ) -> Client:
+        """Generate an IPC client with the given name.
+
+        Many clients in one process should share a `context`, and clients
+        that run for long under load can do without a `store`.
+        """
+        assert isinstance(client_name, str), "Client name must be a string"
+        context = context or Context()
+        socket = context.socket(DEALER)
+        socket.connect(address)
+        client = Client(socket, store=InmemMessageStore() if store else None, name=client_name)
+        return client
+
+    @classmethod
+    def generate_inproc_client(cls, broker: Broker, client_name: str) -> Client:
+        """Generate a client in the broker's process, exchanging messages by reference."""
         assert isinstance(client_name, str), "Client name must be a string"
+        store = InmemMessageStore()
+        client = Client(broker, store=store, name=client_name)
+        return client
+
+    @classmethod
+    def generate_ipc_session(cls) -> Session:
+        """Generate an IPC session to host many clients on one socket."""
         context = Context()
         socket = context.socket(DEALER)
         store = InmemMessageStore()
         address = "ipc://pyaduct"
         socket.connect(address)
-        client = Client(socket, store=store, name=client_name)
-        return client
+        session = Session(socket, store=store)
+        return session
 
 
 class PyaductFactory:
@@ -41,6 +69,14 @@ class PyaductFactory:
         client_2 = ClientFactory.generate_ipc_client("client_2")
         return broker, client_1, client_2
 
+    @classmethod
+    def generate_inproc_nodes(cls) -> tuple[Broker, Client, Client]:
+        """Generate a broker and two clients that share its process."""
+        broker = BrokerFactory.generate_ipc_broker()
+        client_1 = ClientFactory.generate_inproc_client(broker, "client_1")
+        client_2 = ClientFactory.generate_inproc_client(broker, "client_2")
+        return broker, client_1, client_2
+
     @classmethod
     def generate_demo_ipc_nodes(cls) -> tuple[Broker, Client, Client]:
         """Generate a demo system with a broker and two clients."""
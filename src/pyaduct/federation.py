@@ -0,0 +1,182 @@
+import time
+from collections import OrderedDict
+from uuid import UUID
+
+from loguru import logger
+from zmq import Socket
+
+from .broker import Broker
+from .codec import BINARY_CODEC, JSON_CODEC, negotiate
+from .compression import COMPRESSORS, DICTIONARIES
+from .models import (
+    ACK,
+    Announce,
+    MessageType,
+    Register,
+    Subscribe,
+    Unsubscribe,
+)
+from .topics import TopicTrie
+from .utils import generate_random_md5
+from .wire import Envelope
+
+# How many routed message ids to remember for dropping copies that loop back.
+MAX_SEEN: int = 100_000
+
+
+class FederatedBroker(Broker):
+    """A Broker that routes to clients of the brokers it peers with.
+
+    Every broker floods an Announce of its own clients and subscription
+    patterns to its peers whenever they change. Peers keep the newest
+    version per origin broker, pass newer ones on to their other peers and
+    remember which peer it came from as the next hop towards that origin,
+    so the brokers may be connected in any topology, loops included.
+    Requests and responses for remote clients go to the next hop of the
+    client's broker, and events only to next hops of brokers with a
+    matching subscription. Each broker handles a given message once and
+    never sends it back where it came from, which ends routing loops.
+    """
+
+    def __init__(self, socket: Socket, node: str | None = None, **kwargs):
+        super().__init__(socket, **kwargs)
+        self.node: str = node or generate_random_md5()
+        self._peers: set[bytes] = set()
+        self._announcement: Announce | None = None
+        self._states: dict[str, Announce] = {}
+        self._next_hop: dict[str, bytes] = {}
+        self._remote_clients: dict[str, str] = {}
+        self._remote_topics: TopicTrie = TopicTrie()
+        self._seen: OrderedDict[UUID, None] = OrderedDict()
+        self._handlers[MessageType.ANNOUNCE] = self._handle_announce
+        # Peers ACK our Register, and fail requests for their clients with a
+        # Timeout; clients never send either.
+        self._routes[MessageType.ACK] = self._handle_response
+        self._routes[MessageType.TIMEOUT] = self._handle_response
+
+    def add_peer(self, socket: Socket):
+        """Peer with the broker that a connected DEALER socket points at."""
+        link_id = self.add_link(socket)
+        self._codecs[link_id] = BINARY_CODEC
+        self._envelopes.add(link_id)
+        register = Register(
+            source=self.node,
+            codecs=[BINARY_CODEC.name, JSON_CODEC.name],
+            envelope=True,
+            peer=True,
+            compression=list(COMPRESSORS),
+            dictionaries=list(DICTIONARIES),
+        )
+        # Forced like the clients' control messages: a full queue must not lose it.
+        self._tx_queue.force((Envelope.from_message(register), link_id))
+
+    def _handle_register(self, register: Register, client_id: bytes):
+        if not register.peer:
+            known = register.source in self.clients
+            super()._handle_register(register, client_id)
+            if not known:
+                self._announce()
+            return
+        logger.info(f"Peering with broker {register.source}")
+        codec = negotiate(register.codecs)
+        self._codecs[client_id] = codec
+        self._envelopes.add(client_id)
+        ack = ACK(source=self.node, requestor=register.source, request_id=register.id)
+        self._reply(ack, client_id)
+        self._add_peer(client_id)
+
+    def _handle_subscribe(self, subscribe: Subscribe, client_id: bytes):
+        super()._handle_subscribe(subscribe, client_id)
+        self._announce()
+
+    def _handle_unsubscribe(self, unsubscribe: Unsubscribe, client_id: bytes):
+        super()._handle_unsubscribe(unsubscribe, client_id)
+        self._announce()
+
+    def _add_peer(self, peer: bytes):
+        """Start routing over a peer and tell it everything we know."""
+        self._peers.add(peer)
+        if self._announcement is None:
+            self._announce()
+        else:
+            self._reply(self._announcement, peer)
+        for state in self._states.values():
+            self._reply(state, peer)
+
+    def _announce(self):
+        version = time.time_ns()
+        if self._announcement is not None:
+            version = max(version, self._announcement.version + 1)
+        self._announcement = Announce(
+            source=self.node,
+            origin=self.node,
+            version=version,
+            clients=list(self.clients),
+            topics=sorted(self._topics.all_patterns() | self._group_topics.all_patterns()),
+        )
+        for peer in self._peers:
+            self._reply(self._announcement, peer)
+
+    def _handle_announce(self, announce: Announce, client_id: bytes):
+        origin = announce.origin
+        current = self._states.get(origin)
+        if origin == self.node or (current is not None and current.version >= announce.version):
+            return
+        if current is not None:
+            self._remote_topics.remove(origin)
+            for name in current.clients:
+                if self._remote_clients.get(name) == origin:
+                    del self._remote_clients[name]
+        self._states[origin] = announce
+        self._next_hop[origin] = client_id
+        for name in announce.clients:
+            self._remote_clients[name] = origin
+        for pattern in announce.topics:
+            self._remote_topics.subscribe(pattern, origin)
+        for peer in self._peers:
+            if peer != client_id:
+                self._reply(announce, peer)
+
+    def _first_sighting(self, message_id: UUID) -> bool:
+        if message_id in self._seen:
+            return False
+        self._seen[message_id] = None
+        if len(self._seen) > MAX_SEEN:
+            self._seen.popitem(last=False)
+        return True
+
+    def _route_to(self, name: str) -> bytes | None:
+        if (client_id := self.clients.get(name)) is not None:
+            return client_id
+        if (origin := self._remote_clients.get(name)) is not None:
+            return self._next_hop[origin]
+        return None
+
+    def _client_names(self) -> list[str]:
+        return [*self.clients, *(n for n in self._remote_clients if n not in self.clients)]
+
+    def _handle_event(self, envelope: Envelope, client_id: bytes):
+        if not self._first_sighting(envelope.header.id):
+            return
+        topic = envelope.header.route
+        hops = {self._next_hop[origin] for origin in self._remote_topics.match(topic)}
+        hops.discard(client_id)
+        for hop in hops:
+            self._queue(envelope, hop)
+        local = self._topics.match(topic) or self._group_topics.match(topic)
+        if not hops or self.log is not None or local:
+            super()._handle_event(envelope, client_id)
+
+    def _handle_request(self, envelope: Envelope, client_id: bytes):
+        if self._first_sighting(envelope.header.id):
+            super()._handle_request(envelope, client_id)
+
+    def _handle_response(self, envelope: Envelope, client_id: bytes):
+        header = envelope.header
+        if header.route == self.node:
+            # A peer accepted our Register.
+            if header.type == MessageType.ACK and client_id not in self._peers:
+                self._add_peer(client_id)
+            return
+        if self._first_sighting(header.id):
+            super()._handle_response(envelope, client_id)
@@ -0,0 +1,93 @@
+import math
+from typing import Iterator
+
+# Bucket boundaries grow by this factor, so any recorded value is reported
+# within half of it: 1% buckets, 0.5% error.
+GROWTH: float = 1.01
+_SCALE: float = 1 / math.log(GROWTH)
+
+
+class Histogram:
+    """Counts of values in logarithmic buckets.
+
+    Percentiles are accurate to within half a bucket whatever the range
+    of the values, and histograms recorded apart, in other threads or
+    processes, `merge` exactly. Values below 1 share the first bucket.
+    """
+
+    def __init__(self):
+        self.counts: dict[int, int] = {}
+        self.count: int = 0
+        self.total: float = 0.0
+        self.min: float = math.inf
+        self.max: float = 0.0
+
+    @staticmethod
+    def _bucket(value: float) -> int:
+        return int(math.log(value) * _SCALE) if value > 1 else 0
+
+    @staticmethod
+    def _value(bucket: int) -> float:
+        return math.exp((bucket + 0.5) / _SCALE) if bucket else 1.0
+
+    def record(self, value: float, count: int = 1) -> None:
+        bucket = self._bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += count
+        self.total += value * count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "Histogram") -> None:
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def copy(self) -> "Histogram":
+        """A copy that is safe to read while this one is still being recorded."""
+        histogram = Histogram()
+        histogram.counts = self.counts.copy()
+        histogram.count = sum(histogram.counts.values())
+        histogram.total, histogram.min, histogram.max = self.total, self.min, self.max
+        return histogram
+
+    def percentile(self, fraction: float) -> float:
+        """The value `fraction` of the recorded values are at most; 0 if empty."""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(fraction * self.count))
+        if rank >= self.count:
+            return self.max
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(max(self._value(bucket), self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def __iter__(self) -> Iterator[tuple[float, int]]:
+        """Upper bound and count of each non-empty bucket, smallest first."""
+        for bucket in sorted(self.counts):
+            yield math.exp((bucket + 1) / _SCALE), self.counts[bucket]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "min": self.min if self.count else 0.0,
+            "max": self.max,
+            **{f"p{label}": self.percentile(fraction) for label, fraction in _REPORTED},
+        }
+
+
+_REPORTED = (("50", 0.5), ("90", 0.9), ("99", 0.99), ("999", 0.999), ("9999", 0.9999))
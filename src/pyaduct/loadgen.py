@@ -0,0 +1,582 @@
+import bisect
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from functools import partial
+from pathlib import Path
+from typing import Callable, Iterable, NamedTuple
+
+from zmq import ROUTER, Context
+
+from .broker import Broker
+from .client import Client
+from .factory import ClientFactory
+from .histogram import Histogram
+from .models import Message, MessageType, Ping
+from .store import InmemMessageStore
+
+KINDS: tuple[str, ...] = ("event", "request", "ping")
+_KIND_OF = {
+    MessageType.EVENT: "event",
+    MessageType.REQUEST: "request",
+    MessageType.PING: "ping",
+}
+TOPIC: str = "loadgen"
+# Seconds a request or ping may go unanswered before it counts as lost.
+REPLY_TIMEOUT: int = 5
+# Seconds consumers keep receiving once producers are done.
+DRAIN: float = 2.0
+# Seconds to wait for a worker process to come up.
+STARTUP: float = 60.0
+
+
+class LoadgenError(Exception):
+    """Raised when a worker process fails or does not come up."""
+
+
+class Mix(NamedTuple):
+    """Relative weights of events, requests and pings sent by producers."""
+
+    events: float = 0.8
+    requests: float = 0.15
+    pings: float = 0.05
+
+
+class Step(NamedTuple):
+    """Send `rate` messages per second over all producers for `duration` seconds."""
+
+    duration: float
+    rate: float
+    mix: Mix = Mix()
+
+
+def constant(rate: float, duration: float, mix: Mix | None = None) -> list[Step]:
+    return [Step(duration, rate, mix or Mix())]
+
+
+def ramp(
+    start: float, stop: float, step: float, duration: float, mix: Mix | None = None
+) -> list[Step]:
+    """Rates from `start` up to `stop` by `step`, `duration` seconds each, to find the knee."""
+    count = int((stop - start) / step + 1e-9) + 1
+    return [Step(duration, start + i * step, mix or Mix()) for i in range(count)]
+
+
+def shape_of(messages: Iterable[Message], interval: float = 1.0) -> list[Step]:
+    """The traffic shape of recorded messages, for instance a store's, to replay.
+
+    Events, requests and pings are counted in `interval` second buckets of
+    their timestamps; each bucket becomes a step with their rate and mix.
+    """
+    buckets: dict[int, Counter] = {}
+    for message in messages:
+        if (kind := _KIND_OF.get(message.type)) is None:
+            continue
+        bucket = int(message.timestamp.timestamp() // interval)
+        buckets.setdefault(bucket, Counter())[kind] += 1
+    if not buckets:
+        return []
+    steps = []
+    for bucket in range(min(buckets), max(buckets) + 1):
+        counts = buckets.get(bucket, Counter())
+        total = sum(counts.values())
+        mix = Mix(*(counts[kind] / total for kind in KINDS)) if total else Mix()
+        steps.append(Step(interval, total / interval, mix))
+    return steps
+
+
+def save_shape(path: Path, steps: list[Step]) -> None:
+    shape = [{"duration": s.duration, "rate": s.rate, "mix": list(s.mix)} for s in steps]
+    Path(path).write_text(json.dumps(shape, indent=2))
+
+
+def load_shape(path: Path) -> list[Step]:
+    shape = json.loads(Path(path).read_text())
+    return [Step(s["duration"], s["rate"], Mix(*s.get("mix", Mix()))) for s in shape]
+
+
+class Stats:
+    """What workers saw of the messages scheduled during one step.
+
+    `latency` runs from when a message was due to be sent, so that a
+    stalled producer or a backlog in the broker counts against every
+    message it held up; `service` runs from when it was actually sent and
+    is what a closed-loop client would have reported, coordinated
+    omission and all. Both are in microseconds.
+    """
+
+    def __init__(self):
+        self.sent: Counter[str] = Counter()
+        # Events received by any consumer; requests and pings answered.
+        self.completed: Counter[str] = Counter()
+        # Requests and pings that timed out.
+        self.lost: Counter[str] = Counter()
+        self.latency: dict[str, Histogram] = {kind: Histogram() for kind in KINDS}
+        self.service: dict[str, Histogram] = {kind: Histogram() for kind in KINDS}
+
+    def merge(self, other: "Stats") -> None:
+        self.sent.update(other.sent)
+        self.completed.update(other.completed)
+        self.lost.update(other.lost)
+        for kind in KINDS:
+            self.latency[kind].merge(other.latency[kind])
+            self.service[kind].merge(other.service[kind])
+
+
+class _Recorder:
+    """Stats of one worker by step, taken by its reporter at each interval."""
+
+    def __init__(self, start: float, steps: list[Step]):
+        self._start = start
+        self._ends = list(itertools.accumulate(step.duration for step in steps))
+        self._lock = threading.Lock()
+        self._stats: dict[int, Stats] = {}
+        self.outstanding = 0
+
+    def _of(self, due: float) -> Stats:
+        step = min(bisect.bisect_right(self._ends, due - self._start), len(self._ends) - 1)
+        if (stats := self._stats.get(step)) is None:
+            stats = self._stats[step] = Stats()
+        return stats
+
+    def sent(self, kind: str, due: float, replied: bool = False) -> None:
+        with self._lock:
+            self._of(due).sent[kind] += 1
+            self.outstanding += replied
+
+    def completed(self, kind: str, due: float, sent: float, now: float) -> None:
+        with self._lock:
+            stats = self._of(due)
+            stats.completed[kind] += 1
+            stats.latency[kind].record((now - due) * 1e6)
+            stats.service[kind].record((now - sent) * 1e6)
+
+    def replied(self, kind: str, due: float, sent: float, future: Future) -> None:
+        now = time.monotonic()
+        if future.cancelled() or future.exception() is not None:
+            with self._lock:
+                self._of(due).lost[kind] += 1
+        else:
+            self.completed(kind, due, sent, now)
+        with self._lock:
+            self.outstanding -= 1
+
+    def take(self) -> dict[int, Stats]:
+        with self._lock:
+            stats, self._stats = self._stats, {}
+        return stats
+
+
+class _Config(NamedTuple):
+    address: str
+    steps: list[Step]
+    producers: int
+    consumers: int
+    clients: int
+    body_size: int
+    interval: float
+    seed: int
+
+
+def _consumer_names(config: _Config) -> list[str]:
+    return [
+        f"loadgen_consumer_{process}_{client}"
+        for process in range(config.consumers)
+        for client in range(config.clients)
+    ]
+
+
+def _report(recorder: _Recorder, results, done, interval: float) -> None:
+    while not done.wait(interval):
+        results.put(("stats", recorder.take()))
+    results.put(("stats", recorder.take()))
+
+
+def _receive(events: queue.Queue, recorder: _Recorder, done: threading.Event) -> None:
+    while not done.is_set():
+        try:
+            event = events.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        now = time.monotonic()
+        due, sent, _ = event.body.split(" ", 2)
+        recorder.completed("event", float(due), float(sent), now)
+
+
+def _serve(client: Client, done: threading.Event) -> None:
+    while not done.is_set():
+        try:
+            request = client.requests.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        client.respond(request, "")
+
+
+def _consume(index: int, config: _Config, results, start, go, stop) -> None:
+    context = Context()
+    names = _consumer_names(config)[index * config.clients : (index + 1) * config.clients]
+    clients = [
+        ClientFactory.generate_ipc_client(name, config.address, context, store=False)
+        for name in names
+    ]
+    subscriptions = []
+    for client in clients:
+        client.start()
+        subscriptions.append(client.subscribe(TOPIC))
+    results.put(("ready", "consumer", index))
+    go.wait()
+    recorder = _Recorder(start.value, config.steps)
+    done = threading.Event()
+    threads = [
+        threading.Thread(target=_receive, args=(events, recorder, done)) for events in subscriptions
+    ] + [threading.Thread(target=_serve, args=(client, done)) for client in clients]
+    for thread in threads:
+        thread.start()
+    _report(recorder, results, stop, config.interval)
+    done.set()
+    for thread in threads:
+        thread.join()
+    for client in clients:
+        client.stop()
+    context.destroy(linger=0)
+    results.put(("done", "consumer", index))
+
+
+def _send(
+    kind: str, client: Client, target: str, due: float, body: str, recorder: _Recorder
+) -> None:
+    sent = time.monotonic()
+    if kind == "event":
+        client.publish(client.generate_event(TOPIC, f"{due!r} {sent!r} {body}"))
+        recorder.sent(kind, due)
+        return
+    if kind == "request":
+        future = client.submit(client.generate_request(target, body, timeout=REPLY_TIMEOUT))
+    else:
+        # Client.ping blocks for the Pong, which would close the loop.
+        future = client._submit(Ping(source=client.name, target=target), REPLY_TIMEOUT)
+    recorder.sent(kind, due, replied=True)
+    future.add_done_callback(partial(recorder.replied, kind, due, sent))
+
+
+def _produce(index: int, config: _Config, results, start, go, stop) -> None:
+    context = Context()
+    clients = [
+        ClientFactory.generate_ipc_client(
+            f"loadgen_producer_{index}_{i}", config.address, context, store=False
+        )
+        for i in range(config.clients)
+    ]
+    for client in clients:
+        client.start()
+    targets = _consumer_names(config)
+    results.put(("ready", "producer", index))
+    go.wait()
+    recorder = _Recorder(start.value, config.steps)
+    done = threading.Event()
+    reporter = threading.Thread(
+        target=_report, args=(recorder, results, done, config.interval), name="loadgen|Report"
+    )
+    reporter.start()
+    rng = random.Random(config.seed + index)
+    body = "x" * config.body_size
+    turn = itertools.cycle(clients)
+    step_start = start.value
+    for step in config.steps:
+        step_end = step_start + step.duration
+        if step.rate <= 0:
+            stop.wait(max(0.0, step_end - time.monotonic()))
+            step_start = step_end
+            continue
+        period = config.producers / step.rate
+        # Producers take turns rather than sending in lockstep.
+        due = step_start + period * index / config.producers
+        while due < step_end and not stop.is_set():
+            if (delay := due - time.monotonic()) > 0:
+                time.sleep(delay)
+            kind = rng.choices(KINDS, weights=step.mix)[0]
+            _send(kind, next(turn), rng.choice(targets), due, body, recorder)
+            due += period
+        step_start = step_end
+    deadline = time.monotonic() + REPLY_TIMEOUT + 1
+    while recorder.outstanding > 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    for client in clients:
+        # Cancels whatever is still outstanding, which then counts as lost.
+        client.stop()
+    done.set()
+    reporter.join()
+    context.destroy(linger=0)
+    results.put(("done", "producer", index))
+
+
+def _broker(address: str, store: bool, ready, stop) -> None:
+    context = Context()
+    socket = context.socket(ROUTER)
+    socket.bind(address)
+    broker = Broker(socket, store=InmemMessageStore() if store else None)
+    broker.start()
+    ready.set()
+    stop.wait()
+    broker.stop()
+    context.destroy(linger=0)
+
+
+def rss(pid: int) -> int | None:
+    """Resident set size of a process in bytes, where /proc has it."""
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def growth(samples: list[tuple[float, int]], warmup: float = 0.1) -> float:
+    """Least-squares growth of RSS samples in bytes per hour, after the first `warmup` of them."""
+    samples = samples[int(len(samples) * warmup) :]
+    if len(samples) < 2:
+        return 0.0
+    mean_t = sum(t for t, _ in samples) / len(samples)
+    mean_r = sum(r for _, r in samples) / len(samples)
+    variance = sum((t - mean_t) ** 2 for t, _ in samples)
+    if not variance:
+        return 0.0
+    covariance = sum((t - mean_t) * (r - mean_r) for t, r in samples)
+    return covariance / variance * 3600
+
+
+class StepReport(NamedTuple):
+    """One step of a run; latencies are percentiles in microseconds."""
+
+    duration: float
+    rate: float
+    sent: dict[str, int]
+    lost: dict[str, int]
+    latency: dict[str, dict]
+    service: dict[str, dict]
+
+    @property
+    def sent_rate(self) -> float:
+        return sum(self.sent.values()) / self.duration if self.duration else 0.0
+
+    @property
+    def p99(self) -> float:
+        """The worst p99 latency of any kind of message."""
+        return max((latency["p99"] for latency in self.latency.values()), default=0.0)
+
+
+class Interval(NamedTuple):
+    """Progress over one reporting interval."""
+
+    elapsed: float
+    rate: float
+    completed: int
+    throughput: float
+    event_p99: float
+    request_p99: float
+    lost: int
+    rss: int | None
+
+
+class Report(NamedTuple):
+    steps: list[StepReport]
+    # Seconds since the start and broker RSS in bytes.
+    rss: list[tuple[float, int]]
+
+    @property
+    def lost(self) -> int:
+        return sum(sum(step.lost.values()) for step in self.steps)
+
+    @property
+    def rss_growth(self) -> float:
+        return growth(self.rss)
+
+    def knee(self, slo: float) -> float | None:
+        """The highest rate sustained before the first step that lost messages
+        or whose p99 latency exceeded `slo` microseconds; None if even the
+        first did."""
+        sustained = None
+        for step in sorted(self.steps, key=lambda step: step.rate):
+            if sum(step.lost.values()) or step.p99 > slo:
+                break
+            sustained = step.rate
+        return sustained
+
+    def to_dict(self) -> dict:
+        return {
+            "steps": [step._asdict() for step in self.steps],
+            "rss": self.rss,
+            "rss_growth": self.rss_growth,
+            "lost": self.lost,
+        }
+
+
+def _step_report(step: Step, stats: Stats, receivers: int) -> StepReport:
+    lost = dict(stats.lost)
+    # Every event is due once at every consumer.
+    missing = stats.sent["event"] * receivers - stats.completed["event"]
+    if missing > 0:
+        lost["event"] = missing
+    return StepReport(
+        step.duration,
+        step.rate,
+        dict(stats.sent),
+        lost,
+        {kind: stats.latency[kind].to_dict() for kind in KINDS},
+        {kind: stats.service[kind].to_dict() for kind in KINDS},
+    )
+
+
+def run(
+    steps: list[Step],
+    address: str | None = None,
+    producers: int = 2,
+    consumers: int = 2,
+    clients: int = 4,
+    body_size: int = 256,
+    interval: float = 5.0,
+    store: bool = True,
+    broker_pid: int | None = None,
+    progress: Callable[[Interval], None] | None = None,
+    seed: int = 0,
+) -> Report:
+    """Drive a broker with producer and consumer processes following `steps`.
+
+    Producers send open-loop, on a schedule that does not wait for replies,
+    each hosting `clients` clients; consumers subscribe every one of
+    theirs to the events and answer requests and pings. Without an
+    `address`, a broker (with a store unless `store` is False) is started
+    in a process of its own on ipc; pass the `broker_pid` of another
+    broker to follow its RSS. Latencies span processes on the monotonic
+    clock, so every process must run on one host. `progress` is called at
+    each interval.
+    """
+    if producers < 1 or consumers < 1 or clients < 1:
+        raise LoadgenError("At least one producer, consumer and client each")
+    if not steps:
+        raise LoadgenError("Nothing to run")
+    mp = multiprocessing.get_context("spawn")
+    results = mp.Queue()
+    go, stop, broker_stop, broker_ready = mp.Event(), mp.Event(), mp.Event(), mp.Event()
+    start = mp.Value("d", 0.0)
+    processes: list = []
+    broker = None
+    if address is None:
+        address = f"ipc:///tmp/pyaduct-loadgen-{os.getpid()}"
+        broker = mp.Process(
+            target=_broker, args=(address, store, broker_ready, broker_stop), name="loadgen|Broker"
+        )
+        broker.start()
+        if not broker_ready.wait(STARTUP):
+            broker.terminate()
+            raise LoadgenError("The broker did not start")
+        broker_pid = broker.pid
+    config = _Config(address, steps, producers, consumers, clients, body_size, interval, seed)
+    workers = {"consumer": consumers, "producer": producers}
+
+    def collect(until: Callable[[], bool], timeout: float, on_stats=None) -> None:
+        """Handle results until `until`, failing if a worker dies first."""
+        deadline = time.monotonic() + timeout
+        while not until():
+            try:
+                kind, *result = results.get(timeout=0.1)
+            except queue.Empty:
+                if failed := [p.name for p in processes if p.exitcode not in (None, 0)]:
+                    raise LoadgenError(f"Worker failed: {', '.join(failed)}") from None
+                if time.monotonic() > deadline:
+                    raise LoadgenError("Workers did not finish in time") from None
+                continue
+            if kind == "stats" and on_stats is not None:
+                on_stats(result[0])
+            elif kind in ("ready", "done"):
+                counts[kind, result[0]] += 1
+
+    counts: Counter = Counter()
+    totals: dict[int, Stats] = {}
+    window = Stats()
+    samples: list[tuple[float, int]] = []
+
+    def on_stats(stats: dict[int, Stats]) -> None:
+        for step, step_stats in stats.items():
+            totals.setdefault(step, Stats()).merge(step_stats)
+            window.merge(step_stats)
+
+    try:
+        for role, target in (("consumer", _consume), ("producer", _produce)):
+            for index in range(workers[role]):
+                process = mp.Process(
+                    target=target,
+                    args=(index, config, results, start, go, stop),
+                    name=f"loadgen|{role}-{index}",
+                )
+                process.start()
+                processes.append(process)
+            collect(lambda r=role: counts["ready", r] == workers[r], STARTUP)
+        start.value = time.monotonic() + 0.5
+        go.set()
+        duration = sum(step.duration for step in steps)
+        ends = list(itertools.accumulate(step.duration for step in steps))
+        receivers = consumers * clients
+        lost = 0
+        while counts["done", "producer"] < producers:
+            since = time.monotonic()
+            tick = since + interval
+            collect(
+                lambda t=tick: time.monotonic() >= t or counts["done", "producer"] == producers,
+                duration + interval + REPLY_TIMEOUT + STARTUP,
+                on_stats,
+            )
+            now = time.monotonic()
+            elapsed = now - start.value
+            if broker_pid is not None and (resident := rss(broker_pid)) is not None:
+                samples.append((elapsed, resident))
+            lost += sum(window.lost.values())
+            if progress is not None:
+                step = steps[min(bisect.bisect_right(ends, elapsed), len(steps) - 1)]
+                completed = window.completed["event"] // receivers + sum(
+                    window.completed[kind] for kind in KINDS[1:]
+                )
+                progress(
+                    Interval(
+                        elapsed,
+                        step.rate,
+                        completed,
+                        completed / (now - since),
+                        window.latency["event"].percentile(0.99),
+                        window.latency["request"].percentile(0.99),
+                        lost,
+                        samples[-1][1] if samples else None,
+                    )
+                )
+            window = Stats()
+        stop.wait(DRAIN)
+        stop.set()
+        collect(lambda: counts["done", "consumer"] == consumers, STARTUP, on_stats)
+    finally:
+        stop.set()
+        go.set()
+        for process in processes:
+            process.join(timeout=REPLY_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        if broker is not None:
+            if broker_pid is not None and (resident := rss(broker_pid)) is not None:
+                samples.append((time.monotonic() - start.value, resident))
+            broker_stop.set()
+            broker.join(timeout=REPLY_TIMEOUT)
+            if broker.is_alive():
+                broker.terminate()
+    return Report(
+        [_step_report(step, totals.get(i, Stats()), receivers) for i, step in enumerate(steps)],
+        samples,
+    )
@@ -0,0 +1,302 @@
+import bisect
+import heapq
+import mmap
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Iterator, NamedTuple
+from urllib.parse import quote, unquote
+
+from .topics import TopicError, TopicTrie
+
+# length of the whole record, offset, timestamp, lengths of the header and
+# body frames; a payload frame, if any, takes up the rest of the record
+_RECORD = struct.Struct("<IQdII")
+_SUFFIX = ".log"
+
+
+class LogRecord(NamedTuple):
+    topic: str
+    offset: int
+    timestamp: float
+    header: bytes
+    body: bytes
+    payload: bytes | None = None
+
+
+class _Segment:
+    """One memory-mapped file of records, starting at offset `base`.
+
+    Files are preallocated to their full size, so the end of the data is
+    the first zero length. Every `index_interval` bytes the offset,
+    timestamp and position of a record are kept in a sparse index, which
+    is rebuilt by scanning the file when it is reopened.
+    """
+
+    def __init__(self, path: Path, base: int, capacity: int, index_interval: int):
+        self.path = path
+        self.base = base
+        self.index_interval = index_interval
+        self._file = open(path, "r+b" if path.exists() else "w+b")
+        if os.fstat(self._file.fileno()).st_size < capacity:
+            self._file.truncate(capacity)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        self.capacity = len(self._map)
+        self.position = 0
+        self.next_offset = base
+        self.last_timestamp = 0.0
+        self._index_offsets: list[int] = []
+        self._index_timestamps: list[float] = []
+        self._index_positions: list[int] = []
+        for offset, timestamp, _, _, _, position in self._scan(0):
+            self._note(offset, timestamp, position)
+
+    def append(
+        self, offset: int, timestamp: float, header: bytes, body: bytes, payload: bytes = b""
+    ) -> bool:
+        """Write a record, or return False if it does not fit."""
+        size = _RECORD.size + len(header) + len(body) + len(payload)
+        if self.position + size > self.capacity:
+            return False
+        position = self.position
+        _RECORD.pack_into(self._map, position, size, offset, timestamp, len(header), len(body))
+        start = position + _RECORD.size
+        body_start = start + len(header)
+        self._map[start:body_start] = header
+        self._map[body_start : body_start + len(body)] = body
+        self._map[body_start + len(body) : position + size] = payload
+        self._note(offset, timestamp, position)
+        return True
+
+    def _note(self, offset: int, timestamp: float, position: int):
+        if not self._index_positions or position - self._index_positions[-1] >= self.index_interval:
+            self._index_offsets.append(offset)
+            self._index_timestamps.append(timestamp)
+            self._index_positions.append(position)
+        self.position = position + _RECORD.unpack_from(self._map, position)[0]
+        self.next_offset = offset + 1
+        self.last_timestamp = timestamp
+
+    def _scan(self, position: int) -> Iterator[tuple[int, float, bytes, bytes, bytes, int]]:
+        while position + _RECORD.size <= self.capacity:
+            size, offset, timestamp, header_size, body_size = _RECORD.unpack_from(
+                self._map, position
+            )
+            if size == 0:
+                return
+            start = position + _RECORD.size
+            body_start = start + header_size
+            header = self._map[start:body_start]
+            body = self._map[body_start : body_start + body_size]
+            payload = self._map[body_start + body_size : position + size]
+            yield offset, timestamp, header, body, payload, position
+            position += size
+
+    def records(
+        self, offset: int | None = None, since: float | None = None
+    ) -> Iterator[tuple[int, float, bytes, bytes, bytes]]:
+        """Records at or after the offset and timestamp, starting from the index."""
+        slot = 0
+        if offset is not None:
+            slot = max(slot, bisect.bisect_right(self._index_offsets, offset) - 1)
+        if since is not None:
+            slot = max(slot, bisect.bisect_left(self._index_timestamps, since) - 1)
+        position = self._index_positions[slot] if self._index_positions else 0
+        end = self.position
+        for record_offset, timestamp, header, body, payload, at in self._scan(position):
+            if at >= end:
+                return
+            if offset is not None and record_offset < offset:
+                continue
+            if since is not None and timestamp < since:
+                continue
+            yield record_offset, timestamp, header, body, payload
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def delete(self):
+        self.close()
+        self.path.unlink()
+
+
+class _Partition:
+    """The segments of a single topic, oldest first."""
+
+    def __init__(self, directory: Path, topic: str, log: "TopicLog"):
+        self.topic = topic
+        self.directory = directory
+        self._log = log
+        self._lock = threading.Lock()
+        directory.mkdir(parents=True, exist_ok=True)
+        bases = sorted(int(path.stem) for path in directory.glob(f"*{_SUFFIX}"))
+        self.segments = [self._open(base) for base in bases] or [self._open(0)]
+
+    def _open(self, base: int, capacity: int = 0) -> _Segment:
+        path = self.directory / f"{base:020d}{_SUFFIX}"
+        capacity = max(capacity, self._log.segment_bytes)
+        return _Segment(path, base, capacity, self._log.index_interval)
+
+    @property
+    def next_offset(self) -> int:
+        return self.segments[-1].next_offset
+
+    def append(self, header: bytes, body: bytes, payload: bytes) -> int:
+        with self._lock:
+            active = self.segments[-1]
+            # Keep timestamps non-decreasing so that they can be bisected.
+            timestamp = max(time.time(), active.last_timestamp)
+            offset = active.next_offset
+            if not active.append(offset, timestamp, header, body, payload):
+                if active.position == 0:
+                    # An empty segment too small for this record; replace it.
+                    self.segments.pop().delete()
+                else:
+                    active.flush()
+                size = _RECORD.size + len(header) + len(body) + len(payload)
+                active = self._open(offset, size)
+                self.segments.append(active)
+                active.append(offset, timestamp, header, body, payload)
+                self._retain()
+            return offset
+
+    def _retain(self):
+        """Delete the oldest closed segments that fall outside the retention limits."""
+        log = self._log
+        while len(self.segments) > 1:
+            oldest = self.segments[0]
+            too_big = (
+                log.retention_bytes is not None
+                and sum(segment.position for segment in self.segments) > log.retention_bytes
+            )
+            too_old = (
+                log.retention_age is not None
+                and oldest.last_timestamp < time.time() - log.retention_age
+            )
+            if not (too_big or too_old):
+                return
+            self.segments.pop(0).delete()
+
+    def read(self, offset: int | None = None, since: float | None = None) -> Iterator[LogRecord]:
+        with self._lock:
+            segments = list(self.segments)
+            end = self.next_offset
+        first = 0
+        if offset is not None:
+            first = max(0, bisect.bisect_right([s.base for s in segments], offset) - 1)
+        if since is not None:
+            stamps = [s.last_timestamp for s in segments]
+            first = max(first, min(bisect.bisect_left(stamps, since), len(segments) - 1))
+        for segment in segments[first:]:
+            for record_offset, timestamp, header, body, payload in segment.records(offset, since):
+                if record_offset >= end:
+                    return
+                yield LogRecord(self.topic, record_offset, timestamp, header, body, payload or None)
+
+    def close(self):
+        with self._lock:
+            for segment in self.segments:
+                segment.flush()
+                segment.close()
+
+
+class TopicLog:
+    """Append-only, memory-mapped event log with one partition per topic.
+
+    Each topic gets a directory of segment files named after the offset of
+    their first record. When a record no longer fits, the active segment
+    is closed and a new one started, and the oldest segments are deleted
+    once the topic holds more than `retention_bytes` or their newest
+    record is older than `retention_age` seconds. The active segment is
+    never deleted. Offsets count from zero per topic and timestamps are
+    the time the broker appended the record.
+    """
+
+    def __init__(
+        self,
+        directory: str | Path,
+        segment_bytes: int = 64 * 2**20,
+        index_interval: int = 4096,
+        retention_bytes: int | None = None,
+        retention_age: float | None = None,
+    ):
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.index_interval = index_interval
+        self.retention_bytes = retention_bytes
+        self.retention_age = retention_age
+        self._lock = threading.Lock()
+        self._partitions: dict[str, _Partition] = {}
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for path in sorted(self.directory.iterdir()):
+            if path.is_dir():
+                topic = unquote(path.name)
+                self._partitions[topic] = _Partition(path, topic, self)
+
+    def _partition(self, topic: str) -> _Partition:
+        partition = self._partitions.get(topic)
+        if partition is None:
+            with self._lock:
+                partition = self._partitions.get(topic)
+                if partition is None:
+                    path = self.directory / quote(topic, safe="")
+                    partition = self._partitions[topic] = _Partition(path, topic, self)
+        return partition
+
+    def append(
+        self, topic: str, header: bytes, body: bytes, payload: bytes | memoryview | None = None
+    ) -> int:
+        """Append an event's header, body and payload frames, returning its offset.
+
+        Raises TopicError for a topic that is empty, has empty levels or
+        wildcards, which also keeps `.` and `..` out of the file names.
+        """
+        levels = TopicTrie.validate(topic)
+        if TopicTrie.SINGLE in levels or TopicTrie.MULTI in levels:
+            raise TopicError(f"Events cannot be published to a pattern: {topic!r}")
+        return self._partition(topic).append(header, body, payload if payload is not None else b"")
+
+    def topics(self) -> list[str]:
+        return list(self._partitions)
+
+    def end_offset(self, topic: str) -> int:
+        """The offset the next event on this topic will get."""
+        partition = self._partitions.get(topic)
+        return partition.next_offset if partition is not None else 0
+
+    def read(
+        self, pattern: str, offset: int | None = None, since: float | None = None
+    ) -> Iterator[LogRecord]:
+        """Records of every topic matching the pattern, from an offset or Unix time.
+
+        A single topic is read in offset order. Wildcard patterns apply the
+        offset to each matching topic and merge them by timestamp.
+        """
+        levels = TopicTrie.validate(pattern)
+        if TopicTrie.SINGLE not in levels and TopicTrie.MULTI not in levels:
+            if pattern in self._partitions:
+                yield from self._partitions[pattern].read(offset, since)
+            return
+        trie = TopicTrie()
+        trie.subscribe(pattern, pattern)
+        partitions = [p for topic, p in list(self._partitions.items()) if trie.match(topic)]
+        if len(partitions) == 1:
+            yield from partitions[0].read(offset, since)
+            return
+        yield from heapq.merge(
+            *(partition.read(offset, since) for partition in partitions),
+            key=lambda record: (record.timestamp, record.topic, record.offset),
+        )
+
+    def close(self):
+        for partition in list(self._partitions.values()):
+            partition.close()
+
+    def __repr__(self) -> str:
+        return f"<TopicLog(directory={str(self.directory)!r}, topics={len(self._partitions)})>"
@@ -1,20 +1,23 @@
 import datetime
+import json
 import time
 from pathlib import Path
 
 import click
 from click import Context
 from loguru import logger
-from rich.console import Console
+from rich.console import Console, Group
 from rich.live import Live
 from rich.spinner import Spinner
 from rich.table import Table
 
-from pyaduct import Client
+from pyaduct import Client, bench, loadgen, metrics, profiling, tracing
 from pyaduct.broker import Broker
 from pyaduct.certs import generate_certificates
-from pyaduct.factory import BrokerFactory, PyaductFactory
+from pyaduct.client import ResponseTimeout
+from pyaduct.factory import BrokerFactory, ClientFactory, PyaductFactory
 from pyaduct.store import IMessageStore
+from pyaduct.utils import generate_random_md5
 
 
 @click.group()
@@ -45,18 +48,27 @@ def main(
 @main.command(name="broker")
 @click.pass_context
 @click.argument("bus", type=click.Choice(["ipc", "tcp"]), required=True)
+@click.option(
+    "--profile",
+    "profile_path",
+    type=click.Path(dir_okay=False),
+    help="Profile the broker's threads and write their collapsed stacks",
+)
 def broker(
     ctx: Context,
     bus: str,
+    profile_path: str | None,
 ):
     """Broker bus type (ipc or tcp)"""
-    _ = ctx
     click.echo(bus)
 
     broker = BrokerFactory().generate_ipc_broker()
+    profiler = broker.profile().start() if profile_path else None
     broker.start()
     time.sleep(1)
     broker.stop()
+    if profiler is not None:
+        save_profile(ctx.obj["console"], profiler.stop(), Path(profile_path))
 
 
 @main.command(name="certs")
@@ -77,10 +89,27 @@ def certs(ctx: Context, directory: Path):
 
 @main.command(name="demo")
 @click.pass_context
-def demo(ctx: Context):
+@click.option(
+    "--inproc",
+    is_flag=True,
+    default=False,
+    help="Run the clients in the broker's process, without sockets",
+)
+@click.option(
+    "--profile",
+    "profile_path",
+    type=click.Path(dir_okay=False),
+    help="Profile the threads of the broker and clients and write their collapsed stacks",
+)
+def demo(ctx: Context, inproc: bool, profile_path: str | None):
     """Broker bus type (ipc or tcp)"""
     console = ctx.obj["console"]
-    broker, client_1, client_2 = PyaductFactory().generate_demo_ipc_nodes()
+    profiler = profiling.Profiler().start() if profile_path else None
+    if inproc:
+        broker, client_1, client_2 = PyaductFactory().generate_inproc_nodes()
+        broker._latency = (0.4, 0.8)
+    else:
+        broker, client_1, client_2 = PyaductFactory().generate_demo_ipc_nodes()
     with Live(console=console) as live:
         spinner = Spinner("dots", text="Initializing broker and clients...")
         live.update(spinner)
@@ -105,6 +134,391 @@ def demo(ctx: Context):
     console.print(generate_table(broker))
     console.print(generate_table(client_1))
     console.print(generate_table(client_2))
+    if profiler is not None:
+        save_profile(console, profiler.stop(), Path(profile_path))
+
+
+@main.command(name="bench")
+@click.pass_context
+@click.option(
+    "-t",
+    "--transport",
+    "transports",
+    type=click.Choice(bench.TRANSPORTS),
+    multiple=True,
+    help="Transports to measure, all by default",
+)
+@click.option(
+    "-s",
+    "--scenario",
+    "scenarios",
+    type=click.Choice(bench.SCENARIOS),
+    multiple=True,
+    help="Scenarios to measure, all by default",
+)
+@click.option("--messages", default=20_000, help="Messages per throughput run")
+@click.option("--samples", default=2_000, help="Messages timed one by one for latency")
+@click.option("--subscribers", default=8, help="Subscribers of the fanout scenario")
+@click.option("--save", type=click.Path(dir_okay=False), help="Write the results as JSON")
+@click.option(
+    "--compare",
+    "baseline",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Fail on regressions against a saved baseline",
+)
+@click.option("--threshold", default=0.1, help="Regression threshold, as a fraction")
+@click.option(
+    "--trace",
+    "trace_path",
+    type=click.Path(dir_okay=False),
+    help="Write the stages of sampled messages as a Chrome trace",
+)
+@click.option("--trace-sample", default=0.01, help="Fraction of messages to trace")
+@click.option(
+    "--profile",
+    "profile_path",
+    type=click.Path(dir_okay=False),
+    help="Profile the threads of the brokers and clients and write their collapsed stacks",
+)
+def benchmark(
+    ctx: Context,
+    transports: tuple[str, ...],
+    scenarios: tuple[str, ...],
+    messages: int,
+    samples: int,
+    subscribers: int,
+    save: str | None,
+    baseline: str | None,
+    threshold: float,
+    trace_path: str | None,
+    trace_sample: float,
+    profile_path: str | None,
+):
+    """Measure throughput and latency, optionally against a baseline"""
+    console = ctx.obj["console"]
+    profiler = profiling.Profiler().start() if profile_path else None
+    tracer = tracing.ChromeTracer(Path(trace_path), trace_sample) if trace_path else None
+    table = Table(title="pyaduct bench")
+    table.add_column("Scenario", style="cyan")
+    table.add_column("Transport", style="magenta")
+    for column in ("msgs/s", "p50 us", "p99 us", "p999 us"):
+        table.add_column(column, justify="right")
+    results = []
+    with Live(table, console=console):
+        for scenario in scenarios or bench.SCENARIOS:
+            for transport in transports or bench.TRANSPORTS:
+                result = bench.run(scenario, transport, messages, samples, subscribers, tracer)
+                results.append(result)
+                table.add_row(
+                    scenario,
+                    transport,
+                    f"{result.throughput:.0f}",
+                    f"{result.p50:.0f}",
+                    f"{result.p99:.0f}",
+                    f"{result.p999:.0f}",
+                )
+    if profiler is not None:
+        save_profile(console, profiler.stop(), Path(profile_path))
+    if tracer is not None:
+        tracer.close()
+        console.print(generate_spans(tracing.breakdown((0, stamp) for stamp in tracer.stamps)))
+        console.print(f"Saved {trace_path}")
+    if save:
+        parameters = {"messages": messages, "samples": samples, "subscribers": subscribers}
+        bench.save(Path(save), results, parameters)
+        console.print(f"Saved {save}")
+    if baseline:
+        regressions = bench.compare(bench.load(Path(baseline)), results, threshold)
+        for regression in regressions:
+            console.print(f"[red]Regression: {regression}")
+        if regressions:
+            ctx.exit(1)
+        console.print(f"No regressions beyond {threshold:.0%} against {baseline}")
+
+
+@main.command(name="trace")
+@click.pass_context
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False),
+    help="Write the traces of all the files as one Chrome trace",
+)
+def trace(ctx: Context, paths: tuple[str, ...], output: str | None):
+    """Break down where messages spend their time, from the traces of their processes"""
+    console = ctx.obj["console"]
+    if output:
+        stamps = tracing.merge([Path(path) for path in paths], Path(output))
+        console.print(f"Saved {output}")
+    else:
+        stamps = [stamp for path in paths for stamp in tracing.load(Path(path))[0]]
+    console.print(generate_spans(tracing.breakdown(stamps)))
+
+
+def generate_spans(spans: dict) -> Table:
+    """Durations between consecutive stages of traced messages."""
+    table = Table(title="Spans (us)")
+    table.add_column("Span", style="cyan")
+    for column in ("Count", "p50", "p99", "Max"):
+        table.add_column(column, justify="right")
+    for name, histogram in sorted(spans.items(), key=lambda item: -item[1].total):
+        table.add_row(
+            name,
+            str(histogram.count),
+            *(
+                f"{value:.0f}"
+                for value in (histogram.percentile(0.5), histogram.percentile(0.99), histogram.max)
+            ),
+        )
+    return table
+
+
+@main.command(name="loadgen")
+@click.pass_context
+@click.option("--address", help="Broker to load; by default one is started on ipc")
+@click.option("--broker-pid", type=int, help="Process of that broker, to follow its RSS")
+@click.option("--store/--no-store", default=True, help="Whether a started broker keeps a store")
+@click.option("--producers", default=2, help="Producer processes")
+@click.option("--consumers", default=2, help="Consumer processes")
+@click.option("--clients", default=4, help="Clients in each process")
+@click.option("--rate", default=500.0, help="Messages per second over all producers")
+@click.option("--duration", default=60.0, help="Seconds to run, or to hold each ramp step")
+@click.option(
+    "--ramp",
+    type=(float, float, float),
+    help="START STOP STEP: ramp the rate up, to find the knee",
+)
+@click.option(
+    "--replay",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Replay a recorded traffic shape instead",
+)
+@click.option(
+    "--mix",
+    type=(float, float, float),
+    default=tuple(loadgen.Mix()),
+    help="EVENTS REQUESTS PINGS: relative weights",
+)
+@click.option("--body-size", default=256, help="Bytes of body in each message")
+@click.option("--interval", default=5.0, help="Seconds between progress reports")
+@click.option("--slo", default=50.0, help="p99 latency in ms that the knee must stay under")
+@click.option("--output", type=click.Path(dir_okay=False), help="Write the report as JSON")
+def load_generator(
+    ctx: Context,
+    address: str | None,
+    broker_pid: int | None,
+    store: bool,
+    producers: int,
+    consumers: int,
+    clients: int,
+    rate: float,
+    duration: float,
+    ramp: tuple[float, float, float] | None,
+    replay: str | None,
+    mix: tuple[float, float, float],
+    body_size: int,
+    interval: float,
+    slo: float,
+    output: str | None,
+):
+    """Load a broker from many processes, for hours if need be"""
+    console = ctx.obj["console"]
+    if replay:
+        steps = loadgen.load_shape(Path(replay))
+    elif ramp:
+        steps = loadgen.ramp(*ramp, duration, loadgen.Mix(*mix))
+    else:
+        steps = loadgen.constant(rate, duration, loadgen.Mix(*mix))
+
+    def progress(interval: loadgen.Interval):
+        resident = f"{interval.rss / 2**20:.1f} MiB" if interval.rss is not None else "-"
+        console.print(
+            f"{interval.elapsed:7.1f}s {interval.rate:.0f}/s done {interval.throughput:.0f}/s"
+            f" p99 event {interval.event_p99 / 1000:.1f} request"
+            f" {interval.request_p99 / 1000:.1f} ms lost {interval.lost} RSS {resident}"
+        )
+
+    report = loadgen.run(
+        steps,
+        address=address,
+        producers=producers,
+        consumers=consumers,
+        clients=clients,
+        body_size=body_size,
+        interval=interval,
+        store=store,
+        broker_pid=broker_pid,
+        progress=progress,
+    )
+    table = Table(title="pyaduct loadgen, latency in ms from when each message was due")
+    table.add_column("Rate", justify="right", style="cyan")
+    table.add_column("Sent/s", justify="right")
+    for kind in loadgen.KINDS:
+        table.add_column(f"{kind} p99", justify="right")
+    table.add_column("p999", justify="right")
+    table.add_column("uncorrected p99", justify="right")
+    table.add_column("Lost", justify="right")
+    for step in report.steps:
+        table.add_row(
+            f"{step.rate:.0f}",
+            f"{step.sent_rate:.0f}",
+            *(f"{step.latency[kind]['p99'] / 1000:.1f}" for kind in loadgen.KINDS),
+            f"{max(latency['p999'] for latency in step.latency.values()) / 1000:.1f}",
+            f"{max(service['p99'] for service in step.service.values()) / 1000:.1f}",
+            str(sum(step.lost.values())),
+        )
+    console.print(table)
+    if report.rss:
+        console.print(
+            f"Broker RSS {report.rss[0][1] / 2**20:.1f} -> {report.rss[-1][1] / 2**20:.1f} MiB,"
+            f" growing {report.rss_growth / 2**20:.1f} MiB/hour"
+        )
+    if len(steps) > 1:
+        knee = report.knee(slo * 1000)
+        console.print(f"Knee: {f'{knee:.0f}/s' if knee is not None else 'below the first rate'}")
+    if output:
+        Path(output).write_text(json.dumps(report.to_dict(), indent=2))
+        console.print(f"Saved {output}")
+    if report.lost:
+        console.print(f"[red]Lost {report.lost} messages")
+        ctx.exit(1)
+
+
+@main.command(name="top")
+@click.pass_context
+@click.option("--address", default="ipc://pyaduct", help="Broker to watch")
+@click.option("--interval", default=1.0, help="Seconds between refreshes")
+@click.option("--once", is_flag=True, default=False, help="Print the metrics once and exit")
+@click.option(
+    "--write",
+    type=click.Path(dir_okay=False),
+    help="Also write them to a file in the Prometheus text format",
+)
+@click.option("--serve", type=int, help="Also serve them in that format on this local port")
+def top(
+    ctx: Context,
+    address: str,
+    interval: float,
+    once: bool,
+    write: str | None,
+    serve: int | None,
+):
+    """Watch a broker's queues, rates, drops and latencies live"""
+    console = ctx.obj["console"]
+    client = ClientFactory.generate_ipc_client(
+        f"top-{generate_random_md5()[:8]}", address, store=False
+    )
+    client.start()
+    try:
+        snapshot = client.get_stats()
+    except ResponseTimeout:
+        snapshot = None
+    if snapshot is None:
+        console.print(f"[red]No metrics from the broker at {address}")
+        client.stop()
+        ctx.exit(1)
+    server = None
+    if serve is not None:
+        server = metrics.serve(lambda: metrics.prometheus(snapshot), serve)
+        console.print(f"Serving http://127.0.0.1:{serve}/metrics")
+    try:
+        if write:
+            metrics.write(Path(write), metrics.prometheus(snapshot))
+        if once:
+            console.print(generate_stats(snapshot, None))
+            return
+        previous = None
+        with Live(generate_stats(snapshot, None), console=console) as live:
+            while True:
+                time.sleep(interval)
+                try:
+                    fresh = client.get_stats()
+                except ResponseTimeout:
+                    fresh = None
+                if fresh is None:
+                    # Keep showing the last snapshot, marked as such.
+                    live.update(generate_stats(snapshot, previous, stale=True))
+                    continue
+                previous, snapshot = snapshot, fresh
+                if write:
+                    metrics.write(Path(write), metrics.prometheus(snapshot))
+                live.update(generate_stats(snapshot, previous))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.shutdown()
+        client.stop()
+
+
+def generate_stats(snapshot: dict, previous: dict | None, stale: bool = False) -> Group:
+    """Tables of a metrics snapshot; counters get rates against the previous one.
+
+    A stale snapshot, one the broker did not refresh in time, is marked as such.
+    """
+    elapsed = snapshot["time"] - previous["time"] if previous else 0.0
+    counters = Table(title="Counters")
+    for column in ("Metric", "Label", "Total"):
+        counters.add_column(column, style="cyan" if column == "Metric" else None)
+    counters.add_column("Per second", justify="right")
+    gauges = Table(title="Gauges")
+    gauges.add_column("Metric", style="cyan")
+    gauges.add_column("Label")
+    gauges.add_column("Value", justify="right")
+    timers = Table(title="Latency (ms)")
+    timers.add_column("Metric", style="cyan")
+    timers.add_column("Label")
+    for column in ("Count", "p50", "p99", "p999", "Max"):
+        timers.add_column(column, justify="right")
+    for name, metric in snapshot["metrics"].items():
+        short = name.removeprefix("pyaduct_broker_")
+        for label, value in sorted(metric["values"].items()):
+            if metric["kind"] == "counter":
+                rate = ""
+                if elapsed > 0:
+                    before = previous["metrics"].get(name, {}).get("values", {}).get(label, 0)
+                    rate = f"{(value - before) / elapsed:.1f}"
+                counters.add_row(short, label, f"{value:.0f}", rate)
+            elif metric["kind"] == "gauge":
+                gauges.add_row(short, label, f"{value:g}")
+            else:
+                timers.add_row(
+                    short,
+                    label,
+                    str(value["count"]),
+                    *(f"{value[p] / 1000:.2f}" for p in ("p50", "p99", "p999", "max")),
+                )
+    if stale:
+        age = time.time() - snapshot["time"]
+        return Group(
+            f"[yellow]Stale: no answer from the broker for {age:.0f}s", gauges, counters, timers
+        )
+    return Group(gauges, counters, timers)
+
+
+def save_profile(console: Console, profile: profiling.Profile, path: Path) -> None:
+    profile.write(path)
+    console.print(generate_profile(profile))
+    console.print(f"Saved {path}; render it with flamegraph.pl, inferno or speedscope")
+
+
+def generate_profile(profile: profiling.Profile) -> Table:
+    """Wall-clock, CPU and estimated GIL wait of each profiled thread."""
+    table = Table(title="Threads")
+    table.add_column("Thread", style="cyan")
+    for column in ("Wall s", "CPU s", "CPU %", "Busy %", "GIL wait s"):
+        table.add_column(column, justify="right")
+    for name, thread in sorted(profile.threads.items()):
+        cpu, wait = thread.cpu, thread.gil_wait
+        table.add_row(
+            name,
+            f"{thread.wall:.2f}",
+            "" if cpu is None else f"{cpu:.2f}",
+            "" if cpu is None or not thread.wall else f"{cpu / thread.wall:.0%}",
+            f"{thread.busy / thread.wall:.0%}" if thread.wall else "",
+            "" if wait is None else f"{wait:.2f}",
+        )
+    return table
 
 
 def generate_table(node: Broker | Client) -> Table:
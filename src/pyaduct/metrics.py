@@ -0,0 +1,291 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable
+
+from .histogram import Histogram
+
+# Quantiles of timers in snapshots and in Prometheus summaries.
+QUANTILES: tuple[tuple[str, float], ...] = (
+    ("p50", 0.5),
+    ("p90", 0.9),
+    ("p99", 0.99),
+    ("p999", 0.999),
+)
+# Label values past a metric's `max_values` are counted under this one, so
+# that labels such as topics cannot grow the number of series without end.
+OTHER: str = "other"
+MAX_VALUES: int = 100
+
+
+class Counter:
+    """A count that only goes up, per label value.
+
+    There are no locks: any one label value must only ever be counted by
+    one thread, which holds for the Handle, Send and Watch threads each
+    counting what they see. Readers may be a count behind. With
+    `max_values`, values past that many are counted as OTHER.
+    """
+
+    kind: str = "counter"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label: str | None = None,
+        max_values: int | None = None,
+    ):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.max_values = max_values
+        self.values: dict[str, float] = {}
+
+    def inc(self, value: str = "", amount: float = 1) -> None:
+        if self.max_values is not None and value not in self.values:
+            value = _capped(value, self.values, self.max_values)
+        self.values[value] = self.values.get(value, 0) + amount
+
+    def snapshot(self) -> dict[str, float]:
+        return self.values.copy()
+
+
+class Gauge:
+    """A value read when a snapshot is taken, such as a queue depth.
+
+    `read` returns the value, or with a label a dict of them by label value.
+    """
+
+    kind: str = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        read: Callable[[], float | dict[str, float]],
+        label: str | None = None,
+    ):
+        self.name = name
+        self.description = description
+        self.label = label
+        self._read = read
+
+    def snapshot(self) -> dict[str, float]:
+        value = self._read()
+        return dict(value) if isinstance(value, dict) else {"": value}
+
+
+class Timer:
+    """Durations per label value, in histograms of microseconds.
+
+    Like counters, any one label value must only be timed by one thread,
+    and values past `max_values` are timed as OTHER.
+    """
+
+    kind: str = "summary"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        label: str | None = None,
+        max_values: int | None = None,
+    ):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.max_values = max_values
+        self.histograms: dict[str, Histogram] = {}
+
+    def observe(self, seconds: float, value: str = "") -> None:
+        histogram = self.histograms.get(value)
+        if histogram is None and self.max_values is not None:
+            value = _capped(value, self.histograms, self.max_values)
+            histogram = self.histograms.get(value)
+        if histogram is None:
+            histogram = self.histograms[value] = Histogram()
+        histogram.record(seconds * 1e6)
+
+    def snapshot(self) -> dict[str, dict]:
+        summaries = {}
+        for value, histogram in self.histograms.copy().items():
+            histogram = histogram.copy()
+            summaries[value] = {
+                "count": histogram.count,
+                "sum": histogram.total,
+                "max": histogram.max,
+                **{name: histogram.percentile(fraction) for name, fraction in QUANTILES},
+            }
+        return summaries
+
+
+def _capped(value: str, values: dict, max_values: int) -> str:
+    """A new label value, or OTHER once there are `max_values` of them."""
+    return value if len(values) < max_values else OTHER
+
+
+class Metrics:
+    """The counters, gauges and timers of a Broker or Client.
+
+    Updating a counter or timer costs a dict update and, for timers, a
+    histogram bucket; nothing is locked. `snapshot` reads them all into
+    plain data, the body of the STATS command, which `prometheus` renders
+    in the Prometheus text format.
+    """
+
+    def __init__(self, namespace: str, labels: dict[str, str] | None = None):
+        self.namespace = namespace
+        self.labels: dict[str, str] = labels or {}
+        self._metrics: dict[str, Counter | Gauge | Timer] = {}
+
+    def _add(self, metric):
+        self._metrics[f"{self.namespace}_{metric.name}"] = metric
+        return metric
+
+    def counter(
+        self,
+        name: str,
+        description: str,
+        label: str | None = None,
+        max_values: int | None = None,
+    ) -> Counter:
+        return self._add(Counter(name, description, label, max_values))
+
+    def gauge(
+        self,
+        name: str,
+        description: str,
+        read: Callable[[], float | dict[str, float]],
+        label: str | None = None,
+    ) -> Gauge:
+        return self._add(Gauge(name, description, read, label))
+
+    def timer(
+        self,
+        name: str,
+        description: str,
+        label: str | None = None,
+        max_values: int | None = None,
+    ) -> Timer:
+        return self._add(Timer(name, description, label, max_values))
+
+    def snapshot(self) -> dict:
+        """Every metric by its full name, with its kind, description, label and values.
+
+        Timer values are summaries in microseconds.
+        """
+        return {
+            "time": time.time(),
+            "labels": self.labels,
+            "metrics": {
+                name: {
+                    "kind": metric.kind,
+                    "description": metric.description,
+                    "label": metric.label,
+                    "values": metric.snapshot(),
+                }
+                for name, metric in list(self._metrics.items())
+            },
+        }
+
+    def prometheus(self) -> str:
+        return prometheus(self.snapshot())
+
+    def write(self, path: Path) -> None:
+        write(path, self.prometheus())
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        return serve(self.prometheus, port, host)
+
+
+def merge(snapshots: list[dict]) -> dict:
+    """One snapshot of several nodes, such as the shards of a ShardedBroker.
+
+    Counters and gauges are added up, and so are the counts and sums of
+    timers. Their quantiles and maximum are the highest of any node, an
+    upper bound for the merged distribution.
+    """
+    merged = {"time": max(s["time"] for s in snapshots), "labels": snapshots[0]["labels"]}
+    metrics: dict[str, dict] = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot["metrics"].items():
+            if name not in metrics:
+                metrics[name] = {**metric, "values": {}}
+            values = metrics[name]["values"]
+            for value, sample in metric["values"].items():
+                if metric["kind"] != "summary":
+                    values[value] = values.get(value, 0) + sample
+                elif (summary := values.get(value)) is None:
+                    values[value] = dict(sample)
+                else:
+                    for key, number in sample.items():
+                        added = key in ("count", "sum")
+                        summary[key] = summary[key] + number if added else max(summary[key], number)
+    merged["metrics"] = metrics
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def prometheus(snapshot: dict) -> str:
+    """A snapshot in the Prometheus text exposition format; timers in seconds."""
+    lines = []
+    for name, metric in snapshot["metrics"].items():
+        lines.append(f"# HELP {name} {_escape(metric['description'])}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        for value, sample in metric["values"].items():
+            labels = dict(snapshot["labels"])
+            if metric["label"] is not None:
+                labels[metric["label"]] = value
+            if metric["kind"] != "summary":
+                lines.append(f"{name}{_labels(labels)} {sample:g}")
+                continue
+            for quantile, fraction in QUANTILES:
+                quantiled = _labels({**labels, "quantile": str(fraction)})
+                lines.append(f"{name}{quantiled} {sample[quantile] / 1e6:g}")
+            lines.append(f"{name}_sum{_labels(labels)} {sample['sum'] / 1e6:g}")
+            lines.append(f"{name}_count{_labels(labels)} {sample['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def write(path: Path, text: str) -> None:
+    """Replace a file atomically, for collectors reading text files."""
+    path = Path(path)
+    partial = path.with_name(f".{path.name}.{os.getpid()}")
+    partial.write_text(text)
+    partial.replace(path)
+
+
+def serve(render: Callable[[], str], port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve `render()` at /metrics from a daemon thread; `shutdown()` the server to stop."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(target=server.serve_forever, name="Metrics|Serve", daemon=True)
+    thread.start()
+    return server
@@ -2,7 +2,7 @@ import datetime
 from enum import Enum
 from uuid import UUID
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 from .utils import generate_datetime, generate_uuid7
 
@@ -17,25 +17,64 @@ class MessageType(Enum):
     PING = "PING"
     PONG = "PONG"
     ACK = "ACK"
+    UNSUBSCRIBE = "UNSUBSCRIBE"
+    TIMEOUT = "TIMEOUT"
+    ANNOUNCE = "ANNOUNCE"
+    EVENT_ACK = "EVENT_ACK"
+    RELEASE = "RELEASE"
 
 
 class Message(BaseModel):
+    """Base of all messages.
+
+    `payload` is optional binary data that travels in a frame of its own
+    after the body, outside of any codec, and is never copied on the way:
+    receivers get a memoryview of the frame it arrived in.
+    """
+
+    # Frozen: an inproc broker hands the same instance to every receiver.
+    model_config = ConfigDict(frozen=True, arbitrary_types_allowed=True)
+
     id: UUID = Field(default_factory=generate_uuid7)
     type: MessageType
     timestamp: datetime.datetime = Field(default_factory=generate_datetime)
     source: str
     body: str
+    payload: bytes | memoryview | None = Field(default=None, exclude=True, repr=False)
 
 
 class Register(Message):
+    """Join the broker under `source`.
+
+    `host` identifies the client's host; a client on the broker's own
+    host may hand large payloads over in shared memory. `compression`
+    and `dictionaries` are the compressors and preset dictionary ids the
+    client can decompress bodies with.
+    """
+
     type: MessageType = MessageType.REGISTER
     body: str = "REGISTER"
+    codecs: list[str] = ["json"]
+    envelope: bool = False
+    peer: bool = False
+    service: str | None = None
+    balance: str = "round_robin"
+    host: str | None = None
+    compression: list[str] = []
+    dictionaries: list[int] = []
 
 
 class Request(Message):
+    """A request for a client, or for a service of load balanced replicas.
+
+    `key` picks the replica when the service balances by consistent hash;
+    requests with the same key go to the same replica.
+    """
+
     type: MessageType = MessageType.REQUEST
     target: str
     timeout: int = 5
+    key: str | None = None
 
 
 class Command(Request):
@@ -49,14 +88,43 @@ class Response(Message):
 
 
 class Event(Message):
+    """An event on a topic.
+
+    `member` is the consumer group member it was delivered to, which
+    travels in the header rather than the body, see wire.GROUP.
+    """
+
     type: MessageType = MessageType.EVENT
     topic: str
+    member: str | None = Field(default=None, exclude=True, repr=False)
 
 
 class Subscribe(Message):
+    """Subscribe to a topic pattern.
+
+    With a broker event log, `offset` or `since` first replays the logged
+    events from that offset or time before live events follow.
+
+    With a `group`, each event goes to only one member of the group, which
+    holds at most `prefetch` unacknowledged events and must acknowledge
+    each within `ack_timeout` seconds before it is delivered again.
+    """
+
     type: MessageType = MessageType.SUBSCRIBE
     topic: str
     body: str = "SUBSCRIBE"
+    offset: int | None = None
+    since: datetime.datetime | None = None
+    group: str | None = None
+    prefetch: int = 100
+    ack_timeout: float = 30.0
+
+
+class Unsubscribe(Message):
+    type: MessageType = MessageType.UNSUBSCRIBE
+    topic: str
+    body: str = "UNSUBSCRIBE"
+    group: str | None = None
 
 
 class Ping(Request):
@@ -70,5 +138,68 @@ class Pong(Response):
 
 
 class ACK(Response):
+    """Acknowledges a change.
+
+    For a Register, the body is the codec to use and `shared_memory` tells
+    the client that it is on the broker's host.
+    """
+
     type: MessageType = MessageType.ACK
     body: str = "ACK"
+    shared_memory: bool = False
+
+
+class Timeout(Response):
+    """Sent by the broker when a request's deadline passes without a response."""
+
+    type: MessageType = MessageType.TIMEOUT
+    body: str = "TIMEOUT"
+
+
+class Announce(Message):
+    """A broker's local clients and subscriptions, flooded to its peers.
+
+    `origin` is the broker the state belongs to; a higher `version`
+    replaces what peers know about it.
+    """
+
+    type: MessageType = MessageType.ANNOUNCE
+    body: str = "ANNOUNCE"
+    origin: str
+    version: int
+    clients: list[str] = []
+    topics: list[str] = []
+
+
+class EventAck(Message):
+    """Acknowledges a batch of events delivered through consumer groups."""
+
+    type: MessageType = MessageType.EVENT_ACK
+    body: str = "EVENT_ACK"
+    events: list[UUID] = []
+
+
+class Release(Message):
+    """Tells the broker that shared memory payloads have been mapped."""
+
+    type: MessageType = MessageType.RELEASE
+    body: str = "RELEASE"
+    segments: list[str] = []
+
+
+MESSAGE_MODELS: dict[MessageType, type[Message]] = {
+    MessageType.COMMAND: Command,
+    MessageType.REQUEST: Request,
+    MessageType.RESPONSE: Response,
+    MessageType.EVENT: Event,
+    MessageType.REGISTER: Register,
+    MessageType.SUBSCRIBE: Subscribe,
+    MessageType.PING: Ping,
+    MessageType.PONG: Pong,
+    MessageType.ACK: ACK,
+    MessageType.UNSUBSCRIBE: Unsubscribe,
+    MessageType.TIMEOUT: Timeout,
+    MessageType.ANNOUNCE: Announce,
+    MessageType.EVENT_ACK: EventAck,
+    MessageType.RELEASE: Release,
+}
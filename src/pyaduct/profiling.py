@@ -0,0 +1,183 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from threading import Thread
+from types import CodeType
+from typing import Iterable, NamedTuple
+
+# Seconds between samples.
+INTERVAL: float = 0.005
+# Functions that a thread is blocked in, rather than running, when they are
+# its innermost Python frame: the Condition and Poller waits of the I/O loops.
+IDLE: frozenset[str] = frozenset({"wait", "poll", "select", "_wait_for_tstate_lock"})
+
+
+class ThreadProfile(NamedTuple):
+    """Where the time of the threads of one name went, in seconds.
+
+    `busy` is the share of the wall-clock time that samples found them
+    outside of IDLE functions: running, or waiting to. `cpu` is what they
+    actually got, where the platform has per-thread clocks.
+    """
+
+    name: str
+    wall: float
+    cpu: float | None
+    busy: float
+    samples: int
+
+    @property
+    def gil_wait(self) -> float | None:
+        """Estimated time spent ready to run but waiting for the GIL, or for a CPU."""
+        return None if self.cpu is None else max(0.0, self.busy - self.cpu)
+
+
+class Profile:
+    """Thread profiles by name, and sample counts by collapsed stack."""
+
+    def __init__(self, threads: dict[str, ThreadProfile], stacks: Counter[str]):
+        self.threads = threads
+        self.stacks = stacks
+
+    def collapsed(self) -> str:
+        """Stacks in the collapsed format of flamegraph.pl, inferno and speedscope.
+
+        Each line is a thread name, then its frames from the outermost,
+        separated by semicolons, then how many samples found it there.
+        """
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+    def write(self, path: Path) -> None:
+        Path(path).write_text(self.collapsed())
+
+
+def _cpu_clock(thread: Thread) -> int | None:
+    try:
+        return time.pthread_getcpuclockid(thread.ident)
+    except (AttributeError, OSError):
+        return None
+
+
+class _Tracked:
+    """What the samples of one thread have found so far."""
+
+    def __init__(self, thread: Thread, now: float):
+        self.thread = thread
+        self.clock = _cpu_clock(thread)
+        self.first = self.last = now
+        self.cpu_first = self.cpu_last = self._cpu()
+        self.samples = 0
+        self.busy = 0
+
+    def _cpu(self) -> float | None:
+        if self.clock is None:
+            return None
+        try:
+            return time.clock_gettime(self.clock)
+        except OSError:
+            # The thread is gone; keep what was read before it went.
+            self.clock = None
+            return None
+
+    def sample(self, now: float, busy: bool) -> None:
+        self.last = now
+        if (cpu := self._cpu()) is not None:
+            self.cpu_last = cpu
+        self.samples += 1
+        self.busy += busy
+
+
+class Profiler:
+    """Samples the stacks and CPU clocks of threads from a thread of its own.
+
+    Profiles the given threads, or every other thread of the process, as
+    they start and until they stop. Use it as a `with` block, or `start`
+    and `stop` it; `stop` returns the Profile, also kept as `profile`.
+    Threads of one name, such as the Listen threads of brokers run one
+    after another, are added up.
+    """
+
+    def __init__(self, threads: Iterable[Thread] | None = None, interval: float = INTERVAL):
+        self._threads: list[Thread] | None = list(threads) if threads is not None else None
+        self.interval = interval
+        self.profile: Profile | None = None
+        self._stop = threading.Event()
+        self._thread = Thread(target=self.__sample, name="Profiler|Sample", daemon=True)
+        self._tracked: dict[int, _Tracked] = {}
+        self._finished: list[_Tracked] = []
+        self._stacks: Counter[str] = Counter()
+        self._names: dict[CodeType, str] = {}
+
+    def start(self) -> "Profiler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> Profile:
+        self._stop.set()
+        self._thread.join()
+        self.profile = Profile(self._profiles(), self._stacks)
+        return self.profile
+
+    def __enter__(self) -> "Profiler":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def __sample(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _targets(self) -> Iterable[Thread]:
+        if self._threads is not None:
+            return self._threads
+        return (thread for thread in threading.enumerate() if thread is not self._thread)
+
+    def _frame_name(self, code: CodeType) -> str:
+        if (name := self._names.get(code)) is None:
+            name = f"{code.co_qualname} ({os.path.basename(code.co_filename)})"
+            self._names[code] = name
+        return name
+
+    def _sample(self):
+        frames = sys._current_frames()
+        now = time.monotonic()
+        for thread in self._targets():
+            if thread.ident is None or (frame := frames.get(thread.ident)) is None:
+                continue
+            tracked = self._tracked.get(thread.ident)
+            if tracked is None or tracked.thread is not thread:
+                # A new thread, or a new one reusing the ident of a finished one.
+                if tracked is not None:
+                    self._finished.append(tracked)
+                tracked = self._tracked[thread.ident] = _Tracked(thread, now)
+            tracked.sample(now, frame.f_code.co_name not in IDLE)
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_name(frame.f_code))
+                frame = frame.f_back
+            stack.append(thread.name)
+            self._stacks[";".join(reversed(stack))] += 1
+
+    def _profiles(self) -> dict[str, ThreadProfile]:
+        profiles: dict[str, ThreadProfile] = {}
+        for tracked in [*self._finished, *self._tracked.values()]:
+            if not tracked.samples:
+                continue
+            name = tracked.thread.name
+            wall = tracked.last - tracked.first
+            cpu = None
+            if tracked.cpu_first is not None:
+                cpu = tracked.cpu_last - tracked.cpu_first
+            busy = wall * tracked.busy / tracked.samples
+            if (other := profiles.get(name)) is not None:
+                cpu = None if cpu is None or other.cpu is None else cpu + other.cpu
+                wall, busy = wall + other.wall, busy + other.busy
+                samples = tracked.samples + other.samples
+            else:
+                samples = tracked.samples
+            profiles[name] = ThreadProfile(name, wall, cpu, busy, samples)
+        return profiles
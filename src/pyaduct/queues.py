@@ -0,0 +1,47 @@
+from queue import Queue
+from typing import NamedTuple
+
+POLICIES: tuple[str, ...] = ("block", "timeout", "raise")
+
+
+class Backpressure(NamedTuple):
+    """What a client does with a message its full send queue has no room for.
+
+    "block" waits for room, "timeout" waits up to `timeout` seconds and
+    "raise" fails at once; the last two fail with queue.Full.
+    """
+
+    policy: str = "block"
+    timeout: float = 1.0
+
+
+class BoundedQueue(Queue):
+    """A Queue of at most `maxsize` items, none for 0, that keeps its high-water mark.
+
+    `force` puts an item whatever the limit, for messages that threads
+    which must never wait, such as the Listen threads, have to pass on.
+    """
+
+    def __init__(self, maxsize: int = 0):
+        super().__init__(maxsize)
+        self.high_water: int = 0
+
+    def _put(self, item):
+        super()._put(item)
+        if len(self.queue) > self.high_water:
+            self.high_water = len(self.queue)
+
+    def force(self, item) -> None:
+        with self.not_full:
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def offer(self, item, backpressure: Backpressure) -> None:
+        """Put an item as `backpressure` says; raises queue.Full if it cannot."""
+        if backpressure.policy == "block":
+            self.put(item)
+        elif backpressure.policy == "timeout":
+            self.put(item, timeout=backpressure.timeout)
+        else:
+            self.put(item, block=False)
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import datetime
+from queue import Queue
+
+from loguru import logger
+from zmq import Socket
+
+from . import profiling
+from .client import Client, ClientException
+from .compression import Compression
+from .models import Event, Message, MessageType, Request, Response
+from .queues import Backpressure
+from .store import IMessageStore
+from .tracing import ITracer
+
+
+class SessionClient(Client):
+    """A client name hosted by a Session, with the same API as a Client.
+
+    It has no socket, threads or correlation table of its own: it sends
+    through its session, which hands it the events, requests and pings
+    addressed to it. Create it with `Session.client()`.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        name: str,
+        service: str | None = None,
+        balance: str = "round_robin",
+    ):
+        # Client.__init__ would open the socket pipes and threads the session shares.
+        self._session = session
+        self._init_name(name, session.store, service, balance, session._max_queue)
+
+    def __getattr__(self, attribute: str):
+        # Everything but the per-name state is the session's: the negotiated
+        # codec and framing, the queues, threads, metrics and correlation table.
+        if attribute == "_session":
+            raise AttributeError(attribute)
+        return getattr(self._session, attribute)
+
+    def start(self):
+        self._session._attach(self)
+        try:
+            self._register()
+        except Exception:
+            self._session._detach(self)
+            raise
+        logger.success(f"{self.name} | Client started in session {self._session.name}")
+
+    def stop(self):
+        self._flush_acks()
+        self._session._detach(self)
+        self.registered = False
+
+    def subscribe(
+        self,
+        topic: str,
+        offset: int | None = None,
+        since: datetime.datetime | None = None,
+        group: str | None = None,
+        prefetch: int = 100,
+        ack_timeout: float = 30.0,
+    ) -> Queue[Event]:
+        # The session must know about the pattern before the broker can
+        # send the first event for it. Group deliveries name their member
+        # instead, so only plain subscriptions go in the session's trie.
+        added = False
+        if group is None:
+            with self._session._subscriptions_lock:
+                added = self._session._subscriptions.subscribe(topic, self.name)
+        try:
+            return super().subscribe(topic, offset, since, group, prefetch, ack_timeout)
+        except Exception:
+            if added:
+                with self._session._subscriptions_lock:
+                    self._session._subscriptions.unsubscribe(topic, self.name)
+            raise
+
+    def unsubscribe(self, topic: str, group: str | None = None) -> None:
+        super().unsubscribe(topic, group)
+        if group is None:
+            with self._session._subscriptions_lock:
+                self._session._subscriptions.unsubscribe(topic, self.name)
+
+    def _negotiated(self, ack: Response):
+        self._session._negotiated(ack)
+
+    def profile(self, interval: float = profiling.INTERVAL) -> profiling.Profiler:
+        """A profiler of the threads of the session, which does this client's work."""
+        return self._session.profile(interval)
+
+
+class Session(Client):
+    """One socket and one set of I/O threads shared by many client names.
+
+    Each name from `client()` registers, subscribes and is routed on its
+    own, exactly like a Client on its own socket, but costs no more than
+    its queues. The session itself never registers a name.
+    """
+
+    def __init__(
+        self,
+        socket: Socket,
+        store: IMessageStore | None = None,
+        codecs: list[str] | None = None,
+        envelope: bool = True,
+        shared_memory: int | None = None,
+        compression: Compression | None = None,
+        tracer: ITracer | None = None,
+        max_queue: int = 0,
+        backpressure: Backpressure | None = None,
+    ):
+        super().__init__(
+            socket,
+            store=store,
+            codecs=codecs,
+            envelope=envelope,
+            shared_memory=shared_memory,
+            compression=compression,
+            tracer=tracer,
+            max_queue=max_queue,
+            backpressure=backpressure,
+        )
+        self.clients: dict[str, SessionClient] = {}
+        # Service name -> the hosted clients that are replicas of it.
+        self._services: dict[str, list[SessionClient]] = {}
+
+    def start(self):
+        for thread in self._threads.values():
+            thread.start()
+        logger.success(f"Session started: {self.name}")
+
+    def stop(self):
+        for client in list(self.clients.values()):
+            client.stop()
+        super().stop()
+
+    def client(
+        self, name: str, service: str | None = None, balance: str = "round_robin"
+    ) -> SessionClient:
+        """A client hosted by the session; start() it to register the name."""
+        if name in self.clients:
+            raise ClientException(f"Session already hosts {name}")
+        return SessionClient(self, name, service=service, balance=balance)
+
+    def _attach(self, client: SessionClient):
+        if self.clients.setdefault(client.name, client) is not client:
+            raise ClientException(f"Session already hosts {client.name}")
+        if client.service is not None:
+            self._services.setdefault(client.service, []).append(client)
+
+    def _detach(self, client: SessionClient):
+        if self.clients.get(client.name) is not client:
+            return
+        del self.clients[client.name]
+        if client.service is not None:
+            self._services[client.service].remove(client)
+        with self._subscriptions_lock:
+            self._subscriptions.remove(client.name)
+
+    def _flush_acks(self):
+        for client in list(self.clients.values()):
+            client._flush_acks()
+
+    def _handle_message(self, message: Message):
+        assert isinstance(message, Message)
+        if message.type == MessageType.EVENT:
+            assert isinstance(message, Event)
+            if message.member is not None:
+                # A consumer group delivery, for its member alone.
+                names = [message.member]
+            else:
+                with self._subscriptions_lock:
+                    names = self._subscriptions.match(message.topic)
+            for name in names:
+                if (client := self.clients.get(name)) is not None:
+                    client._handle_message(message)
+        elif message.type in (MessageType.REQUEST, MessageType.PING):
+            assert isinstance(message, Request)
+            if (client := self._recipient(message.target)) is None:
+                logger.warning(f"{self.name} | No client for {message.target}")
+                self._dropped.inc("no_recipient")
+                return
+            client._handle_message(message)
+        else:
+            super()._handle_message(message)
+
+    def _recipient(self, target: str) -> SessionClient | None:
+        if (client := self.clients.get(target)) is not None:
+            return client
+        if replicas := self._services.get(target):
+            # The broker picked this session; pick the least busy replica in it.
+            return min(replicas, key=lambda replica: replica.requests.qsize())
+        return None
@@ -0,0 +1,308 @@
+import heapq
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+from threading import Thread
+from uuid import UUID
+
+from loguru import logger
+from zmq import NOBLOCK, PAIR, POLLIN, Again, Context, Frame, Poller, Socket
+
+from . import metrics
+from .broker import Broker, BrokerError
+from .codec import decode
+from .log import TopicLog
+from .models import Command, MessageType
+from .utils import BURST_SIZE, POLL_TIMEOUT, generate_random_md5
+from .wire import Envelope, Header, codec_of, correlation, peek, unpack_frames
+
+# Replicated to every shard so that each holds the full registry and trie.
+# Consumer group acks and shared memory releases too, as any shard may have
+# delivered the events, and commands, so that STATS covers every shard.
+_BROADCAST = {
+    MessageType.REGISTER,
+    MessageType.SUBSCRIBE,
+    MessageType.UNSUBSCRIBE,
+    MessageType.EVENT_ACK,
+    MessageType.RELEASE,
+    MessageType.COMMAND,
+}
+# Sharded by their route (topic or target); everything else by its source.
+_BY_ROUTE = {MessageType.EVENT, MessageType.REQUEST, MessageType.PING}
+_REQUESTS = {MessageType.REQUEST, MessageType.PING}
+# Sent to the shard that holds their request: for a service, the replica that
+# answers is not the target the request was sharded by.
+_ANSWERS = {MessageType.RESPONSE, MessageType.PONG}
+_READY = b"READY"
+# How the front combines the replies of every shard to a broadcast message:
+# pass any one of them on, or merge their metrics snapshots.
+_ANY = b""
+_STATS = b"STATS"
+# How long start() waits for the worker processes to come up.
+START_TIMEOUT: float = 30.0
+# How long the front waits for every shard to answer a broadcast message
+# before passing on the answers it has.
+GATHER_TIMEOUT: float = 5.0
+
+
+def shard_of(key: bytes, shards: int) -> int:
+    """The shard that owns a topic, target or client name."""
+    return zlib.crc32(key) % shards
+
+
+class ShardWorker(Broker):
+    """A Broker serving one shard behind the front of a ShardedBroker.
+
+    Registrations, subscriptions and commands reach every shard, and so
+    every shard answers them. Those answers are handed to the front as
+    `["", "", ref, how, client, "", *frames]`, and the front only passes
+    one on to the client, or their merged STATS, once all shards have
+    answered.
+    """
+
+    def __init__(self, socket: Socket, shard: int, shards: int, **kwargs):
+        super().__init__(socket, **kwargs)
+        self.shard = shard
+        self.shards = shards
+        # Every shard holds the whole registry, so only one counts it for STATS.
+        self.metrics.gauge(
+            "clients", "Registered clients", lambda: len(self.clients) if shard == 0 else 0
+        )
+        # Commands handled, until their response is sent.
+        self._commands: dict[UUID, str] = {}
+        self._gathering: tuple[UUID, bytes] | None = None
+
+    def _handle_command(self, command: Command, client_id: bytes):
+        self._commands[command.id] = command.body
+        super()._handle_command(command, client_id)
+
+    def _send_message(self, envelope: Envelope, client_id: bytes):
+        # Only the Send thread gets here, so the flag cannot be interleaved.
+        header = envelope.header
+        self._gathering = None
+        if header.type == MessageType.ACK:
+            self._gathering = (header.ref, _ANY)
+        elif header.type == MessageType.RESPONSE and header.ref in self._commands:
+            command = self._commands.pop(header.ref)
+            self._gathering = (header.ref, _STATS if command == "STATS" else _ANY)
+        super()._send_message(envelope, client_id)
+
+    def _send_multipart(self, client_id: bytes, frames: list[bytes]):
+        if self._gathering is None:
+            super()._send_multipart(client_id, frames)
+        else:
+            ref, how = self._gathering
+            super()._send_multipart(b"", [ref.bytes, how, client_id, b"", *frames])
+
+
+def _serve_shard(
+    address: str,
+    shard: int,
+    shards: int,
+    stop: threading.Event,
+    validate: bool,
+    log_directory: str | None,
+):
+    """Entry point of a worker process."""
+    context = Context()
+    socket = context.socket(PAIR)
+    socket.connect(address)
+    log = TopicLog(Path(log_directory) / f"shard-{shard}") if log_directory else None
+    worker = ShardWorker(socket, shard, shards, validate=validate, log=log)
+    socket.send(_READY)
+    worker.start()
+    stop.wait()
+    worker.stop()
+    if log is not None:
+        log.close()
+    context.destroy(linger=0)
+
+
+def _merge_stats(answers: list[list[Frame]]) -> list[bytes | Frame]:
+    """One `[client, "", *frames]` STATS response of every shard's snapshot."""
+    envelopes = [Envelope.from_frames(unpack_frames(answer[2:])) for answer in answers]
+    snapshot = metrics.merge([json.loads(envelope.message.body) for envelope in envelopes])
+    response = envelopes[0].message.model_copy(update={"body": json.dumps(snapshot)})
+    codec = codec_of(envelopes[0].raw_body)
+    framed = len(answers[0]) > 3
+    return [answers[0][0], b"", *Envelope.from_message(response).frames(codec, framed)]
+
+
+class ShardedBroker:
+    """A front ROUTER spreading the broker's work over worker processes.
+
+    The front only reads routing headers. Events are sharded by topic,
+    requests and pings by target, and responses go back to the shard that
+    holds their request. Registrations and subscriptions are sent to
+    every shard, so each worker has the whole client registry
+    and topic trie and can deliver any event itself. Workers hand their
+    outgoing frames back to the front, which owns the client socket.
+    Commands go to every shard too, and STATS answers with the metrics
+    of all of them, see `metrics.merge`. Clients see the same behavior
+    as with a single Broker.
+    """
+
+    def __init__(
+        self,
+        socket: Socket,
+        workers: int | None = None,
+        validate: bool = False,
+        log_directory: str | None = None,
+    ):
+        assert isinstance(socket, Socket)
+        self._socket = socket
+        self.workers: int = workers or os.cpu_count() or 1
+        self._validate = validate
+        self._log_directory = log_directory
+        self._context = multiprocessing.get_context("spawn")
+        self._stop_workers = self._context.Event()
+        self._processes: list[multiprocessing.process.BaseProcess] = []
+        self._pipes: list[Socket] = []
+        # Answers received so far to each broadcast message by shard, see
+        # ShardWorker, and a heap of their deadlines to stop waiting by.
+        self._answers: dict[bytes, dict[int, list[Frame]]] = {}
+        self._gathering: list[tuple[float, bytes, bytes]] = []
+        # The shard holding each outstanding request, and a heap of their
+        # deadlines to forget them by.
+        self._holders: dict[bytes, int] = {}
+        self._deadlines: list[tuple[float, bytes]] = []
+        self._stop = threading.Event()
+        self._thread = Thread(target=self.__front, name="Broker|Front")
+
+    def start(self):
+        prefix = os.path.join(tempfile.gettempdir(), f"pyaduct-{generate_random_md5()}")
+        for shard in range(self.workers):
+            address = f"ipc://{prefix}-shard-{shard}"
+            pipe = self._socket.context.socket(PAIR)
+            pipe.bind(address)
+            self._pipes.append(pipe)
+            process = self._context.Process(
+                target=_serve_shard,
+                args=(
+                    address,
+                    shard,
+                    self.workers,
+                    self._stop_workers,
+                    self._validate,
+                    self._log_directory,
+                ),
+                name=f"Broker|Shard-{shard}",
+                daemon=True,
+            )
+            process.start()
+            self._processes.append(process)
+        for shard, pipe in enumerate(self._pipes):
+            if not pipe.poll(START_TIMEOUT * 1000) or pipe.recv() != _READY:
+                self.stop()
+                raise BrokerError(f"Shard {shard} did not start")
+        self._thread.start()
+        logger.success(f"Sharded broker started with {self.workers} workers")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self._stop_workers.set()
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for pipe in self._pipes:
+            pipe.close(linger=0)
+        self._socket.close()
+
+    def __front(self):
+        poller = Poller()
+        poller.register(self._socket, POLLIN)
+        for pipe in self._pipes:
+            poller.register(pipe, POLLIN)
+        while not self._stop.is_set():
+            events = dict(poller.poll(POLL_TIMEOUT * 1000))
+            if self._socket in events:
+                self.__dispatch_burst()
+            for shard, pipe in enumerate(self._pipes):
+                if pipe in events:
+                    self.__return_burst(shard, pipe)
+            self._forget_expired()
+            self.__return_gathered()
+
+    def __dispatch_burst(self):
+        for _ in range(BURST_SIZE):
+            try:
+                client_id, *frames = self._socket.recv_multipart(NOBLOCK, copy=False)
+            except Again:
+                return
+            frames = unpack_frames(frames)
+            if not frames:
+                continue
+            for shard in self._shards(frames):
+                self._pipes[shard].send_multipart([client_id, b"", *frames], copy=False)
+
+    def __return_burst(self, shard: int, pipe: Socket):
+        for _ in range(BURST_SIZE):
+            try:
+                frames = pipe.recv_multipart(NOBLOCK, copy=False)
+            except Again:
+                return
+            if not frames[0].bytes:
+                ref, how = frames[2].bytes, frames[3].bytes
+                if ref not in self._answers:
+                    self._answers[ref] = {}
+                    heapq.heappush(self._gathering, (time.time() + GATHER_TIMEOUT, ref, how))
+                answers = self._answers[ref]
+                answers[shard] = frames[4:]
+                if len(answers) < self.workers:
+                    continue
+                del self._answers[ref]
+                answers = list(answers.values())
+                frames = _merge_stats(answers) if how == _STATS else answers[0]
+            self._socket.send_multipart(frames, copy=False)
+
+    def __return_gathered(self):
+        """Pass on what has arrived for broadcast messages some shards never answered."""
+        now = time.time()
+        while self._gathering and self._gathering[0][0] <= now:
+            _, ref, how = heapq.heappop(self._gathering)
+            answers = self._answers.pop(ref, None)
+            if answers is None:
+                continue
+            missing = sorted(set(range(self.workers)) - answers.keys())
+            logger.error(f"Shards {missing} did not answer {ref.hex()} in time")
+            answers = list(answers.values())
+            frames = _merge_stats(answers) if how == _STATS else answers[0]
+            self._socket.send_multipart(frames, copy=False)
+
+    def _forget_expired(self):
+        now = time.time()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            self._holders.pop(heapq.heappop(self._deadlines)[1], None)
+
+    def _shards(self, frames: list[bytes]) -> range | tuple[int]:
+        try:
+            if len(frames) > 1:
+                message_type, source, route = peek(frames[0])
+                if message_type in _REQUESTS or message_type in _ANSWERS:
+                    message_id, ref, deadline = correlation(frames[0])
+            else:
+                header = Header.from_message(decode(frames[0]))
+                message_type = header.type
+                source, route = header.source.encode("utf-8"), header.route.encode("utf-8")
+                message_id, deadline = header.id.bytes, header.deadline
+                ref = header.ref.bytes if header.ref is not None else b""
+        except Exception as e:
+            logger.error(f"Error reading routing header: {e}")
+            return ()
+        if message_type in _BROADCAST:
+            return range(self.workers)
+        if message_type in _ANSWERS and (shard := self._holders.pop(ref, None)) is not None:
+            return (shard,)
+        shard = shard_of(route if message_type in _BY_ROUTE else source, self.workers)
+        if message_type in _REQUESTS:
+            self._holders[message_id] = shard
+            heapq.heappush(self._deadlines, (deadline, message_id))
+        return (shard,)
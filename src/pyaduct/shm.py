@@ -0,0 +1,140 @@
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+from loguru import logger
+
+# How long the broker keeps a segment at most, in seconds, for receivers
+# that never release it.
+SHARED_LEASE: float = 30.0
+# Payload size, name length, then the name.
+_HANDLE = struct.Struct("<QH")
+_SHM_DIR = "/dev/shm"
+
+
+def host_id() -> str:
+    """Identifies this host, so that clients and brokers can tell they share memory."""
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as file:
+            boot = file.read().strip()
+    except OSError:
+        boot = ""
+    return f"{socket.gethostname()}/{boot}"
+
+
+def share(payload: bytes | memoryview) -> bytes:
+    """Copy a payload into a new segment and return the handle to send instead.
+
+    The segment then belongs to the broker, which unlinks it once every
+    receiver has released it or its lease is up.
+    """
+    view = memoryview(payload).cast("B")
+    segment = SharedMemory(create=True, size=max(1, view.nbytes))
+    try:
+        segment.buf[: view.nbytes] = view
+        # Not ours to clean up at exit any more.
+        resource_tracker.unregister(segment._name, "shared_memory")
+    finally:
+        segment.close()
+    name = segment.name.encode("utf-8")
+    return _HANDLE.pack(view.nbytes, len(name)) + name
+
+
+def segment_of(handle: bytes) -> str:
+    """The name of the segment a handle refers to."""
+    _, length = _HANDLE.unpack_from(handle)
+    return str(handle[_HANDLE.size : _HANDLE.size + length], "utf-8")
+
+
+def attach(handle: bytes) -> memoryview:
+    """A read-only view of the payload a handle refers to.
+
+    The segment stays mapped for as long as the view, or any slice of it,
+    is alive, even after the broker has unlinked it. Where segments are
+    not files under /dev/shm, the payload is copied out instead.
+    """
+    size, _ = _HANDLE.unpack_from(handle)
+    name = segment_of(handle)
+    if os.path.isdir(_SHM_DIR):
+        with open(os.path.join(_SHM_DIR, name), "rb") as file:
+            if size == 0:
+                return memoryview(b"")
+            return memoryview(mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ))
+    segment = SharedMemory(name)
+    try:
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return memoryview(bytes(segment.buf[:size]))
+    finally:
+        segment.close()
+
+
+def unlink(name: str) -> None:
+    try:
+        segment = SharedMemory(name)
+    except FileNotFoundError:
+        return
+    segment.close()
+    segment.unlink()
+
+
+class SharedSegments:
+    """Reference counts and leases of the segments passing through a broker.
+
+    Every delivery of a shared payload `hold`s its segment and every
+    receiver `release`s it once mapped. A segment is unlinked when its
+    count drops to zero, or by `expire` once its lease is up, whichever
+    comes first. Methods may be called from the Handle, Send and Watch
+    threads.
+    """
+
+    def __init__(self, lease: float = SHARED_LEASE):
+        self.lease = lease
+        # Segment name -> references, deadline.
+        self.segments: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def open(self, name: str) -> None:
+        """Track a new segment, held once by the broker itself until released."""
+        with self._lock:
+            self.segments.setdefault(name, [0, time.monotonic() + self.lease])[0] += 1
+
+    def hold(self, name: str) -> None:
+        with self._lock:
+            if (entry := self.segments.get(name)) is not None:
+                entry[0] += 1
+
+    def release(self, name: str) -> None:
+        with self._lock:
+            if (entry := self.segments.get(name)) is None:
+                return
+            entry[0] -= 1
+            if entry[0] > 0:
+                return
+            del self.segments[name]
+        unlink(name)
+
+    def expire(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            due = [name for name, (_, deadline) in self.segments.items() if deadline <= now]
+            for name in due:
+                del self.segments[name]
+        for name in due:
+            logger.warning(f"Lease of shared payload {name} is up, unlinking it")
+            unlink(name)
+
+    def close(self) -> None:
+        """Unlink every segment still tracked."""
+        with self._lock:
+            names = list(self.segments)
+            self.segments.clear()
+        for name in names:
+            unlink(name)
+
+    def __len__(self) -> int:
+        return len(self.segments)
@@ -1,19 +1,40 @@
-from typing import Generator, Protocol, runtime_checkable
+import bisect
+import datetime
+import queue
+import sqlite3
+import threading
+from threading import Thread
+from typing import Generator, Iterator, NamedTuple, Protocol, runtime_checkable
 from uuid import UUID
 
-from .models import Message
+from loguru import logger
+
+from .codec import JSON_CODEC
+from .models import Message, MessageType
+from .utils import POLL_TIMEOUT, drain_queue, generate_datetime
 
 
 @runtime_checkable
 class IMessageStore(Protocol):
     def add_tx_message(self, message: Message) -> None:
-        """Add a message to the RX store."""
+        """Add a message to the TX store."""
         ...
 
     def add_rx_message(self, message: Message) -> None:
         """Add a message to the RX store."""
         ...
 
+    def query(
+        self,
+        message_type: MessageType | None = None,
+        source: str | None = None,
+        topic: str | None = None,
+        since: datetime.datetime | None = None,
+        until: datetime.datetime | None = None,
+    ) -> Generator[Message, None, None]:
+        """Messages matching every given filter, oldest first. `until` is exclusive."""
+        ...
+
     def __contains__(self, message_id: UUID) -> bool:
         """Check if a message is in the store."""
         ...
@@ -39,48 +60,462 @@ class IMessageStore(Protocol):
         ...
 
 
-class InmemMessageStore(IMessageStore):
-    """In-memory message store implementation."""
+class _Key(NamedTuple):
+    timestamp: datetime.datetime
+    id: UUID
+
+
+class _Sequence:
+    """Keys in ascending order, appended at the back and evicted from the front.
+
+    Evicted slots are only reclaimed once they make up half of the list, so
+    both ends are O(1) amortized. Keys that arrive out of order are inserted
+    in place.
+    """
+
+    __slots__ = ("_keys", "_head")
 
     def __init__(self):
-        self._rx_messages: dict[UUID, Message] = {}
-        self._tx_messages: dict[UUID, Message] = {}
+        self._keys: list[_Key] = []
+        self._head = 0
+
+    def add(self, key: _Key) -> None:
+        if len(self._keys) == self._head or self._keys[-1] <= key:
+            self._keys.append(key)
+        else:
+            bisect.insort(self._keys, key, lo=self._head)
+
+    def first(self) -> _Key:
+        return self._keys[self._head]
+
+    def popleft(self) -> _Key:
+        key = self._keys[self._head]
+        self._head += 1
+        if self._head * 2 >= len(self._keys):
+            del self._keys[: self._head]
+            self._head = 0
+        return key
+
+    def remove(self, key: _Key) -> None:
+        index = bisect.bisect_left(self._keys, key, lo=self._head)
+        if index < len(self._keys) and self._keys[index] == key:
+            del self._keys[index]
+
+    def between(
+        self, since: datetime.datetime | None, until: datetime.datetime | None
+    ) -> list[_Key]:
+        """A snapshot of the keys with since <= timestamp < until."""
+        lo = self._head
+        hi = len(self._keys)
+        if since is not None:
+            lo = bisect.bisect_left(self._keys, since, lo=lo, hi=hi, key=_timestamp)
+        if until is not None:
+            hi = bisect.bisect_left(self._keys, until, lo=lo, hi=hi, key=_timestamp)
+        return self._keys[lo:hi]
+
+    def __len__(self) -> int:
+        return len(self._keys) - self._head
+
+
+def _timestamp(key: _Key) -> datetime.datetime:
+    return key.timestamp
+
+
+class _Entry:
+    __slots__ = ("message", "key", "size", "rx", "tx")
+
+    def __init__(self, message: Message, key: _Key, size: int):
+        self.message = message
+        self.key = key
+        self.size = size
+        self.rx = False
+        self.tx = False
+
+
+class InmemMessageStore(IMessageStore):
+    """Bounded in-memory message store.
+
+    Messages are kept ordered by timestamp, then id, as they are added, and
+    are evicted oldest first once the store holds more than `max_messages`
+    messages, more than `max_bytes` of JSON encoded messages and their
+    payloads, or messages
+    older than `max_age` seconds. Each limit is disabled by passing None.
+    Messages are also indexed by type, source and topic, so `query` only
+    walks the smallest matching index, and time ranges are found by
+    bisection. A message that is both received and sent is stored once.
+    """
+
+    def __init__(
+        self,
+        max_messages: int | None = 100_000,
+        max_bytes: int | None = None,
+        max_age: float | None = None,
+    ):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_age = datetime.timedelta(seconds=max_age) if max_age is not None else None
+        self._lock = threading.Lock()
+        self._entries: dict[UUID, _Entry] = {}
+        self._order = _Sequence()
+        self._by_type: dict[MessageType, _Sequence] = {}
+        self._by_source: dict[str, _Sequence] = {}
+        self._by_topic: dict[str, _Sequence] = {}
+        self._bytes = 0
+        self._rx_count = 0
+        self._tx_count = 0
 
     def add_tx_message(self, message: Message) -> None:
-        self._tx_messages[message.id] = message
+        with self._lock:
+            entry = self._add(message)
+            if entry is not None and not entry.tx:
+                entry.tx = True
+                self._tx_count += 1
 
     def add_rx_message(self, message: Message) -> None:
-        self._tx_messages[message.id] = message
+        with self._lock:
+            entry = self._add(message)
+            if entry is not None and not entry.rx:
+                entry.rx = True
+                self._rx_count += 1
+
+    def query(
+        self,
+        message_type: MessageType | None = None,
+        source: str | None = None,
+        topic: str | None = None,
+        since: datetime.datetime | None = None,
+        until: datetime.datetime | None = None,
+    ) -> Generator[Message, None, None]:
+        with self._lock:
+            self._evict_expired()
+            candidates = [self._order]
+            for index, value in (
+                (self._by_type, message_type),
+                (self._by_source, source),
+                (self._by_topic, topic),
+            ):
+                if value is not None:
+                    candidates.append(index.get(value, _Sequence()))
+            keys = min(candidates, key=len).between(since, until)
+        for key in keys:
+            entry = self._entries.get(key.id)
+            if entry is None:
+                continue
+            message = entry.message
+            if message_type is not None and message.type != message_type:
+                continue
+            if source is not None and message.source != source:
+                continue
+            if topic is not None and getattr(message, "topic", None) != topic:
+                continue
+            yield message
+
+    def _add(self, message: Message) -> _Entry | None:
+        """The message's entry, or None if it was evicted as soon as it was added."""
+        entry = self._entries.get(message.id)
+        if entry is not None:
+            return entry
+        size = 0
+        if self.max_bytes is not None:
+            size = len(message.model_dump_json())
+            if message.payload is not None:
+                size += memoryview(message.payload).nbytes
+        key = _Key(message.timestamp, message.id)
+        entry = _Entry(message, key, size)
+        self._entries[message.id] = entry
+        self._bytes += size
+        for index, value in self._index_values(message):
+            if value not in index:
+                index[value] = _Sequence()
+            index[value].add(key)
+        self._order.add(key)
+        self._evict()
+        # Too big for max_bytes or too old for max_age on its own.
+        return entry if message.id in self._entries else None
+
+    def _index_values(self, message: Message) -> Iterator[tuple[dict, object]]:
+        yield self._by_type, message.type
+        yield self._by_source, message.source
+        if (topic := getattr(message, "topic", None)) is not None:
+            yield self._by_topic, topic
+
+    def _evict(self) -> None:
+        while self.max_messages is not None and len(self._entries) > self.max_messages:
+            self._remove(self._order.first())
+        while self.max_bytes is not None and self._bytes > self.max_bytes and self._entries:
+            self._remove(self._order.first())
+        self._evict_expired()
+
+    def _evict_expired(self) -> None:
+        if self.max_age is None:
+            return
+        cutoff = generate_datetime() - self.max_age
+        while self._entries and self._order.first().timestamp < cutoff:
+            self._remove(self._order.first())
+
+    def _remove(self, key: _Key) -> None:
+        entry = self._entries.pop(key.id)
+        self._bytes -= entry.size
+        self._rx_count -= entry.rx
+        self._tx_count -= entry.tx
+        for index, value in self._index_values(entry.message):
+            sequence = index[value]
+            if sequence.first() == key:
+                sequence.popleft()
+            else:
+                sequence.remove(key)
+            if not sequence:
+                del index[value]
+        if self._order.first() == key:
+            self._order.popleft()
+        else:
+            self._order.remove(key)
 
     def __contains__(self, message_id: UUID) -> bool:
-        return message_id in self._rx_messages or message_id in self._tx_messages
+        return message_id in self._entries
 
     def __delitem__(self, message_id: UUID) -> None:
         """Allow dictionary-like deletion of messages."""
-        if message_id in self._rx_messages:
-            del self._rx_messages[message_id]
-        elif message_id in self._tx_messages:
-            del self._tx_messages[message_id]
-        else:
+        with self._lock:
+            if message_id not in self._entries:
+                raise KeyError(f"Message with ID {message_id} not found.")
+            self._remove(self._entries[message_id].key)
+
+    def __getitem__(self, message_id: UUID) -> Message | None:
+        """Allow dictionary-like access to messages."""
+        if (entry := self._entries.get(message_id)) is not None:
+            return entry.message
+
+    def __iter__(self) -> Generator[Message, None, None]:
+        return self.query()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self) -> str:
+        """Provide a developer-friendly string representation."""
+        return (
+            f"<InmemMessageStore(rx_messages={self._rx_count}, tx_messages={self._tx_count}, "
+            f"messages={len(self._entries)})>"
+        )
+
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id BLOB PRIMARY KEY,
+    timestamp INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    source TEXT NOT NULL,
+    topic TEXT,
+    rx INTEGER NOT NULL,
+    tx INTEGER NOT NULL,
+    body BLOB NOT NULL,
+    payload BLOB
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS messages_time ON messages (timestamp, id);
+CREATE INDEX IF NOT EXISTS messages_type ON messages (type, timestamp, id);
+CREATE INDEX IF NOT EXISTS messages_source ON messages (source, timestamp, id);
+CREATE INDEX IF NOT EXISTS messages_topic ON messages (topic, timestamp, id);
+"""
+
+_UPSERT = """
+INSERT INTO messages (id, timestamp, type, source, topic, rx, tx, body, payload)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (id) DO UPDATE SET rx = rx | excluded.rx, tx = tx | excluded.tx
+"""
+
+
+def _micros(timestamp: datetime.datetime) -> int:
+    # Naive datetimes are local time, as datetime.timestamp() takes them.
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc)
+    return (timestamp - _EPOCH) // _MICROSECOND
+
+
+def _row(message: Message, rx: int, tx: int) -> tuple:
+    return (
+        message.id.bytes,
+        _micros(message.timestamp),
+        message.type.value,
+        message.source,
+        getattr(message, "topic", None),
+        rx,
+        tx,
+        JSON_CODEC.encode(message),
+        bytes(message.payload) if message.payload is not None else None,
+    )
+
+
+def _decode(body: bytes, payload: bytes | None) -> Message:
+    message = JSON_CODEC.decode(body)
+    if payload is not None:
+        message = message.model_copy(update={"payload": payload})
+    return message
+
+
+class SqliteMessageStore(IMessageStore):
+    """Durable message store on SQLite.
+
+    Messages are queued and written by a background thread, which commits
+    whatever has piled up (up to a burst) in a single transaction, so
+    callers never wait on disk. Reads first wait for the writes queued
+    before them, so they always see every message added before them.
+    Bodies are kept in the JSON codec, payloads in a column of their own,
+    and rows are indexed by time, type, source and topic. Call `close` to
+    write out the queue before exiting; messages added after it are dropped.
+    """
+
+    PAGE_SIZE: int = 1000
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+        columns = [row[1] for row in self._connection.execute("PRAGMA table_info(messages)")]
+        if "payload" not in columns:
+            self._connection.execute("ALTER TABLE messages ADD COLUMN payload BLOB")
+        self._lock = threading.Lock()
+        self._queue: queue.Queue[tuple] = queue.Queue()
+        # Messages queued and written so far; flush waits for the writes
+        # queued before it rather than for the queue to empty.
+        self._queued = 0
+        self._written = 0
+        self._queue_lock = threading.Lock()
+        self._written_changed = threading.Condition()
+        self._stop = threading.Event()
+        self._writer = Thread(target=self.__write, daemon=True, name="SqliteStore|Write")
+        self._writer.start()
+
+    def close(self) -> None:
+        """Write out queued messages, then close the database."""
+        with self._queue_lock:
+            self._stop.set()
+        self._writer.join()
+        self._connection.close()
+
+    def flush(self) -> None:
+        """Block until every message queued before the call has been committed."""
+        with self._queue_lock:
+            target = self._queued
+        with self._written_changed:
+            while self._written < target and self._writer.is_alive():
+                self._written_changed.wait(POLL_TIMEOUT)
+
+    def add_tx_message(self, message: Message) -> None:
+        self._add(message, 0, 1)
+
+    def add_rx_message(self, message: Message) -> None:
+        self._add(message, 1, 0)
+
+    def _add(self, message: Message, rx: int, tx: int) -> None:
+        with self._queue_lock:
+            if self._stop.is_set():
+                logger.warning(f"Dropping {message.id}: the store is closed")
+                return
+            self._queued += 1
+            self._queue.put((message, rx, tx))
+
+    def __write(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            items = drain_queue(self._queue, POLL_TIMEOUT)
+            if not items:
+                continue
+            rows = []
+            for message, rx, tx in items:
+                try:
+                    rows.append(_row(message, rx, tx))
+                except Exception as e:
+                    # Skipped, so that one bad message cannot stop the writer.
+                    logger.error(f"Cannot store {message.id}: {e}")
+            try:
+                with self._lock:
+                    self._connection.execute("BEGIN")
+                    self._connection.executemany(_UPSERT, rows)
+                    self._connection.execute("COMMIT")
+            except sqlite3.Error as e:
+                logger.error(f"Failed to write {len(rows)} messages: {e}")
+                if self._connection.in_transaction:
+                    self._connection.execute("ROLLBACK")
+            finally:
+                with self._written_changed:
+                    self._written += len(items)
+                    self._written_changed.notify_all()
+
+    def _fetch(self, sql: str, parameters: tuple = ()) -> list:
+        self.flush()
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def query(
+        self,
+        message_type: MessageType | None = None,
+        source: str | None = None,
+        topic: str | None = None,
+        since: datetime.datetime | None = None,
+        until: datetime.datetime | None = None,
+    ) -> Generator[Message, None, None]:
+        clauses: list[str] = []
+        parameters: list = []
+        for column, value in (
+            ("type", message_type.value if message_type is not None else None),
+            ("source", source),
+            ("topic", topic),
+        ):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                parameters.append(value)
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            parameters.append(_micros(since))
+        if until is not None:
+            clauses.append("timestamp < ?")
+            parameters.append(_micros(until))
+        # Page through with a keyset so the lock is never held for a whole scan.
+        position = (-1, b"")
+        while True:
+            where = " AND ".join([*clauses, "(timestamp, id) > (?, ?)"])
+            rows = self._fetch(
+                f"SELECT timestamp, id, body, payload FROM messages WHERE {where} "
+                f"ORDER BY timestamp, id LIMIT {self.PAGE_SIZE}",
+                (*parameters, *position),
+            )
+            for _, _, body, payload in rows:
+                yield _decode(body, payload)
+            if len(rows) < self.PAGE_SIZE:
+                return
+            position = rows[-1][:2]
+
+    def __contains__(self, message_id: UUID) -> bool:
+        return bool(self._fetch("SELECT 1 FROM messages WHERE id = ?", (message_id.bytes,)))
+
+    def __delitem__(self, message_id: UUID) -> None:
+        """Allow dictionary-like deletion of messages."""
+        self.flush()
+        with self._lock:
+            cursor = self._connection.execute(
+                "DELETE FROM messages WHERE id = ?", (message_id.bytes,)
+            )
+        if cursor.rowcount == 0:
             raise KeyError(f"Message with ID {message_id} not found.")
 
     def __getitem__(self, message_id: UUID) -> Message | None:
         """Allow dictionary-like access to messages."""
-        if message_id in self._rx_messages:
-            return self._rx_messages[message_id]
-        if message_id in self._tx_messages:
-            return self._tx_messages[message_id]
+        rows = self._fetch("SELECT body, payload FROM messages WHERE id = ?", (message_id.bytes,))
+        if rows:
+            return _decode(*rows[0])
 
     def __iter__(self) -> Generator[Message, None, None]:
-        rx = list(self._rx_messages.values())
-        tx = list(self._tx_messages.values())
-        both = rx + tx
-        for message in sorted(both, key=lambda message: message.id):
-            yield message
+        return self.query()
 
     def __len__(self) -> int:
-        return len(self._rx_messages) + len(self._tx_messages)
+        return self._fetch("SELECT COUNT(*) FROM messages")[0][0]
 
     def __repr__(self) -> str:
         """Provide a developer-friendly string representation."""
-        return f"<InmemMessageStore(rx_messages={len(self._rx_messages)}, tx_messages={len(self._tx_messages)})>"
+        rx, tx = self._fetch("SELECT COALESCE(SUM(rx), 0), COALESCE(SUM(tx), 0) FROM messages")[0]
+        return f"<SqliteMessageStore(path={self.path!r}, rx_messages={rx}, tx_messages={tx})>"
@@ -0,0 +1,134 @@
+class TopicError(ValueError):
+    """Raised for malformed topic patterns."""
+
+
+class _Node:
+    __slots__ = ("children", "subscribers")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        self.subscribers: set[str] = set()
+
+
+class TopicTrie:
+    """Subscriptions indexed by topic level.
+
+    Topics are split on `.`. In a pattern `*` matches exactly one level and
+    `#`, which must be the last level, matches zero or more levels, so
+    `metrics.#` matches `metrics` as well as `metrics.host_1.cpu`. Each
+    subscriber is stored once per pattern and returned once per match, no
+    matter how many of its patterns match. Matching walks the topic's
+    levels, so its cost depends on the topic and on how many wildcard
+    branches it meets, not on the number of subscriptions. Recent results
+    are cached until the subscriptions change.
+    """
+
+    SEPARATOR: str = "."
+    SINGLE: str = "*"
+    MULTI: str = "#"
+    CACHE_SIZE: int = 4096
+
+    def __init__(self):
+        self._root = _Node()
+        self._patterns: dict[str, set[str]] = {}
+        self._cache: dict[str, frozenset[str]] = {}
+
+    @classmethod
+    def validate(cls, pattern: str) -> list[str]:
+        """Split a pattern into levels, raising TopicError if it is malformed."""
+        levels = pattern.split(cls.SEPARATOR)
+        if not pattern or any(not level for level in levels):
+            raise TopicError(f"Empty topic level in: {pattern!r}")
+        if cls.MULTI in levels[:-1]:
+            raise TopicError(f"'{cls.MULTI}' must be the last level: {pattern!r}")
+        return levels
+
+    def subscribe(self, pattern: str, subscriber: str) -> bool:
+        """Add a subscription. Returns False if it already existed."""
+        node = self._root
+        for level in self.validate(pattern):
+            node = node.children.setdefault(level, _Node())
+        if subscriber in node.subscribers:
+            return False
+        node.subscribers.add(subscriber)
+        self._patterns.setdefault(subscriber, set()).add(pattern)
+        self._cache.clear()
+        return True
+
+    def unsubscribe(self, pattern: str, subscriber: str) -> bool:
+        """Remove a subscription. Returns False if there was none."""
+        path = [self._root]
+        levels = self.validate(pattern)
+        for level in levels:
+            node = path[-1].children.get(level)
+            if node is None:
+                return False
+            path.append(node)
+        if subscriber not in path[-1].subscribers:
+            return False
+        path[-1].subscribers.discard(subscriber)
+        patterns = self._patterns[subscriber]
+        patterns.discard(pattern)
+        if not patterns:
+            del self._patterns[subscriber]
+        # Prune branches that no longer lead to a subscriber.
+        for level, parent, node in zip(
+            reversed(levels), reversed(path[:-1]), reversed(path[1:]), strict=True
+        ):
+            if node.subscribers or node.children:
+                break
+            del parent.children[level]
+        self._cache.clear()
+        return True
+
+    def remove(self, subscriber: str) -> None:
+        """Drop every subscription held by a subscriber."""
+        for pattern in list(self._patterns.get(subscriber, ())):
+            self.unsubscribe(pattern, subscriber)
+
+    def patterns(self, subscriber: str) -> set[str]:
+        """The patterns a subscriber is subscribed to."""
+        return set(self._patterns.get(subscriber, ()))
+
+    def all_patterns(self) -> set[str]:
+        """Every pattern anybody is subscribed to."""
+        return set().union(*self._patterns.values())
+
+    def match(self, topic: str) -> frozenset[str]:
+        """Every subscriber with at least one pattern matching the topic."""
+        cached = self._cache.get(topic)
+        if cached is not None:
+            return cached
+        matched: set[str] = set()
+        nodes = [self._root]
+        for level in topic.split(self.SEPARATOR):
+            following = []
+            for node in nodes:
+                if (multi := node.children.get(self.MULTI)) is not None:
+                    matched |= multi.subscribers
+                if (exact := node.children.get(level)) is not None:
+                    following.append(exact)
+                if (single := node.children.get(self.SINGLE)) is not None:
+                    following.append(single)
+            if not following:
+                break
+            nodes = following
+        else:
+            for node in nodes:
+                matched |= node.subscribers
+                if (multi := node.children.get(self.MULTI)) is not None:
+                    matched |= multi.subscribers
+        result = frozenset(matched)
+        if len(self._cache) >= self.CACHE_SIZE:
+            self._cache.clear()
+        self._cache[topic] = result
+        return result
+
+    def __contains__(self, topic: str) -> bool:
+        return bool(self.match(topic))
+
+    def __len__(self) -> int:
+        return sum(len(patterns) for patterns in self._patterns.values())
+
+    def __repr__(self) -> str:
+        return f"<TopicTrie(subscribers={len(self._patterns)}, subscriptions={len(self)})>"
@@ -0,0 +1,224 @@
+import json
+import os
+import threading
+import time
+from enum import Enum
+from pathlib import Path
+from typing import Iterable, NamedTuple, Protocol, runtime_checkable
+from uuid import UUID
+
+from .histogram import Histogram
+
+CATEGORY: str = "pyaduct"
+
+
+class Stage(str, Enum):
+    """The stages of a message's life, in order."""
+
+    # Put on the client's send queue by publish, respond or a request.
+    CLIENT_ENQUEUE = "client_enqueue"
+    # Handed to the socket, or to the broker for inproc clients.
+    CLIENT_TX = "client_tx"
+    # Read off the socket by the broker's Listen thread.
+    BROKER_RX = "broker_rx"
+    # Header, and body if needed, decoded by the Handle thread.
+    VALIDATE = "validate"
+    # Routed or handled by the Handle thread; the Send thread may already
+    # be sending it on.
+    ROUTE = "route"
+    # Handed to the socket for one receiver.
+    BROKER_TX = "broker_tx"
+    # Read off the socket by a receiving client.
+    CLIENT_RX = "client_rx"
+    # Queued for the application, or its future completed.
+    HANDLED = "handled"
+
+
+class Stamp(NamedTuple):
+    """One stage of one message; `time` is monotonic, in nanoseconds.
+
+    `trace` is the message's own id, or the request's for a response, so
+    that a request and its response make up one trace.
+    """
+
+    stage: Stage
+    id: UUID
+    trace: UUID
+    node: str
+    time: int
+    thread: int
+
+
+@runtime_checkable
+class ITracer(Protocol):
+    def sampled(self, trace: UUID) -> bool:
+        """Whether to record the stages of a trace.
+
+        Decided from the trace id alone, so that every process samples
+        the same traces without telling each other.
+        """
+        ...
+
+    def record(self, stamp: Stamp) -> None:
+        """Keep a stamp; called from the thread that reached the stage."""
+        ...
+
+
+def stamp(
+    tracer: ITracer, stage: Stage, node: str, message_id: UUID, ref: UUID | None = None
+) -> None:
+    """Stamp a stage of a message if its trace is sampled.
+
+    Callers only call this when they have a tracer, so that tracing costs
+    one attribute check per stage when it is off.
+    """
+    trace = ref or message_id
+    if tracer.sampled(trace):
+        tracer.record(
+            Stamp(stage, message_id, trace, node, time.monotonic_ns(), threading.get_native_id())
+        )
+
+
+def sampled(trace: UUID, sample: float) -> bool:
+    """Sample a `sample` fraction of traces by the random low bits of their id."""
+    return (trace.int & 0xFFFFFFFF) < sample * 2**32
+
+
+class ChromeTracer(ITracer):
+    """Keeps stamps in memory and writes them as a Chrome trace on `close`.
+
+    The file opens in Perfetto or chrome://tracing, with a span between
+    each stage of a message and the next, and one around each trace. Only
+    a `sample` fraction of traces is recorded, and no more than `limit`
+    stamps. Stamps of one host share a clock, so `merge` can join the
+    files of several processes into traces that cross them.
+    """
+
+    def __init__(self, path: Path, sample: float = 1.0, limit: int = 1_000_000):
+        self.path = Path(path)
+        self.sample = sample
+        self.limit = limit
+        self.stamps: list[Stamp] = []
+        self.dropped = 0
+        self._threads: dict[int, str] = {}
+
+    def sampled(self, trace: UUID) -> bool:
+        return sampled(trace, self.sample)
+
+    def record(self, stamp: Stamp) -> None:
+        if len(self.stamps) >= self.limit:
+            self.dropped += 1
+            return
+        self.stamps.append(stamp)
+        if stamp.thread not in self._threads:
+            self._threads[stamp.thread] = threading.current_thread().name
+
+    def close(self) -> None:
+        pid = os.getpid()
+        metadata = [
+            _metadata("thread_name", pid, thread, name)
+            for thread, name in list(self._threads.items())
+        ]
+        metadata.append(_metadata("process_name", pid, 0, f"pyaduct {pid}"))
+        write(self.path, metadata + events([(pid, stamp) for stamp in list(self.stamps)]))
+
+
+def _metadata(kind: str, pid: int, thread: int, name: str) -> dict:
+    return {"name": kind, "ph": "M", "pid": pid, "tid": thread, "args": {"name": name}}
+
+
+def _instant(pid: int, stamp: Stamp) -> dict:
+    return {
+        "name": stamp.stage.value,
+        "cat": CATEGORY,
+        "ph": "i",
+        "s": "t",
+        "ts": stamp.time / 1000,
+        "pid": pid,
+        "tid": stamp.thread,
+        "args": {"id": str(stamp.id), "trace": str(stamp.trace), "node": stamp.node},
+    }
+
+
+def _span(name: str, trace: UUID, start: int, end: int, pid: int, thread: int) -> list[dict]:
+    span = {"name": name, "cat": CATEGORY, "id": trace.hex, "pid": pid, "tid": thread}
+    return [{**span, "ph": "b", "ts": start / 1000}, {**span, "ph": "e", "ts": end / 1000}]
+
+
+def traces(stamps: Iterable[tuple[int, Stamp]]) -> dict[UUID, list[tuple[int, Stamp]]]:
+    """Stamps, with the process they were taken in, by trace and in time order."""
+    by_trace: dict[UUID, list[tuple[int, Stamp]]] = {}
+    for pid, stamp in stamps:
+        by_trace.setdefault(stamp.trace, []).append((pid, stamp))
+    for trail in by_trace.values():
+        trail.sort(key=lambda item: item[1].time)
+    return by_trace
+
+
+def events(stamps: list[tuple[int, Stamp]]) -> list[dict]:
+    """Chrome trace events of stamps: one instant per stamp, spans between them.
+
+    Each span sits with the stamp that ends it, so the time a message
+    spends on the wire shows on its receiver.
+    """
+    result = [_instant(pid, stamp) for pid, stamp in stamps]
+    for trace, trail in traces(stamps).items():
+        if len(trail) < 2:
+            continue
+        (pid, first), (_, last) = trail[0], trail[-1]
+        result += _span("message", trace, first.time, last.time, pid, first.thread)
+        for (_, before), (pid, after) in zip(trail, trail[1:], strict=False):
+            name = f"{before.stage.value} > {after.stage.value}"
+            result += _span(name, trace, before.time, after.time, pid, after.thread)
+    return result
+
+
+def write(path: Path, trace_events: list[dict]) -> None:
+    report = {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+    Path(path).write_text(json.dumps(report))
+
+
+def load(path: Path) -> tuple[list[tuple[int, Stamp]], list[dict]]:
+    """The stamps and the metadata events of a Chrome trace file."""
+    stamps, metadata = [], []
+    for event in json.loads(Path(path).read_text())["traceEvents"]:
+        if event["ph"] == "M":
+            metadata.append(event)
+        elif event["ph"] == "i" and event.get("cat") == CATEGORY:
+            args = event["args"]
+            stamp = Stamp(
+                Stage(event["name"]),
+                UUID(args["id"]),
+                UUID(args["trace"]),
+                args["node"],
+                round(event["ts"] * 1000),
+                event["tid"],
+            )
+            stamps.append((event["pid"], stamp))
+    return stamps, metadata
+
+
+def merge(paths: Iterable[Path], output: Path) -> list[tuple[int, Stamp]]:
+    """Join the trace files of processes on one host, spanning the hops between them."""
+    stamps, metadata = [], []
+    for path in paths:
+        file_stamps, file_metadata = load(path)
+        stamps += file_stamps
+        metadata += file_metadata
+    write(output, metadata + events(stamps))
+    return stamps
+
+
+def breakdown(stamps: Iterable[tuple[int, Stamp]]) -> dict[str, Histogram]:
+    """Microseconds spent between consecutive stages, and end to end, over all traces."""
+    spans: dict[str, Histogram] = {}
+    for trail in traces(stamps).values():
+        if len(trail) < 2:
+            continue
+        spans.setdefault("message", Histogram()).record(
+            (trail[-1][1].time - trail[0][1].time) / 1000
+        )
+        for (_, before), (_, after) in zip(trail, trail[1:], strict=False):
+            name = f"{before.stage.value} > {after.stage.value}"
+            spans.setdefault(name, Histogram()).record((after.time - before.time) / 1000)
+    return spans
@@ -1,11 +1,22 @@
 import datetime
 import hashlib
+import queue
 import random
 import string
+from multiprocessing.queues import Queue as ProcessQueue
 from uuid import UUID
 
 from uuid_extensions import uuid7
 
+# How long a blocked thread waits before re-checking its stop flag.
+POLL_TIMEOUT: float = 0.1
+# Upper bound on messages moved per wakeup, so one busy direction cannot
+# starve the other.
+BURST_SIZE: int = 256
+# How often a Listen thread that stopped reading, because the queue it fills
+# is full, checks whether that queue has drained.
+THROTTLE_TIMEOUT: float = 0.001
+
 
 def generate_random_md5():
     random_string = "".join(random.choices(string.ascii_letters + string.digits, k=32))
@@ -22,3 +33,17 @@ def generate_uuid7() -> UUID:
 
 def generate_datetime() -> datetime.datetime:
     return datetime.datetime.now(datetime.timezone.utc)
+
+
+def drain_queue(source: queue.Queue | ProcessQueue, timeout: float = POLL_TIMEOUT) -> list:
+    """Block until at least one item is queued, then take up to a burst."""
+    try:
+        items = [source.get(timeout=timeout)]
+    except queue.Empty:
+        return []
+    while len(items) < BURST_SIZE:
+        try:
+            items.append(source.get(block=False))
+        except queue.Empty:
+            break
+    return items
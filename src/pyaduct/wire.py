@@ -0,0 +1,333 @@
+import struct
+from typing import Callable, NamedTuple
+from uuid import UUID
+
+from loguru import logger
+from zmq import Frame
+
+from . import compression, shm
+from .codec import BINARY_CODEC, JSON_CODEC, BinaryCodec, CodecError, ICodec, decode
+from .models import Event, Message, MessageType, Request, Response
+
+# magic, type code, id, ref, deadline, flags, len(source), len(route), len(key)
+_HEADER = struct.Struct("<2sB16s16sdBHHH")
+_MAGIC = b"\xa1\x02"
+# Headers without a key, as found in event logs written before keys existed.
+_HEADER_V1 = struct.Struct("<2sB16s16sdBHH")
+_MAGIC_V1 = b"\xa1\x01"
+_TYPES: list[MessageType] = list(MessageType)
+_CODES: dict[MessageType, int] = {t: i for i, t in enumerate(_TYPES)}
+_NO_REF = bytes(16)
+# Header flags.
+SHARED: int = 0x01  # The payload frame is a shared memory handle, see shm.
+GROUP: int = 0x02  # A consumer group delivery to the member named by `key`.
+
+
+class Header(NamedTuple):
+    """Routing fields of a message, carried in their own small frame.
+
+    `route` is the target of a Request, the topic of an Event or the
+    requestor of a Response. `ref` is the request id a Response answers.
+    `deadline` is the Unix time after which a Request is abandoned, zero
+    for everything else. `key` is a Request's balancing key, see
+    `Request.key`, or the member a consumer group delivery is for.
+    `flags` is a combination of the flags above.
+    """
+
+    type: MessageType
+    id: UUID
+    source: str
+    route: str = ""
+    ref: UUID | None = None
+    deadline: float = 0.0
+    flags: int = 0
+    key: str = ""
+
+    @classmethod
+    def from_message(cls, message: Message) -> "Header":
+        if isinstance(message, Request):
+            deadline = message.timestamp.timestamp() + message.timeout
+            return cls(
+                message.type,
+                message.id,
+                message.source,
+                message.target,
+                None,
+                deadline,
+                key=message.key or "",
+            )
+        if isinstance(message, Response):
+            return cls(
+                message.type, message.id, message.source, message.requestor, message.request_id
+            )
+        if isinstance(message, Event):
+            return cls(message.type, message.id, message.source, message.topic)
+        return cls(message.type, message.id, message.source)
+
+    def encode(self) -> bytes:
+        source = self.source.encode("utf-8")
+        route = self.route.encode("utf-8")
+        key = self.key.encode("utf-8")
+        ref = self.ref.bytes if self.ref is not None else _NO_REF
+        fixed = _HEADER.pack(
+            _MAGIC,
+            _CODES[self.type],
+            self.id.bytes,
+            ref,
+            self.deadline,
+            self.flags,
+            len(source),
+            len(route),
+            len(key),
+        )
+        return b"".join((fixed, source, route, key))
+
+    @classmethod
+    def decode(cls, frame: bytes) -> "Header":
+        layout = _layout(frame)
+        magic, code, id_, ref, deadline, flags, source_len, route_len, *key_len = (
+            layout.unpack_from(frame)
+        )
+        offset = layout.size
+        source = str(frame[offset : offset + source_len], "utf-8")
+        offset += source_len
+        route = str(frame[offset : offset + route_len], "utf-8")
+        offset += route_len
+        key = str(frame[offset : offset + key_len[0]], "utf-8") if key_len else ""
+        return cls(
+            _TYPES[code],
+            UUID(bytes=id_),
+            source,
+            route,
+            UUID(bytes=ref) if ref != _NO_REF else None,
+            deadline,
+            flags,
+            key,
+        )
+
+
+def _layout(frame: bytes) -> struct.Struct:
+    magic = frame[:2]
+    if magic == _MAGIC:
+        return _HEADER
+    if magic == _MAGIC_V1:
+        return _HEADER_V1
+    raise CodecError("Frame is not a routing header")
+
+
+def peek(frame: bytes) -> tuple[MessageType, bytes, bytes]:
+    """Type, source and route of a header frame, without decoding the rest."""
+    layout = _layout(frame)
+    source_len, route_len = layout.unpack_from(frame)[6:8]
+    offset = layout.size
+    source = frame[offset : offset + source_len]
+    return _TYPES[frame[2]], source, frame[offset + source_len : offset + source_len + route_len]
+
+
+def trace_ids(frame: bytes) -> tuple[UUID, UUID | None]:
+    """Id and ref of a header frame, without decoding the rest."""
+    message_id, ref = _layout(frame).unpack_from(frame)[2:4]
+    return UUID(bytes=message_id), UUID(bytes=ref) if ref != _NO_REF else None
+
+
+def correlation(frame: bytes) -> tuple[bytes, bytes, float]:
+    """Raw id, ref and deadline of a header frame, without decoding the rest."""
+    return _layout(frame).unpack_from(frame)[2:5]
+
+
+def member_of(frame: bytes) -> str | None:
+    """The member of a consumer group a header frame delivers its event to, if any."""
+    layout = _layout(frame)
+    if not layout.unpack_from(frame)[5] & GROUP:
+        return None
+    return Header.decode(frame).key
+
+
+def unpack_frames(frames: list[Frame]) -> list[bytes | Frame]:
+    """Frames received with `copy=False`, as bytes except for a payload frame.
+
+    The header and body are small and parsed, so they are copied out. A
+    payload frame after them is kept as the Frame it arrived in, to be
+    forwarded or read in place without a copy.
+    """
+    frames = [frame for frame in frames if len(frame)]
+    return [frame.bytes for frame in frames[:2]] + frames[2:]
+
+
+def codec_of(body: bytes) -> ICodec:
+    """The codec a body frame was encoded with."""
+    return BINARY_CODEC if body[:1] == BinaryCodec.MAGIC else JSON_CODEC
+
+
+def as_bytes(payload: bytes | memoryview | Frame) -> bytes:
+    return payload.bytes if isinstance(payload, Frame) else bytes(payload)
+
+
+def as_buffer(payload: bytes | memoryview | Frame) -> bytes | memoryview:
+    """A payload as Message.payload holds it: frames are viewed, not copied."""
+    return payload.buffer if isinstance(payload, Frame) else payload
+
+
+def share_payload(header: Header, payload: bytes | memoryview) -> tuple[Header, bytes]:
+    """The header and handle to send a payload through shared memory with.
+
+    Falls back to sending the payload itself if no segment can be created.
+    """
+    try:
+        return header._replace(flags=header.flags | SHARED), shm.share(payload)
+    except OSError as e:
+        logger.warning(f"Sending payload of {header.id} inline: {e}")
+        return header, payload
+
+
+def receive_payload(frames: list[bytes | Frame]) -> tuple[bytes | memoryview | None, str | None]:
+    """The payload of received `[header, body, payload]` frames.
+
+    A payload sent through shared memory is mapped, and the name of its
+    segment is returned too, to be released to the broker.
+    """
+    if not Header.decode(frames[0]).flags & SHARED:
+        return as_buffer(frames[2]), None
+    handle = as_bytes(frames[2])
+    segment = shm.segment_of(handle)
+    try:
+        return shm.attach(handle), segment
+    except FileNotFoundError:
+        logger.error(f"Shared payload {segment} is gone")
+        return None, segment
+
+
+class Envelope:
+    """A message in flight: its header plus the body frame as received.
+
+    The body is only decoded when somebody asks for `message`, and is only
+    re-encoded when a receiver negotiated a different codec than the
+    sender. Every re-encoding is kept, so fanning an event out to many
+    subscribers costs at most one encode per codec. A payload frame is
+    passed along as it is, to every receiver, and so is the handle of a
+    payload in shared memory, which `inline` swaps for its contents. A
+    compressed body is passed along to the receivers that can decompress
+    it, and only decompressed for the others.
+    """
+
+    __slots__ = ("header", "payload", "_header_frame", "_message", "_bodies", "_compressed")
+
+    def __init__(
+        self,
+        header: Header,
+        body: bytes | None = None,
+        header_frame: bytes | None = None,
+        message: Message | None = None,
+        payload: bytes | memoryview | Frame | None = None,
+    ):
+        assert body is not None or message is not None, "Envelope needs a body or a message"
+        self.header = header
+        self.payload = payload
+        self._header_frame = header_frame
+        self._message = message
+        self._bodies: dict[str, bytes] = {}
+        self._compressed: bytes | None = None
+        if body is not None and compression.is_compressed(body):
+            self._compressed = body
+        elif body is not None:
+            self._bodies[codec_of(body).name] = body
+
+    @classmethod
+    def from_frames(cls, frames: list[bytes | Frame]) -> "Envelope":
+        """Parse `[header, body, payload?]` frames, or a legacy `TYPE {json}` frame."""
+        if len(frames) == 1:
+            message = decode(frames[0])
+            return cls(Header.from_message(message), frames[0], message=message)
+        header_frame, body = frames[0], frames[1]
+        payload = frames[2] if len(frames) > 2 else None
+        return cls(Header.decode(header_frame), body, header_frame=header_frame, payload=payload)
+
+    @classmethod
+    def from_message(cls, message: Message) -> "Envelope":
+        """Wrap a locally built message; bodies are encoded per receiver on demand."""
+        return cls(Header.from_message(message), message=message, payload=message.payload)
+
+    @property
+    def header_frame(self) -> bytes:
+        if self._header_frame is None:
+            self._header_frame = self.header.encode()
+        return self._header_frame
+
+    @property
+    def message(self) -> Message:
+        """The fully validated message, decoded on first access."""
+        if self._message is None:
+            message = decode(next(iter(self._inflated().values())))
+            if self.payload is not None and self.shared is None:
+                message = message.model_copy(update={"payload": as_buffer(self.payload)})
+            self._message = message
+        return self._message
+
+    @property
+    def shared(self) -> str | None:
+        """The segment holding the payload, if it was sent through shared memory."""
+        if self.payload is None or not self.header.flags & SHARED:
+            return None
+        return shm.segment_of(as_bytes(self.payload))
+
+    def inline(self) -> "Envelope":
+        """This envelope with the payload in place of its shared memory handle.
+
+        Raises FileNotFoundError if the segment is gone.
+        """
+        payload = shm.attach(as_bytes(self.payload))
+        header = self.header._replace(flags=self.header.flags & ~SHARED)
+        inlined = Envelope(header, self.raw_body, payload=payload)
+        inlined._bodies = self._bodies
+        return inlined
+
+    def for_member(self, name: str) -> "Envelope":
+        """This envelope as a consumer group delivery to the named member.
+
+        Sessions hosting several members tell them apart by it.
+        """
+        header = self.header._replace(flags=self.header.flags | GROUP, key=name)
+        delivery = Envelope(header, self.raw_body, message=self._message, payload=self.payload)
+        delivery._bodies = self._bodies
+        return delivery
+
+    def _inflated(self) -> dict[str, bytes]:
+        """The bodies, decompressing a compressed one on first use."""
+        if not self._bodies and self._compressed is not None:
+            body = compression.decompress(self._compressed)
+            self._bodies[codec_of(body).name] = body
+        return self._bodies
+
+    @property
+    def raw_body(self) -> bytes:
+        """The body as it arrived, or JSON for a locally built message."""
+        if self._compressed is not None:
+            return self._compressed
+        for body in self._bodies.values():
+            return body
+        return self.body(JSON_CODEC)
+
+    def body(self, codec: ICodec, accepts: Callable[[bytes], bool] | None = None) -> bytes:
+        """The body in the given codec, passing the original through untouched.
+
+        A compressed body is passed through if `accepts` it.
+        """
+        if self._compressed is not None and accepts is not None and accepts(self._compressed):
+            return self._compressed
+        bodies = self._inflated()
+        if codec.name not in bodies:
+            bodies[codec.name] = codec.encode(self.message)
+        return bodies[codec.name]
+
+    def frames(
+        self, codec: ICodec, envelope: bool, accepts: Callable[[bytes], bool] | None = None
+    ) -> list[bytes | Frame]:
+        """Wire frames for a receiver with the given codec, framing and compression.
+
+        Receivers without the header framing cannot take a payload.
+        """
+        if not envelope:
+            return [self.body(codec, accepts)]
+        if self.payload is not None:
+            return [self.header_frame, self.body(codec, accepts), self.payload]
+        return [self.header_frame, self.body(codec, accepts)]
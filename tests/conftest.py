@@ -55,24 +55,28 @@ def certs() -> Generator[tuple[Path, Path], None, None]:
 
 
 @pytest.fixture
-def ipc_broker():
+def ipc_address(tmp_path) -> str:
+    """An IPC address whose socket file lives in the test's temporary directory."""
+    return f"ipc://{tmp_path}/pyaduct"
+
+
+@pytest.fixture
+def ipc_broker(ipc_address):
     """A fixture that provides an IPC broker for testing."""
     store = InmemMessageStore()
-    address = "ipc://pyaduct"
     context = Context()
     socket = context.socket(ROUTER)
-    socket.bind(address)
+    socket.bind(ipc_address)
     broker = Broker(socket, store=store, latency=(0.3, 0.7))
     broker.start()
     yield broker
     broker.stop()
 
 
-def generate_ipc_client(ctx: Context, client_name: str) -> Client:
+def generate_ipc_client(ctx: Context, client_name: str, address: str) -> Client:
     """Generate an IPC client with the given name."""
     assert isinstance(client_name, str), "Client name must be a string"
     socket = ctx.socket(DEALER)
-    address = "ipc://pyaduct"
     socket.connect(address)
     store = InmemMessageStore()
     client = Client(socket, store=store, name=client_name)
@@ -80,20 +84,20 @@ def generate_ipc_client(ctx: Context, client_name: str) -> Client:
 
 
 @pytest.fixture
-def ipc_client_1(ctx, ipc_broker):
+def ipc_client_1(ctx, ipc_broker, ipc_address):
     """A fixture that provides an IPC client for testing."""
     _ = ipc_broker  # to ensure broker is started before client
-    client = generate_ipc_client(ctx, "client_1")
+    client = generate_ipc_client(ctx, "client_1", ipc_address)
     client.start()
     yield client
     client.stop()
 
 
 @pytest.fixture
-def ipc_client_2(ctx, ipc_broker):
+def ipc_client_2(ctx, ipc_broker, ipc_address):
     """A fixture that provides an IPC client for testing."""
     _ = ipc_broker  # to ensure broker is started before client
-    client = generate_ipc_client(ctx, "client_2")
+    client = generate_ipc_client(ctx, "client_2", ipc_address)
     client.start()
     yield client
     client.stop()
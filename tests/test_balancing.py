@@ -0,0 +1,56 @@
+from collections import Counter
+
+import pytest
+
+from pyaduct.balancing import BalancingError, ServiceGroup
+from pyaduct.models import Request
+from pyaduct.wire import Header
+
+
+def _header(key: str | None = None, source: str = "caller") -> Header:
+    return Header.from_message(Request(source=source, target="resize", body="x", key=key))
+
+
+def test_round_robin_takes_turns():
+    group = ServiceGroup("resize")
+    for replica in (b"a", b"b", b"c"):
+        group.add(replica)
+    assert [group.dispatch(_header()) for _ in range(6)] == [b"a", b"b", b"c"] * 2
+    assert group.in_flight == {b"a": 2, b"b": 2, b"c": 2}
+    group.release(b"a")
+    group.release(b"a")
+    group.release(b"a")
+    assert group.in_flight[b"a"] == 0
+
+
+def test_least_outstanding_prefers_idle_replicas():
+    group = ServiceGroup("resize", "least_outstanding")
+    for replica in (b"a", b"b"):
+        group.add(replica)
+    assert {group.dispatch(_header()), group.dispatch(_header())} == {b"a", b"b"}
+    group.release(b"b")
+    assert group.dispatch(_header()) == b"b"
+    assert group.dispatch(_header()) in (b"a", b"b")
+
+
+def test_consistent_hash_is_sticky_and_moves_few_keys():
+    group = ServiceGroup("resize", "consistent_hash")
+    for replica in (b"a", b"b", b"c"):
+        group.add(replica)
+    keys = [f"user-{i}" for i in range(1000)]
+    before = {key: group.dispatch(_header(key)) for key in keys}
+    assert before == {key: group.dispatch(_header(key)) for key in keys}
+    assert min(Counter(before.values()).values()) > 200
+    group.add(b"d")
+    after = {key: group.dispatch(_header(key)) for key in keys}
+    moved = [key for key in keys if before[key] != after[key]]
+    assert all(after[key] == b"d" for key in moved)
+    assert 100 < len(moved) < 400
+    # Without a key the requester is the key.
+    assert group.dispatch(_header(source="x")) == group.dispatch(_header("x"))
+
+
+def test_unknown_policy():
+    with pytest.raises(BalancingError):
+        ServiceGroup("resize", "random")
+    assert ServiceGroup("resize").dispatch(_header()) is None
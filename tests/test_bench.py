@@ -0,0 +1,40 @@
+import pytest
+
+from pyaduct import bench
+
+
+@pytest.mark.parametrize("scenario", bench.SCENARIOS)
+def test_run_inproc(scenario):
+    result = bench.run(scenario, "inproc", messages=600, samples=50, subscribers=2)
+    assert result.scenario == scenario and result.transport == "inproc"
+    assert result.throughput > 0
+    assert 0 < result.p50 <= result.p99 <= result.p999
+
+
+def test_save_and_compare(tmp_path):
+    baseline = [
+        bench.Result("publish", "tcp", 10_000, 100, 200, 900),
+        bench.Result("ping", "tcp", 1_000, 500, 900, 2_000),
+    ]
+    path = tmp_path / "baseline.json"
+    bench.save(path, baseline, {"messages": 10})
+    assert bench.load(path) == baseline
+    results = [
+        # Within the threshold, and p999 is not compared.
+        bench.Result("publish", "tcp", 9_500, 105, 210, 5_000),
+        bench.Result("ping", "tcp", 800, 500, 1_000, 2_000),
+        bench.Result("fanout", "tcp", 1, 1, 1, 1),
+    ]
+    regressions = bench.compare(baseline, results, 0.1)
+    assert len(regressions) == 2
+    assert all(regression.startswith("ping/tcp") for regression in regressions)
+
+
+def test_environment_without_the_package(monkeypatch):
+    """A source checkout that is not installed reports its git revision instead."""
+
+    def version(name):
+        raise bench.metadata.PackageNotFoundError(name)
+
+    monkeypatch.setattr(bench.metadata, "version", version)
+    assert bench.environment()["pyaduct"].startswith(("git-", "unknown"))
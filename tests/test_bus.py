@@ -1,5 +1,31 @@
-from pyaduct import Broker, Client, Event
-from pyaduct.store import IMessageStore
+import asyncio
+import threading
+import time
+from queue import Empty
+
+import pytest
+import zmq.asyncio
+from pydantic import ValidationError
+from zmq import DEALER
+
+from pyaduct import (
+    AsyncClient,
+    Broker,
+    Client,
+    Command,
+    Event,
+    Register,
+    Session,
+    Subscribe,
+    compression,
+)
+from pyaduct.client import ClientException, ResponseTimeout
+from pyaduct.codec import JSON_CODEC, decode
+from pyaduct.compression import Compression
+from pyaduct.log import TopicLog
+from pyaduct.models import MessageType
+from pyaduct.store import IMessageStore, InmemMessageStore
+from pyaduct.wire import Header
 
 
 def test_ipc_bus(
@@ -20,3 +46,576 @@ def test_ipc_bus(
     assert ipc_client_1.ping("client_2")
     assert len(ipc_broker.store) == 9
     assert ipc_client_1.get_clients() == ["client_2"]
+
+
+def test_ipc_concurrent_requests(
+    ipc_broker: Broker,
+    ipc_client_1: Client,
+    ipc_client_2: Client,
+):
+    """Many requests can be in flight at once without a worker per request."""
+    ipc_broker._latency = None
+    stop = threading.Event()
+
+    def serve():
+        while not stop.is_set():
+            try:
+                request = ipc_client_2.requests.get(timeout=0.1)
+            except Empty:
+                continue
+            ipc_client_2.respond(request, request.body.upper())
+
+    server = threading.Thread(target=serve)
+    server.start()
+    try:
+        requests = [ipc_client_1.generate_request("client_2", f"r{i}") for i in range(200)]
+        futures = [ipc_client_1.submit(request) for request in requests]
+        bodies = [future.result(timeout=10).body for future in futures]
+        assert bodies == [f"R{i}" for i in range(200)]
+        assert not ipc_client_1._pending_requests
+        # Requests for unknown targets fail at once, not at their deadline.
+        with pytest.raises(ResponseTimeout, match="Broker"):
+            ipc_client_1.submit(ipc_client_1.generate_request("nobody", "x"), 30).result(3)
+        assert not ipc_client_1._pending_requests
+        assert not ipc_broker._pending
+    finally:
+        stop.set()
+        server.join()
+
+
+def test_ipc_mixed_codecs(ctx, ipc_address, ipc_broker: Broker, ipc_client_1: Client):
+    """Binary, JSON and legacy single-frame clients share one broker."""
+    ipc_broker._latency = None
+    socket = ctx.socket(DEALER)
+    socket.connect(ipc_address)
+    client = Client(socket, name="binary_client", codecs=["binary", "json"])
+    client.start()
+    socket = ctx.socket(DEALER)
+    socket.connect(ipc_address)
+    legacy = Client(socket, name="legacy_client", envelope=False)
+    legacy.start()
+    try:
+        assert client._codec.name == "binary" and client._envelope
+        assert ipc_client_1._codec.name == "json" and ipc_client_1._envelope
+        assert legacy._codec.name == "json" and not legacy._envelope
+        events = ipc_client_1.subscribe("mixed")
+        legacy_events = legacy.subscribe("mixed")
+        client.publish(client.generate_event("mixed", "from binary"))
+        assert events.get(timeout=2).body == "from binary"
+        assert legacy_events.get(timeout=2).body == "from binary"
+        assert client.ping("client_1")
+        assert ipc_client_1.ping("binary_client")
+        assert legacy.ping("binary_client")
+    finally:
+        legacy.stop()
+        client.stop()
+
+
+def test_ipc_wildcard_subscriptions(ipc_broker: Broker, ipc_client_1: Client, ipc_client_2: Client):
+    """Overlapping patterns deliver once per pattern queue, and unsubscribe stops delivery."""
+    ipc_broker._latency = None
+    cpu = ipc_client_1.subscribe("metrics.*.cpu")
+    everything = ipc_client_1.subscribe("metrics.#")
+    assert ipc_client_1.subscribe("metrics.#") is everything
+    ipc_client_2.publish(ipc_client_2.generate_event("metrics.host_1.cpu", "42"))
+    assert cpu.get(timeout=2).body == "42"
+    assert everything.get(timeout=2).body == "42"
+    ipc_client_1.unsubscribe("metrics.*.cpu")
+    ipc_client_2.publish(ipc_client_2.generate_event("metrics.host_1.cpu", "43"))
+    assert everything.get(timeout=2).body == "43"
+    assert everything.empty() and cpu.empty()
+    assert ipc_broker._topics.patterns("client_1") == {"metrics.#"}
+
+
+def test_ipc_broker_request_timeout(ipc_broker: Broker, ipc_client_1: Client, ipc_client_2: Client):
+    """The broker fails an unanswered request at its deadline, ahead of the client."""
+    ipc_broker._latency = None
+    request = ipc_client_1.generate_request("client_2", "never answered", timeout=1)
+    future = ipc_client_1.submit(request, timeout=30)
+    assert ipc_client_2.requests.get(timeout=2).id == request.id
+    with pytest.raises(ResponseTimeout, match="Broker"):
+        future.result(timeout=5)
+    assert not ipc_client_1._pending_requests
+    assert not ipc_broker._pending
+    ipc_client_2.respond(request, "too late")
+    assert ipc_client_1.ping("client_2")
+
+
+def test_ipc_broker_survives_bad_messages(
+    ipc_broker: Broker, ipc_client_1: Client, ipc_client_2: Client
+):
+    """Invalid bodies and failing handlers drop one message, not the Handle thread."""
+    command = Command(source="client_1", target="broker", body="GET_CLIENTS")
+    header = Header.from_message(command).encode()
+    ipc_broker._rx_queue.put((b"bogus", [header, b"not a body"]))
+
+    def fail(message, client_id):
+        raise RuntimeError("handler failed")
+
+    ipc_broker._handlers[MessageType.COMMAND] = fail
+    ipc_broker._rx_queue.put((b"bogus", [header, JSON_CODEC.encode(command)]))
+    dropped = ipc_broker.metrics.snapshot()["metrics"]["pyaduct_broker_dropped_total"]
+    deadline = time.monotonic() + 2
+    while len(dropped["values"]) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+        dropped = ipc_broker.metrics.snapshot()["metrics"]["pyaduct_broker_dropped_total"]
+    assert dropped["values"] == {"invalid": 1, "handler_error": 1}
+    assert ipc_client_1.ping("client_2")
+
+
+def test_ipc_client_survives_unsendable_messages(ipc_broker: Broker, ipc_client_1: Client):
+    """A message that fails to encode is dropped, and its request fails at once."""
+    ipc_broker._latency = None
+    codec = ipc_client_1._codec
+
+    class Failing:
+        name = codec.name
+
+        def encode(self, message):
+            if getattr(message, "body", None) == "boom":
+                raise ValueError("boom")
+            return codec.encode(message)
+
+    ipc_client_1._codec = Failing()
+    ipc_client_1.publish(ipc_client_1.generate_event("anything", "boom"))
+    future = ipc_client_1.submit(ipc_client_1.generate_request("client_1", "boom"), 30)
+    with pytest.raises(ClientException, match="Failed to send"):
+        future.result(timeout=2)
+    assert ipc_client_1.ping("client_1")
+    dropped = ipc_client_1.metrics.snapshot()["metrics"]["pyaduct_client_dropped_total"]
+    assert dropped["values"]["send_error"] == 2
+
+
+def test_ipc_stats(ipc_broker: Broker, ipc_client_1: Client, ipc_client_2: Client):
+    """Broker metrics come back from a STATS command; clients keep their own."""
+    ipc_broker._latency = None
+    events = ipc_client_2.subscribe("stats.#")
+    for _ in range(3):
+        ipc_client_1.publish(ipc_client_1.generate_event("stats.a", "hello"))
+        events.get(timeout=2)
+    ipc_client_1.publish(ipc_client_1.generate_event("nobody", "hello"))
+    assert ipc_client_1.ping("client_2")
+    stats = ipc_client_1.get_stats()
+    metrics = stats["metrics"]
+    assert stats["labels"] == {"name": "broker"}
+    assert metrics["pyaduct_broker_published_total"]["values"]["stats.a"] == 3
+    assert metrics["pyaduct_broker_delivered_total"]["values"]["stats.a"] == 3
+    assert metrics["pyaduct_broker_dropped_total"]["values"]["no_subscribers"] == 1
+    assert metrics["pyaduct_broker_received_total"]["values"]["PING"] == 1
+    assert metrics["pyaduct_broker_request_seconds"]["values"]["client_2"]["count"] == 1
+    assert metrics["pyaduct_broker_handle_seconds"]["values"]["EVENT"]["count"] == 4
+    assert metrics["pyaduct_broker_pending"]["values"][""] == 0
+    client = ipc_client_1.metrics.snapshot()["metrics"]
+    assert client["pyaduct_client_sent_total"]["values"]["EVENT"] == 4
+    assert client["pyaduct_client_request_seconds"]["values"]["PING"]["count"] == 1
+    assert client["pyaduct_client_subscription_queue"]["values"] == {}
+    assert 'pyaduct_client_sent_total{name="client_1",type="EVENT"} 4' in (
+        ipc_client_1.metrics.prometheus()
+    )
+
+
+def test_ipc_service_group(ctx, ipc_address, ipc_broker: Broker, ipc_client_1: Client):
+    """Requests for a service are balanced over its replicas."""
+    ipc_broker._latency = None
+    replicas = []
+    for i in range(3):
+        socket = ctx.socket(DEALER)
+        socket.connect(ipc_address)
+        replica = Client(socket, name=f"resize_{i}", service="resize", balance="consistent_hash")
+        replica.start()
+        replicas.append(replica)
+    stop = threading.Event()
+
+    def serve(replica: Client):
+        while not stop.is_set():
+            try:
+                request = replica.requests.get(timeout=0.1)
+            except Empty:
+                continue
+            replica.respond(request, replica.name)
+
+    servers = [threading.Thread(target=serve, args=(replica,)) for replica in replicas]
+    for server in servers:
+        server.start()
+    try:
+        group = ipc_broker.services["resize"]
+        assert len(group.replicas) == 3
+        assert "resize" in ipc_client_1.get_clients()
+        requests = [
+            ipc_client_1.generate_request("resize", "image", key=f"user-{i % 10}")
+            for i in range(60)
+        ]
+        futures = [ipc_client_1.submit(request) for request in requests]
+        served = [future.result(timeout=10).source for future in futures]
+        assert len(set(served)) > 1
+        for i in range(10):
+            assert len(set(served[i::10])) == 1
+        assert not ipc_broker._dispatched
+        assert set(group.in_flight.values()) == {0}
+    finally:
+        stop.set()
+        for server in servers:
+            server.join()
+        for replica in replicas:
+            replica.stop()
+
+
+def test_ipc_consumer_group(ipc_broker: Broker, ipc_client_1: Client, ipc_client_2: Client):
+    """Each event of a consumer group goes to one member, and unacked ones come back."""
+    ipc_broker._latency = None
+    jobs_1 = ipc_client_1.subscribe("jobs.#", group="workers", prefetch=4, ack_timeout=1)
+    jobs_2 = ipc_client_2.subscribe("jobs.#", group="workers", prefetch=4)
+    for i in range(20):
+        ipc_client_2.publish(ipc_client_2.generate_event(f"jobs.{i % 3}", str(i)))
+    done = []
+    while len(done) < 20:
+        try:
+            event = jobs_2.get(timeout=0.2)
+        except Empty:
+            # client_1 never acks: once it times out, its events go to client_2.
+            continue
+        done.append(event.body)
+        ipc_client_2.ack(event)
+    assert sorted(done, key=int) == [str(i) for i in range(20)]
+    assert jobs_1.qsize() > 0
+    ipc_client_2.unsubscribe("jobs.#", group="workers")
+    ipc_client_1.unsubscribe("jobs.#", group="workers")
+    assert not ipc_broker._groups
+
+
+def test_ipc_session(ctx, ipc_address, ipc_broker: Broker, ipc_client_1: Client):
+    """Many client names share one session socket and its threads."""
+    ipc_broker._latency = None
+    socket = ctx.socket(DEALER)
+    socket.connect(ipc_address)
+    session = Session(socket)
+    threads = threading.active_count()
+    session.start()
+    actors = [session.client(f"actor_{i}") for i in range(50)]
+    try:
+        for actor in actors:
+            actor.start()
+        assert threading.active_count() - threads <= 5
+        assert len(set(ipc_broker.clients[f"actor_{i}"] for i in range(50))) == 1
+        queues = [actor.subscribe("fan.#") for actor in actors]
+        ipc_client_1.publish(ipc_client_1.generate_event("fan.out", "hello"))
+        assert [queue.get(timeout=2).body for queue in queues] == ["hello"] * 50
+        assert all(queue.empty() for queue in queues)
+        # Names in one session reach each other through the broker like any client.
+        assert actors[0].ping("actor_1")
+        assert ipc_client_1.ping("actor_49")
+        future = ipc_client_1.submit(ipc_client_1.generate_request("actor_7", "hi"))
+        request = actors[7].requests.get(timeout=2)
+        actors[7].respond(request, "hello from 7")
+        assert future.result(timeout=2).source == "actor_7"
+        assert actors[7].requests.empty()
+        assert "actor_3" in actors[0].get_clients()
+        # Names send with the codec and framing their session negotiated.
+        assert actors[0]._codec is session._codec and actors[0]._envelope
+        received = ipc_client_1.subscribe("from.actor")
+        actors[0].publish(actors[0].generate_event("from.actor", "hi"))
+        assert received.get(timeout=2).source == "actor_0"
+    finally:
+        session.stop()
+
+
+def test_ipc_session_group(ctx, ipc_address, ipc_broker: Broker, ipc_client_1: Client):
+    """Group members sharing a session each get only the events dealt to them."""
+    ipc_broker._latency = None
+    socket = ctx.socket(DEALER)
+    socket.connect(ipc_address)
+    session = Session(socket)
+    session.start()
+    members = [session.client(f"member_{i}") for i in range(2)]
+    watcher = session.client("watcher")
+    try:
+        for client in (*members, watcher):
+            client.start()
+        queues = [member.subscribe("work.#", group="w", prefetch=20) for member in members]
+        watched = watcher.subscribe("work.#")
+        for i in range(10):
+            ipc_client_1.publish(ipc_client_1.generate_event("work.item", str(i)))
+        assert sorted(watched.get(timeout=2).body for _ in range(10)) == sorted(map(str, range(10)))
+        deadline = time.monotonic() + 2
+        while sum(queue.qsize() for queue in queues) < 10 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        received = [[queue.get_nowait() for _ in range(queue.qsize())] for queue in queues]
+        assert [len(events) for events in received] == [5, 5]
+        assert sorted(event.body for events in received for event in events) == sorted(
+            map(str, range(10))
+        )
+        assert all(
+            event.member == member.name
+            for member, events in zip(members, received, strict=True)
+            for event in events
+        )
+        for member, events in zip(members, received, strict=True):
+            member.ack(*events)
+            member._flush_acks()
+        deadline = time.monotonic() + 2
+        while len(ipc_broker._groups["w"]) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(ipc_broker._groups["w"]) == 0
+    finally:
+        session.stop()
+
+
+def test_inproc_clients(ipc_broker: Broker, ipc_client_1: Client):
+    """Clients in the broker's process share messages by reference with it."""
+    ipc_broker._latency = None
+    inproc_1 = Client(ipc_broker, name="inproc_1")
+    inproc_2 = Client(ipc_broker, name="inproc_2")
+    inproc_1.start()
+    inproc_2.start()
+    try:
+        queues = [client.subscribe("local.#") for client in (inproc_1, inproc_2, ipc_client_1)]
+        event = inproc_2.generate_event("local.news", "hello")
+        inproc_2.publish(event)
+        received = [queue.get(timeout=2) for queue in queues]
+        # Both inproc subscribers get the very object that was published.
+        assert received[0] is event and received[1] is event
+        assert received[2] == event and received[2] is not event
+        with pytest.raises(ValidationError):
+            received[0].body = "changed"
+        assert inproc_1.ping("inproc_2") and inproc_1.ping("client_1")
+        assert ipc_client_1.ping("inproc_1")
+        future = ipc_client_1.submit(ipc_client_1.generate_request("inproc_1", "hi"))
+        request = inproc_1.requests.get(timeout=2)
+        inproc_1.respond(request, request.body.upper())
+        assert future.result(timeout=2).body == "HI"
+    finally:
+        inproc_1.stop()
+        inproc_2.stop()
+
+
+def test_ipc_payloads(ipc_broker: Broker, ipc_client_1: Client, ipc_client_2: Client):
+    """Binary payloads travel as their own frame, past every codec."""
+    ipc_broker._latency = None
+    inproc = Client(ipc_broker, name="inproc_1")
+    inproc.start()
+    try:
+        queues = [client.subscribe("blobs") for client in (ipc_client_1, inproc)]
+        blob = bytes(range(256)) * 4096
+        event = ipc_client_2.generate_event("blobs", "image", payload=memoryview(blob))
+        ipc_client_2.publish(event)
+        for queue in queues:
+            received = queue.get(timeout=2)
+            assert received.body == "image" and bytes(received.payload) == blob
+        assert "payload" not in received.model_dump_json()
+
+        def serve():
+            request = ipc_client_1.requests.get(timeout=2)
+            ipc_client_1.respond(request, "reversed", payload=bytes(request.payload)[::-1])
+
+        server = threading.Thread(target=serve)
+        server.start()
+        response = inproc.request(inproc.generate_request("client_1", "", payload=b"abc"))
+        server.join()
+        assert bytes(response.payload) == b"cba"
+    finally:
+        inproc.stop()
+
+
+def test_ipc_shared_memory_payloads(ctx, ipc_address, ipc_broker: Broker, ipc_client_1: Client):
+    """Local clients hand payloads over in shared memory; others get them inline."""
+    ipc_broker._latency = None
+    clients = []
+    for name in ("shm_sender", "shm_receiver"):
+        socket = ctx.socket(DEALER)
+        socket.connect(ipc_address)
+        clients.append(Client(socket, name=name, codecs=["binary"], shared_memory=1024))
+    clients.append(Client(ipc_broker, name="inproc_1", shared_memory=1024))
+    for client in clients:
+        client.start()
+    sender, receiver, inproc = clients
+    try:
+        assert sender._shared and receiver._shared and not ipc_client_1._shared
+        queues = [client.subscribe("blobs") for client in (receiver, ipc_client_1, inproc)]
+        blob = bytes(range(256)) * 4096
+        sender.publish(sender.generate_event("blobs", "image", payload=blob))
+        payloads = [queue.get(timeout=2).payload for queue in queues]
+        assert all(bytes(payload) == blob for payload in payloads)
+        # Mapped read-only by the local receiver, not copied.
+        assert payloads[0].readonly
+        deadline = time.time() + 2
+        while len(ipc_broker._segments) and time.time() < deadline:
+            time.sleep(0.01)
+        assert len(ipc_broker._segments) == 0
+        # Small payloads stay inline.
+        sender.publish(sender.generate_event("blobs", "small", payload=b"tiny"))
+        assert bytes(queues[0].get(timeout=2).payload) == b"tiny"
+    finally:
+        for client in clients:
+            client.stop()
+
+
+def test_ipc_compression(ctx, ipc_address, ipc_broker: Broker, ipc_client_1: Client):
+    """Compressed bodies pass through to clients that declared support, inflated for others."""
+    ipc_broker._latency = None
+    samples = [f'{{"sensor": "t-{i}", "celsius": {i / 3:.2f}}}'.encode() for i in range(50)]
+    dictionary = compression.train(samples)
+    socket = ctx.socket(DEALER)
+    socket.connect(ipc_address)
+    sender = Client(
+        socket,
+        name="compressing",
+        compression=Compression(threshold=16, dictionaries={"telemetry.#": dictionary}),
+    )
+    sender.start()
+    raw = {}
+    declared = {"raw_zlib": ["zlib"], "raw_plain": []}
+    for name, compressors in declared.items():
+        raw[name] = ctx.socket(DEALER)
+        raw[name].connect(ipc_address)
+        register = Register(
+            source=name,
+            envelope=True,
+            compression=compressors,
+            dictionaries=[compression.add_dictionary(dictionary)],
+        )
+        for message in (register, Subscribe(source=name, topic="telemetry.#")):
+            frames = [Header.from_message(message).encode(), JSON_CODEC.encode(message)]
+            raw[name].send_multipart(frames)
+            raw[name].recv_multipart()
+    try:
+        events = ipc_client_1.subscribe("telemetry.#")
+        body = '{"sensor": "t-7", "celsius": 2.40}'
+        sender.publish(sender.generate_event("telemetry.room", body))
+        assert events.get(timeout=2).body == body
+        frames = {name: socket.recv_multipart()[-1] for name, socket in raw.items()}
+        assert compression.compression_of(frames["raw_zlib"])[0] == "zlib"
+        assert not compression.is_compressed(frames["raw_plain"])
+        assert all(decode(frame).body == body for frame in frames.values())
+    finally:
+        sender.stop()
+        for socket in raw.values():
+            socket.close(linger=0)
+
+
+def test_ipc_event_log_replay(
+    tmp_path, ipc_broker: Broker, ipc_client_1: Client, ipc_client_2: Client
+):
+    """Events are logged without subscribers and replayed to a late subscriber."""
+    ipc_broker._latency = None
+    ipc_broker.log = TopicLog(tmp_path)
+    for i in range(3):
+        ipc_client_2.publish(ipc_client_2.generate_event("history", f"old {i}"))
+    assert ipc_client_2.ping("client_1")
+    events = ipc_client_1.subscribe("history", offset=1)
+    ipc_client_2.publish(ipc_client_2.generate_event("history", "live"))
+    assert [events.get(timeout=2).body for _ in range(3)] == ["old 1", "old 2", "live"]
+    ipc_broker.log.close()
+
+
+def test_ipc_event_log_rejects_unsafe_topics(
+    tmp_path, ipc_broker: Broker, ipc_client_1: Client, ipc_client_2: Client
+):
+    """Topics that would escape the log directory are dropped, never written."""
+    ipc_broker._latency = None
+    ipc_broker.log = TopicLog(tmp_path / "logs" / "log")
+    for topic in ("..", ".", "", "a.*"):
+        ipc_client_2.publish(ipc_client_2.generate_event(topic, "escape"))
+    ipc_client_2.publish(ipc_client_2.generate_event("safe", "kept"))
+    assert ipc_client_2.ping("client_1")
+    assert [path.name for path in (tmp_path / "logs").iterdir()] == ["log"]
+    assert ipc_broker.log.topics() == ["safe"]
+    dropped = ipc_broker.metrics.snapshot()["metrics"]["pyaduct_broker_dropped_total"]
+    assert dropped["values"]["invalid_topic"] == 4
+    ipc_broker.log.close()
+
+
+def test_ipc_event_log_payloads(
+    ctx, ipc_address, tmp_path, ipc_broker: Broker, ipc_client_1: Client
+):
+    """Payloads are logged with their events, shared memory ones copied in."""
+    ipc_broker._latency = None
+    ipc_broker.log = TopicLog(tmp_path)
+    socket = ctx.socket(DEALER)
+    socket.connect(ipc_address)
+    sender = Client(socket, name="shm_sender", shared_memory=1024)
+    sender.start()
+    try:
+        blob = bytes(range(256)) * 16
+        sender.publish(sender.generate_event("frames", "small", payload=b"tiny"))
+        sender.publish(sender.generate_event("frames", "shared", payload=blob))
+        sender.publish(sender.generate_event("frames", "none"))
+        assert sender.ping("client_1")
+        events = ipc_client_1.subscribe("frames", offset=0)
+        replayed = [events.get(timeout=2) for _ in range(3)]
+        assert [event.body for event in replayed] == ["small", "shared", "none"]
+        assert [event.payload and bytes(event.payload) for event in replayed] == [
+            b"tiny",
+            blob,
+            None,
+        ]
+    finally:
+        sender.stop()
+        ipc_broker.log.close()
+
+
+def test_ipc_async_client(ipc_address, ipc_broker: Broker, ipc_client_2: Client):
+    """AsyncClient requests, pings and iterates events on one event loop."""
+    ipc_broker._latency = None
+
+    def serve():
+        request = ipc_client_2.requests.get(timeout=5)
+        ipc_client_2.respond(request, request.body.upper())
+
+    server = threading.Thread(target=serve)
+    server.start()
+
+    async def run():
+        context = zmq.asyncio.Context()
+        socket = context.socket(DEALER)
+        socket.connect(ipc_address)
+        client = AsyncClient(socket, name="async_client", codecs=["binary"])
+        await client.start()
+        try:
+            assert await client.ping("client_2")
+            assert await client.get_clients() == ["client_2"]
+            response = await client.request(client.generate_request("client_2", "hello"))
+            assert response.body == "HELLO"
+            events = await client.subscribe("async.#")
+            for i in range(3):
+                ipc_client_2.publish(ipc_client_2.generate_event(f"async.{i}", str(i)))
+            bodies = []
+            async for event in events:
+                bodies.append(event.body)
+                if len(bodies) == 3:
+                    await client.unsubscribe("async.#")
+            assert bodies == ["0", "1", "2"]
+            with pytest.raises(ResponseTimeout):
+                await client.request(client.generate_request("nobody", "x", timeout=1), 3)
+        finally:
+            await client.stop()
+            context.term()
+
+    asyncio.run(run())
+    server.join()
+
+
+def test_ipc_async_client_survives_handler_errors(
+    ipc_address, ipc_broker: Broker, ipc_client_2: Client
+):
+    """A message the AsyncClient fails to handle does not end its listen task."""
+    ipc_broker._latency = None
+
+    class FailingStore(InmemMessageStore):
+        def add_rx_message(self, message):
+            raise RuntimeError("store is full")
+
+    async def run():
+        context = zmq.asyncio.Context()
+        socket = context.socket(DEALER)
+        socket.connect(ipc_address)
+        client = AsyncClient(socket, name="async_client", codecs=["binary"], store=FailingStore())
+        await client.start()
+        try:
+            assert await client.ping("client_2")
+            assert await client.ping("client_2")
+        finally:
+            await client.stop()
+            context.term()
+
+    asyncio.run(run())
@@ -0,0 +1,48 @@
+import datetime
+
+import pytest
+
+from pyaduct import Command, Event, Ping, Pong, Register, Request, Response, Subscribe
+from pyaduct.codec import BINARY_CODEC, CODECS, JSON_CODEC, decode, negotiate
+from pyaduct.models import ACK, Message
+
+register = Register(source="client_1", codecs=["binary", "json"])
+request = Request(source="client_1", target="client_2", body="héllo", timeout=3)
+MESSAGES: list[Message] = [
+    register,
+    request,
+    Command(source="client_1", target="broker", body="GET_CLIENTS"),
+    Response(source="client_2", requestor="client_1", request_id=request.id, body="ok"),
+    Event(source="client_2", topic="test_topic", body=""),
+    Subscribe(source="client_1", topic="test_topic"),
+    Ping(source="client_1", target="client_2"),
+    Pong(source="client_2", requestor="client_1", request_id=request.id),
+    ACK(source="broker", requestor="client_1", request_id=register.id),
+]
+
+
+@pytest.mark.parametrize("codec", CODECS.values(), ids=CODECS.keys())
+@pytest.mark.parametrize("message", MESSAGES, ids=[m.type.value for m in MESSAGES])
+def test_codec_roundtrip(codec, message):
+    frame = codec.encode(message)
+    assert decode(frame) == message
+    assert type(decode(frame)) is type(message)
+
+
+def test_codec_json_is_legacy_text_frame():
+    assert JSON_CODEC.encode(request) == f"REQUEST {request.model_dump_json()}".encode()
+    assert len(BINARY_CODEC.encode(request)) < len(JSON_CODEC.encode(request))
+
+
+def test_codec_negotiate():
+    assert negotiate(["binary", "json"]) is BINARY_CODEC
+    assert negotiate(["msgpack", "json"]) is JSON_CODEC
+    assert negotiate([]) is JSON_CODEC
+
+
+def test_binary_codec_naive_datetimes():
+    """Naive datetimes are local time, as the JSON codec and timestamp() take them."""
+    since = datetime.datetime.now()
+    subscribe = Subscribe(source="client_1", topic="test_topic", since=since)
+    decoded = decode(BINARY_CODEC.encode(subscribe))
+    assert decoded.since == since.astimezone(datetime.timezone.utc)
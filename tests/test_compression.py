@@ -0,0 +1,50 @@
+import pytest
+
+from pyaduct import Event
+from pyaduct.codec import JSON_CODEC, decode
+from pyaduct.compression import (
+    Compression,
+    CompressionError,
+    accepts,
+    compression_of,
+    decompress,
+    is_compressed,
+    train,
+)
+
+samples = [
+    JSON_CODEC.encode(Event(source="probe", topic="telemetry", body=f'{{"celsius": {i}}}'))
+    for i in range(100)
+]
+
+
+@pytest.mark.parametrize("algorithm", ["zlib", "lzma"])
+def test_roundtrip_above_threshold(algorithm: str):
+    body = samples[0] * 20
+    frame = Compression(algorithm, threshold=len(body)).compress(body)
+    assert is_compressed(frame) and len(frame) < len(body)
+    assert compression_of(frame) == (algorithm, 0)
+    assert decompress(frame) == body
+    assert Compression(algorithm, threshold=len(body) + 1).compress(body) is body
+
+
+def test_trained_dictionary_for_small_bodies():
+    dictionary = train(samples[:50])
+    plain = Compression(threshold=0)
+    trained = Compression(threshold=0, dictionaries={"telemetry.#": dictionary})
+    body = samples[77]
+    frame = trained.compress(body, "telemetry.room")
+    assert len(frame) < len(plain.compress(body, "telemetry.room")) / 2
+    assert decode(frame).body == '{"celsius": 77}'
+    _, dictionary_id = compression_of(frame)
+    assert accepts(frame, {"zlib"}, {dictionary_id})
+    assert not accepts(frame, {"zlib"}, set())
+    assert not accepts(frame, {"lzma"}, {dictionary_id})
+    assert compression_of(trained.compress(body, "other")) == ("zlib", 0)
+
+
+def test_unknown_dictionary():
+    frame = Compression(threshold=0, dictionaries={"#": train(samples)}).compress(samples[0], "a")
+    corrupted = frame[:2] + b"\x01\x00\x00\x00" + frame[6:]
+    with pytest.raises(CompressionError):
+        decompress(corrupted)
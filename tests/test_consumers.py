@@ -0,0 +1,49 @@
+import time
+
+from pyaduct.consumers import ConsumerGroup
+from pyaduct.models import Event
+from pyaduct.wire import Envelope
+
+
+def _events(count: int) -> list[Envelope]:
+    return [
+        Envelope.from_message(Event(source="producer", topic="jobs", body=str(i)))
+        for i in range(count)
+    ]
+
+
+def test_prefetch_windows_and_acks():
+    group = ConsumerGroup("workers")
+    assert group.join("a", b"A", prefetch=2, ack_timeout=30) == []
+    assert group.join("b", b"B", prefetch=1, ack_timeout=30) == []
+    events = _events(5)
+    deliveries = [d for event in events for d in group.offer(event)]
+    assert [client_id for _, client_id in deliveries] == [b"A", b"B", b"A"]
+    assert len(group.backlog) == 2
+    # Acking frees the window, and the backlog flows in order.
+    deliveries = group.ack("b", [deliveries[1][0].header.id])
+    assert [(e.header.id, c) for e, c in deliveries] == [(events[3].header.id, b"B")]
+    assert group.ack("nobody", [events[0].header.id]) == []
+    assert len(group) == 4
+
+
+def test_redelivery_on_timeout_leave_and_restart():
+    group = ConsumerGroup("workers")
+    group.join("a", b"A", prefetch=10, ack_timeout=0.05)
+    events = _events(3)
+    for event in events:
+        group.offer(event)
+    group.join("b", b"B", prefetch=10, ack_timeout=30)
+    time.sleep(0.1)
+    redelivered = group.expire()
+    assert sorted(e.header.id for e, _ in redelivered) == sorted(e.header.id for e in events)
+    assert {c for _, c in redelivered} == {b"A", b"B"}
+    held_by_b = [e for e, c in redelivered if c == b"B"]
+    # A member that leaves hands its events on.
+    deliveries = group.leave("b")
+    assert [e.header.id for e, _ in deliveries] == [e.header.id for e in held_by_b]
+    assert {e.header.key for e, _ in deliveries} == {"a"}
+    assert {c for _, c in deliveries} == {b"A"}
+    # A member back under a new identity lost what it held.
+    deliveries = group.join("a", b"A2", prefetch=10, ack_timeout=30)
+    assert len(deliveries) == 3 and {c for _, c in deliveries} == {b"A2"}
@@ -0,0 +1,99 @@
+import time
+
+import pytest
+from zmq import DEALER, ROUTER
+
+from pyaduct import Client, FederatedBroker, InmemMessageStore
+from pyaduct.client import ResponseTimeout
+
+NODES = ("a", "b", "c")
+
+
+@pytest.fixture
+def triangle(ctx):
+    """Three brokers peered in a loop: a-b, b-c and c-a."""
+    brokers, ports = {}, {}
+    for node in NODES:
+        socket = ctx.socket(ROUTER)
+        ports[node] = socket.bind_to_random_port("tcp://127.0.0.1")
+        brokers[node] = FederatedBroker(socket, node=node)
+        brokers[node].start()
+    for node, peer in (("a", "b"), ("b", "c"), ("c", "a")):
+        link = ctx.socket(DEALER)
+        link.connect(f"tcp://127.0.0.1:{ports[peer]}")
+        brokers[node].add_peer(link)
+    yield brokers
+    for broker in brokers.values():
+        broker.stop()
+
+
+def _client(ctx, broker: FederatedBroker, name: str) -> Client:
+    socket = ctx.socket(DEALER)
+    socket.connect(broker._socket.LAST_ENDPOINT.decode())
+    client = Client(socket, name=name)
+    client.start()
+    return client
+
+
+def _wait_for(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Condition not met in time"
+        time.sleep(0.05)
+
+
+def test_federated_brokers(ctx, triangle: dict[str, FederatedBroker]):
+    client_1 = _client(ctx, triangle["a"], "client_1")
+    client_2 = _client(ctx, triangle["c"], "client_2")
+    try:
+        events = client_1.subscribe("remote.#")
+        _wait_for(lambda: "client_1" in triangle["c"]._remote_clients)
+        _wait_for(lambda: triangle["c"]._remote_topics.match("remote.topic"))
+        assert set(client_1.get_clients()) == {"client_2"}
+        client_2.publish(client_2.generate_event("remote.topic", "hello"))
+        assert events.get(timeout=2).body == "hello"
+        # Not delivered a second time around the loop.
+        assert client_1.ping("client_2")
+        assert events.empty()
+        # Nobody is interested in this topic, so it never leaves c.
+        triangle["b"].store = InmemMessageStore()
+        client_2.publish(client_2.generate_event("elsewhere", "ignored"))
+        assert client_2.ping("client_1")
+        assert not list(triangle["b"].store.query(topic="elsewhere"))
+
+        future = client_1.submit(client_1.generate_request("client_2", "question"))
+        request = client_2.requests.get(timeout=2)
+        client_2.respond(request, "answer")
+        assert future.result(timeout=2).body == "answer"
+    finally:
+        client_1.stop()
+        client_2.stop()
+
+
+def test_remote_timeout(ctx, triangle: dict[str, FederatedBroker]):
+    """A remote broker failing a request fails it on the requester's node too."""
+    client_1 = _client(ctx, triangle["a"], "client_1")
+    client_2 = _client(ctx, triangle["c"], "client_2")
+    try:
+        _wait_for(lambda: "client_2" in triangle["a"]._remote_clients)
+        # Left c, which a has not heard of yet.
+        del triangle["c"].clients["client_2"]
+        future = client_1.submit(client_1.generate_request("client_2", "x", timeout=30))
+        with pytest.raises(ResponseTimeout, match="Broker"):
+            future.result(timeout=3)
+        assert not triangle["a"]._pending
+    finally:
+        client_1.stop()
+        client_2.stop()
+
+
+def test_add_peer_with_full_queue(ctx, tmp_path):
+    """Peering is never refused because the send queue happens to be full."""
+    broker = FederatedBroker(ctx.socket(ROUTER), node="full", max_queue=1)
+    broker._tx_queue.put(None)
+    link = ctx.socket(DEALER)
+    link.connect(f"ipc://{tmp_path}/peer")
+    broker.add_peer(link)
+    assert broker._tx_queue.qsize() == 2
+    link.close(linger=0)
+    broker._socket.close(linger=0)
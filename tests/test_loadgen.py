@@ -0,0 +1,68 @@
+import datetime
+import random
+
+from pyaduct import Event, Request, loadgen
+from pyaduct.histogram import Histogram
+
+
+def test_histogram_percentiles_and_merge():
+    rng = random.Random(0)
+    values = [rng.expovariate(1 / 1000) for _ in range(10_000)]
+    first, second = Histogram(), Histogram()
+    for i, value in enumerate(values):
+        (first if i % 2 else second).record(value)
+    first.merge(second)
+    assert len(first) == len(values)
+    ordered = sorted(values)
+    for fraction in (0.5, 0.99, 0.999):
+        exact = ordered[int(fraction * len(values)) - 1]
+        assert abs(first.percentile(fraction) - exact) <= exact * 0.01
+    assert first.percentile(1.0) == max(values)
+    assert Histogram().percentile(0.99) == 0.0
+
+
+def test_shape_of_recorded_messages():
+    start = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+    messages = [
+        Event(source="a", topic="t", body="", timestamp=start),
+        Event(source="a", topic="t", body="", timestamp=start),
+        Request(source="a", target="b", body="", timestamp=start),
+        Event(source="a", topic="t", body="", timestamp=start + datetime.timedelta(seconds=2)),
+    ]
+    steps = loadgen.shape_of(messages, interval=1.0)
+    assert [step.rate for step in steps] == [3, 0, 1]
+    assert steps[0].mix == loadgen.Mix(2 / 3, 1 / 3, 0)
+
+
+def test_knee_and_growth():
+    def step(rate, p99, lost=0):
+        latency = {"p99": p99}
+        return loadgen.StepReport(
+            1, rate, {}, {"event": lost} if lost else {}, {"event": latency}, {}
+        )
+
+    report = loadgen.Report(
+        [step(100, 1_000), step(200, 2_000), step(300, 90_000), step(400, 1_000, lost=5)],
+        [(t, 1000 + t * 10) for t in range(100)],
+    )
+    assert report.knee(50_000) == 200
+    assert report.knee(500) is None
+    assert report.lost == 5
+    assert round(report.rss_growth) == 36_000
+
+
+def test_run_loses_nothing():
+    intervals = []
+    report = loadgen.run(
+        loadgen.constant(100, 2),
+        producers=1,
+        consumers=1,
+        clients=2,
+        interval=1.0,
+        progress=intervals.append,
+    )
+    (step,) = report.steps
+    assert sum(step.sent.values()) >= 190
+    assert report.lost == 0
+    assert step.latency["event"]["count"] == step.sent["event"] * 2
+    assert intervals and report.rss
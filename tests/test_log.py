@@ -0,0 +1,54 @@
+import time
+
+from pyaduct.log import TopicLog
+
+
+def _bodies(records) -> list[bytes]:
+    return [record.body for record in records]
+
+
+def test_topic_log_append_read_and_reopen(tmp_path):
+    log = TopicLog(tmp_path, segment_bytes=256, index_interval=64)
+    for i in range(50):
+        assert log.append("metrics.cpu", b"h", f"cpu {i}".encode()) == i
+    log.append("metrics.mem", b"h", b"mem 0")
+    assert len(list((tmp_path / "metrics.cpu").iterdir())) > 1
+    assert _bodies(log.read("metrics.cpu", offset=47)) == [b"cpu 47", b"cpu 48", b"cpu 49"]
+    assert [r.offset for r in log.read("metrics.cpu", offset=0)] == list(range(50))
+    assert list(log.read("missing", offset=0)) == []
+    log.close()
+
+    log = TopicLog(tmp_path, segment_bytes=256, index_interval=64)
+    assert log.end_offset("metrics.cpu") == 50
+    assert log.append("metrics.cpu", b"h", b"cpu 50") == 50
+    records = list(log.read("metrics.#", offset=0))
+    assert _bodies(records)[-3:] == [b"cpu 49", b"mem 0", b"cpu 50"]
+    log.close()
+
+
+def test_topic_log_since_and_retention(tmp_path):
+    log = TopicLog(tmp_path, segment_bytes=128, retention_bytes=512)
+    for i in range(5):
+        log.append("a", b"h", f"old {i}".encode())
+    since = time.time()
+    time.sleep(0.01)
+    for i in range(5):
+        log.append("a", b"h", f"new {i}".encode())
+    assert _bodies(log.read("a", since=since)) == [f"new {i}".encode() for i in range(5)]
+    for _ in range(100):
+        log.append("a", b"h", b"x" * 20)
+    offsets = [record.offset for record in log.read("a", offset=0)]
+    assert offsets[-1] == 109
+    assert 0 < offsets[0] and offsets == list(range(offsets[0], 110))
+    log.close()
+
+
+def test_topic_log_payloads(tmp_path):
+    log = TopicLog(tmp_path, segment_bytes=128)
+    log.append("frames", b"h", b"with", memoryview(b"p" * 100))
+    log.append("frames", b"h", b"without")
+    log.close()
+    log = TopicLog(tmp_path, segment_bytes=128)
+    records = list(log.read("frames", offset=0))
+    assert [(r.body, r.payload) for r in records] == [(b"with", b"p" * 100), (b"without", None)]
+    log.close()
@@ -0,0 +1,72 @@
+import urllib.request
+
+from pyaduct.metrics import OTHER, Metrics, merge, prometheus
+
+
+def test_snapshot_and_prometheus(tmp_path):
+    metrics = Metrics("pyaduct_test", {"name": "node"})
+    sent = metrics.counter("sent_total", "Messages sent", "type")
+    sent.inc("EVENT")
+    sent.inc("EVENT", 2)
+    metrics.gauge("depth", "Queue depth", lambda: 7)
+    metrics.gauge("backlog", "Backlogs", lambda: {'a"b': 1}, "group")
+    latency = metrics.timer("handle_seconds", "Handling time")
+    for milliseconds in range(1, 101):
+        latency.observe(milliseconds / 1000)
+    snapshot = metrics.snapshot()
+    summary = snapshot["metrics"]["pyaduct_test_handle_seconds"]["values"][""]
+    assert summary["count"] == 100 and abs(summary["p99"] - 99_000) < 1_000
+    text = prometheus(snapshot)
+    assert "# TYPE pyaduct_test_sent_total counter" in text
+    assert 'pyaduct_test_sent_total{name="node",type="EVENT"} 3' in text
+    assert 'pyaduct_test_depth{name="node"} 7' in text
+    assert 'pyaduct_test_backlog{name="node",group="a\\"b"} 1' in text
+    assert 'pyaduct_test_handle_seconds{name="node",quantile="0.5"} 0.05' in text
+    assert 'pyaduct_test_handle_seconds_count{name="node"} 100' in text
+
+    path = tmp_path / "pyaduct.prom"
+    metrics.write(path)
+    assert path.read_text() == metrics.prometheus()
+    server = metrics.serve(0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url) as response:
+            assert "pyaduct_test_sent_total" in response.read().decode()
+    finally:
+        server.shutdown()
+
+
+def test_capped_label_values():
+    metrics = Metrics("pyaduct_test")
+    published = metrics.counter("published_total", "Events published", "topic", max_values=2)
+    latency = metrics.timer("request_seconds", "Request time", "target", max_values=2)
+    for topic in ("a", "b", "c", "d", "a"):
+        published.inc(topic)
+        latency.observe(0.001, topic)
+    assert published.values == {"a": 2, "b": 1, OTHER: 2}
+    assert {target: summary["count"] for target, summary in latency.snapshot().items()} == {
+        "a": 2,
+        "b": 1,
+        OTHER: 2,
+    }
+
+
+def test_merge():
+    snapshots = []
+    for count in (1, 3):
+        metrics = Metrics("pyaduct_test", {"name": "broker"})
+        metrics.counter("sent_total", "Messages sent", "type").inc("EVENT", count)
+        metrics.gauge("depth", "Queue depth", lambda count=count: count)
+        latency = metrics.timer("handle_seconds", "Handling time")
+        for _ in range(count):
+            latency.observe(count / 1000)
+        snapshots.append(metrics.snapshot())
+    merged = merge(snapshots)["metrics"]
+    assert merged["pyaduct_test_sent_total"]["values"] == {"EVENT": 4}
+    assert merged["pyaduct_test_depth"]["values"] == {"": 4}
+    summary = merged["pyaduct_test_handle_seconds"]["values"][""]
+    assert summary["count"] == 4 and abs(summary["sum"] - 10_000) < 100
+    assert (
+        summary["max"]
+        == snapshots[1]["metrics"]["pyaduct_test_handle_seconds"]["values"][""]["max"]
+    )
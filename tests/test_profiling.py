@@ -0,0 +1,65 @@
+import threading
+import time
+
+from zmq import ROUTER
+
+from pyaduct import Broker, Client
+from pyaduct.profiling import Profiler
+
+
+def test_broker_and_client_profiles(ctx, tmp_path):
+    """The named threads are profiled as they start, down to their own stacks."""
+    router = ctx.socket(ROUTER)
+    router.bind_to_random_port("tcp://127.0.0.1")
+    broker = Broker(router)
+    client = Client(broker, name="profiled")
+    with broker.profile(0.001) as profiler, client.profile(0.001) as client_profiler:
+        broker.start()
+        client.start()
+        events = client.subscribe("profile")
+        for _ in range(200):
+            client.publish(client.generate_event("profile", "x" * 64))
+        for _ in range(200):
+            events.get(timeout=2)
+        client.stop()
+        broker.stop()
+    profile = profiler.profile
+    assert set(profile.threads) == {"Broker|Listen", "Broker|Handle", "Broker|Send", "Broker|Watch"}
+    assert set(client_profiler.profile.threads) == {"profiled|Handle", "profiled|Send"}
+    handle = profile.threads["Broker|Handle"]
+    assert handle.samples > 0 and 0 < handle.wall and handle.busy <= handle.wall
+    assert handle.cpu is not None and handle.gil_wait is not None
+
+    path = tmp_path / "broker.folded"
+    profile.write(path)
+    lines = path.read_text().splitlines()
+    assert all(line.split(";")[0].startswith("Broker|") for line in lines)
+    assert any("Broker.__handle (broker.py)" in line for line in lines)
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == sum(
+        thread.samples for thread in profile.threads.values()
+    )
+
+
+def test_gil_wait():
+    """Two threads spinning in Python each wait for the GIL about half the time."""
+    stop = threading.Event()
+
+    def spin():
+        while not stop.is_set():
+            sum(range(1000))
+
+    threads = [threading.Thread(target=spin, name="spin") for _ in range(2)]
+    idle = threading.Thread(target=stop.wait, name="idle")
+    with Profiler([*threads, idle]) as profiler:
+        for thread in [*threads, idle]:
+            thread.start()
+        time.sleep(1)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    spinning, waiting = profiler.profile.threads["spin"], profiler.profile.threads["idle"]
+    # Threads of one name are added up.
+    assert 1.5 < spinning.wall < 3
+    assert spinning.busy > 0.9 * spinning.wall
+    assert spinning.gil_wait > 0.5
+    assert waiting.busy < 0.1 * waiting.wall and waiting.gil_wait < 0.1
@@ -0,0 +1,100 @@
+import queue
+import time
+
+import pytest
+from zmq import DEALER, ROUTER
+
+from pyaduct import Broker, Client
+from pyaduct.client import BackpressureError
+from pyaduct.queues import Backpressure, BoundedQueue
+from pyaduct.utils import BURST_SIZE
+
+
+def test_bounded_queue():
+    bounded = BoundedQueue(2)
+    bounded.put(1)
+    bounded.offer(2, Backpressure("raise"))
+    with pytest.raises(queue.Full):
+        bounded.offer(3, Backpressure("raise"))
+    started = time.monotonic()
+    with pytest.raises(queue.Full):
+        bounded.offer(3, Backpressure("timeout", 0.1))
+    assert time.monotonic() - started >= 0.1
+    bounded.force(3)
+    assert bounded.high_water == 3
+    assert [bounded.get(), bounded.get(), bounded.get()] == [1, 2, 3]
+
+
+def test_publish_backpressure(ctx):
+    """publish and requests fail once the send queue is full; its threads never started."""
+    broker = Broker(ctx.socket(ROUTER))
+    client = Client(broker, name="full", max_queue=2, backpressure=Backpressure("raise"))
+    client.publish(client.generate_event("topic", "1"))
+    client.publish(client.generate_event("topic", "2"))
+    with pytest.raises(BackpressureError):
+        client.publish(client.generate_event("topic", "3"))
+    with pytest.raises(BackpressureError):
+        client.submit(client.generate_request("other", "hello"))
+    assert not client._pending_requests
+    assert client.high_water()["tx"] == 2
+
+
+def test_full_subscription_drops(ctx):
+    """Events that find a full subscription are counted as dropped, never queued."""
+    router = ctx.socket(ROUTER)
+    router.bind_to_random_port("tcp://127.0.0.1")
+    broker = Broker(router)
+    broker.start()
+    subscriber = Client(broker, name="slow", max_queue=5)
+    publisher = Client(broker, name="fast")
+    subscriber.start()
+    publisher.start()
+    try:
+        events = subscriber.subscribe("flood")
+        for i in range(20):
+            publisher.publish(publisher.generate_event("flood", str(i)))
+
+        def dropped():
+            client = subscriber.metrics.snapshot()["metrics"]["pyaduct_client_dropped_total"]
+            routed = broker.metrics.snapshot()["metrics"]["pyaduct_broker_dropped_total"]
+            return client["values"].get("subscription_full", 0) + routed["values"].get(
+                "inbox_full", 0
+            )
+
+        deadline = time.monotonic() + 5
+        while dropped() < 15 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert dropped() == 15 and events.qsize() == 5
+        assert subscriber.high_water()["flood"] == 5
+    finally:
+        subscriber.stop()
+        publisher.stop()
+        broker.stop()
+
+
+def test_throttled_broker_loses_nothing(ctx):
+    """A broker whose queue is full stops reading, and its senders wait."""
+    router = ctx.socket(ROUTER)
+    port = router.bind_to_random_port("tcp://127.0.0.1")
+    broker = Broker(router, max_queue=4)
+    broker.start()
+    clients = []
+    for name in ("producer", "consumer"):
+        socket = ctx.socket(DEALER)
+        socket.connect(f"tcp://127.0.0.1:{port}")
+        clients.append(Client(socket, name=name, max_queue=8 if name == "producer" else 0))
+        clients[-1].start()
+    producer, consumer = clients
+    try:
+        events = consumer.subscribe("throttled")
+        for i in range(500):
+            producer.publish(producer.generate_event("throttled", str(i)))
+        received = [events.get(timeout=5).body for _ in range(500)]
+        assert received == [str(i) for i in range(500)]
+        assert broker._rx_queue.high_water <= 4 + BURST_SIZE
+        snapshot = broker.metrics.snapshot()["metrics"]
+        assert snapshot["pyaduct_broker_queue_high_water"]["values"]["tx"] <= 4
+    finally:
+        for client in clients:
+            client.stop()
+        broker.stop()
@@ -0,0 +1,147 @@
+import threading
+import time
+
+import pytest
+from zmq import DEALER, PAIR, ROUTER
+
+from pyaduct import Client, sharding
+from pyaduct.client import ResponseTimeout
+from pyaduct.codec import BINARY_CODEC
+from pyaduct.models import Command, Response
+from pyaduct.sharding import ShardedBroker, shard_of
+from pyaduct.wire import Envelope, unpack_frames
+
+
+@pytest.fixture
+def sharded_broker(ctx, tmp_path):
+    socket = ctx.socket(ROUTER)
+    socket.bind(f"ipc://{tmp_path}/pyaduct-sharded")
+    broker = ShardedBroker(socket, workers=3)
+    broker.start()
+    yield broker
+    broker.stop()
+
+
+def _client(ctx, broker: ShardedBroker, name: str, **kwargs) -> Client:
+    socket = ctx.socket(DEALER)
+    socket.connect(broker._socket.LAST_ENDPOINT.decode())
+    client = Client(socket, name=name, codecs=["binary"], **kwargs)
+    client.start()
+    return client
+
+
+def test_sharded_broker(ctx, sharded_broker: ShardedBroker):
+    """Clients see single-broker behavior while work is spread over shards."""
+    topics = [f"metrics.host_{i}" for i in range(12)]
+    assert len({shard_of(topic.encode(), 3) for topic in topics}) == 3
+    client_1 = _client(ctx, sharded_broker, "client_1")
+    client_2 = _client(ctx, sharded_broker, "client_2")
+    stop = threading.Event()
+
+    def serve():
+        while not stop.is_set():
+            try:
+                request = client_2.requests.get(timeout=0.1)
+            except Exception:
+                continue
+            client_2.respond(request, request.body.upper())
+
+    server = threading.Thread(target=serve)
+    server.start()
+    try:
+        assert client_1.get_clients() == ["client_2"]
+        assert client_1.ping("client_2")
+        events = client_1.subscribe("metrics.#")
+        for topic in topics:
+            client_2.publish(client_2.generate_event(topic, topic))
+        received = {events.get(timeout=5).body for _ in topics}
+        assert received == set(topics)
+        # Every shard's metrics, merged.
+        stats = client_1.get_stats()["metrics"]
+        assert set(stats["pyaduct_broker_published_total"]["values"]) == set(topics)
+        assert stats["pyaduct_broker_clients"]["values"][""] == 2
+        futures = [
+            client_1.submit(client_1.generate_request("client_2", f"r{i}")) for i in range(50)
+        ]
+        assert [f.result(timeout=10).body for f in futures] == [f"R{i}" for i in range(50)]
+        with pytest.raises(ResponseTimeout):
+            client_1.request(client_1.generate_request("nobody", "x", timeout=1), 5)
+    finally:
+        stop.set()
+        server.join()
+        client_1.stop()
+        client_2.stop()
+
+
+def test_sharded_service(ctx, sharded_broker: ShardedBroker):
+    """Responses from a service replica reach the shard holding the request."""
+    assert shard_of(b"echo_0", 3) != shard_of(b"echo", 3)
+    client = _client(ctx, sharded_broker, "client_1")
+    replica = _client(ctx, sharded_broker, "echo_0", service="echo")
+    stop = threading.Event()
+
+    def serve():
+        while not stop.is_set():
+            try:
+                request = replica.requests.get(timeout=0.1)
+            except Exception:
+                continue
+            replica.respond(request, request.body.upper())
+
+    server = threading.Thread(target=serve)
+    server.start()
+    try:
+        futures = [
+            client.submit(client.generate_request("echo", f"r{i}", timeout=1)) for i in range(20)
+        ]
+        assert [f.result(timeout=10).body for f in futures] == [f"R{i}" for i in range(20)]
+        # Past the deadlines, no shard found a request left unanswered.
+        time.sleep(1.5)
+        received = client.metrics.snapshot()["metrics"]["pyaduct_client_received_total"]
+        assert "TIMEOUT" not in received["values"]
+        assert not sharded_broker._holders
+    finally:
+        stop.set()
+        server.join()
+        client.stop()
+        replica.stop()
+
+
+def test_sharded_broker_missing_shard(ctx, monkeypatch):
+    """A shard that never answers does not hold back the others' answers."""
+    monkeypatch.setattr(sharding, "GATHER_TIMEOUT", 0.5)
+    socket = ctx.socket(ROUTER)
+    port = socket.bind_to_random_port("tcp://127.0.0.1")
+    broker = ShardedBroker(socket, workers=2)
+    shards = []
+    for shard in range(2):
+        pipe = ctx.socket(PAIR)
+        pipe.bind(f"inproc://pyaduct-shard-{shard}")
+        broker._pipes.append(pipe)
+        shards.append(ctx.socket(PAIR))
+        shards[-1].connect(f"inproc://pyaduct-shard-{shard}")
+    broker._thread.start()
+    dealer = ctx.socket(DEALER)
+    dealer.connect(f"tcp://127.0.0.1:{port}")
+    try:
+        command = Command(source="client_1", target="broker", body="CLIENTS")
+        dealer.send_multipart([b"", *Envelope.from_message(command).frames(BINARY_CODEC, True)])
+        # Both shards get the command, and only the first answers it.
+        for shard in shards:
+            assert shard.poll(5000)
+        client_id, _, *frames = shards[0].recv_multipart()
+        response = Response(
+            body="client_2", requestor="client_1", request_id=command.id, source="broker"
+        )
+        answer = Envelope.from_message(response).frames(BINARY_CODEC, True)
+        shards[0].send_multipart([b"", b"", command.id.bytes, b"", client_id, b"", *answer])
+        assert dealer.poll(5000)
+        envelope = Envelope.from_frames(unpack_frames(dealer.recv_multipart(copy=False)))
+        assert envelope.message.request_id == command.id
+        assert envelope.message.body == "client_2"
+        assert not broker._answers
+    finally:
+        dealer.close(linger=0)
+        broker.stop()
+        for shard in shards:
+            shard.close(linger=0)
@@ -0,0 +1,39 @@
+import pytest
+
+from pyaduct import shm
+
+
+def test_share_and_attach():
+    handle = shm.share(b"x" * 4096)
+    segment = shm.segment_of(handle)
+    view = shm.attach(handle)
+    assert view.readonly and bytes(view) == b"x" * 4096
+    shm.unlink(segment)
+    # Still mapped after the unlink, until the view goes away.
+    assert bytes(view[:2]) == b"xx"
+    with pytest.raises(FileNotFoundError):
+        shm.attach(handle)
+
+
+def test_segments_refcount_and_lease():
+    segments = shm.SharedSegments(lease=60)
+    handle = shm.share(b"payload")
+    segment = shm.segment_of(handle)
+    segments.open(segment)
+    segments.hold(segment)
+    segments.hold(segment)
+    segments.release(segment)
+    segments.release(segment)
+    assert bytes(shm.attach(handle)) == b"payload"
+    segments.release(segment)
+    assert len(segments) == 0
+    with pytest.raises(FileNotFoundError):
+        shm.attach(handle)
+
+    segments.lease = 0
+    handle = shm.share(b"payload")
+    segments.open(shm.segment_of(handle))
+    segments.expire()
+    assert len(segments) == 0
+    with pytest.raises(FileNotFoundError):
+        shm.attach(handle)
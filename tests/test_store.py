@@ -0,0 +1,151 @@
+import datetime
+import threading
+
+import pytest
+
+from pyaduct import Event, InmemMessageStore, Ping, SqliteMessageStore
+from pyaduct.models import MessageType
+from pyaduct.store import IMessageStore
+
+
+def _event(topic: str, seconds: float, source: str = "client_1") -> Event:
+    timestamp = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+    timestamp += datetime.timedelta(seconds=seconds)
+    return Event(source=source, topic=topic, body=str(seconds), timestamp=timestamp)
+
+
+def test_inmem_store_rx_tx_and_ordering():
+    store = InmemMessageStore()
+    assert isinstance(store, IMessageStore)
+    late, early = _event("a", 2), _event("a", 1)
+    store.add_rx_message(late)
+    store.add_rx_message(early)
+    store.add_tx_message(late)
+    assert len(store) == 2
+    assert [m.body for m in store] == ["1", "2"]
+    assert "rx_messages=2, tx_messages=1" in repr(store)
+    assert store[early.id] is early
+    del store[early.id]
+    assert early.id not in store
+    with pytest.raises(KeyError):
+        del store[early.id]
+
+
+def test_inmem_store_eviction():
+    store = InmemMessageStore(max_messages=3)
+    for i in range(5):
+        store.add_rx_message(_event("a", i))
+    assert [m.body for m in store] == ["2", "3", "4"]
+    assert [m.body for m in store.query(topic="a")] == ["2", "3", "4"]
+
+    store = InmemMessageStore(max_messages=None, max_bytes=1000)
+    for i in range(20):
+        store.add_rx_message(_event("a", i))
+    assert 0 < len(store) < 20
+    assert list(store)[-1].body == "19"
+
+    # Messages evicted as soon as they are added are not counted.
+    store = InmemMessageStore(max_messages=None, max_bytes=10)
+    store.add_rx_message(_event("a", 0))
+    store.add_tx_message(_event("a", 1))
+    assert len(store) == 0 and "rx_messages=0, tx_messages=0" in repr(store)
+
+    store = InmemMessageStore(max_age=60)
+    store.add_rx_message(_event("a", 0))
+    store.add_rx_message(Ping(source="client_1", target="client_2"))
+    assert [m.type for m in store] == [MessageType.PING]
+
+
+def test_inmem_store_query():
+    store = InmemMessageStore()
+    for i in range(10):
+        store.add_rx_message(_event("even" if i % 2 == 0 else "odd", i, f"client_{i % 3}"))
+    store.add_rx_message(Ping(source="client_0", target="client_1"))
+    assert [m.body for m in store.query(topic="odd")] == ["1", "3", "5", "7", "9"]
+    assert [m.body for m in store.query(topic="odd", source="client_0")] == ["3", "9"]
+    assert [m.type for m in store.query(message_type=MessageType.PING)] == [MessageType.PING]
+    since = datetime.datetime(2025, 1, 1, 0, 0, 3, tzinfo=datetime.timezone.utc)
+    until = since + datetime.timedelta(seconds=3)
+    assert [m.body for m in store.query(since=since, until=until)] == ["3", "4", "5"]
+    assert [m.body for m in store.query(topic="even", since=since, until=until)] == ["4"]
+    assert list(store.query(topic="missing")) == []
+
+
+def test_sqlite_store_survives_restart(tmp_path):
+    path = str(tmp_path / "messages.db")
+    store = SqliteMessageStore(path)
+    assert isinstance(store, IMessageStore)
+    late, early = _event("a", 2), _event("a", 1)
+    store.add_rx_message(late)
+    store.add_rx_message(early)
+    store.add_tx_message(late)
+    assert len(store) == 2
+    assert "rx_messages=2, tx_messages=1" in repr(store)
+    store.close()
+
+    store = SqliteMessageStore(path)
+    assert [m.body for m in store] == ["1", "2"]
+    assert early.id in store
+    assert store[early.id] == early
+    del store[early.id]
+    assert early.id not in store
+    assert store[early.id] is None
+    with pytest.raises(KeyError):
+        del store[early.id]
+    store.close()
+
+
+def test_sqlite_store_query():
+    store = SqliteMessageStore()
+    store.PAGE_SIZE = 2
+    for i in range(10):
+        store.add_rx_message(_event("even" if i % 2 == 0 else "odd", i, f"client_{i % 3}"))
+    store.add_rx_message(Ping(source="client_0", target="client_1"))
+    assert [m.body for m in store.query(topic="odd")] == ["1", "3", "5", "7", "9"]
+    assert [m.body for m in store.query(topic="odd", source="client_0")] == ["3", "9"]
+    assert [m.type for m in store.query(message_type=MessageType.PING)] == [MessageType.PING]
+    since = datetime.datetime(2025, 1, 1, 0, 0, 3, tzinfo=datetime.timezone.utc)
+    until = since + datetime.timedelta(seconds=3)
+    assert [m.body for m in store.query(since=since, until=until)] == ["3", "4", "5"]
+    assert len(list(store)) == 11
+    store.close()
+
+
+def test_sqlite_store_flush_under_writes_and_after_close(tmp_path):
+    """Reads wait for earlier writes only, and a closed store drops new ones."""
+    store = SqliteMessageStore(str(tmp_path / "messages.db"))
+    stop = threading.Event()
+
+    def write():
+        i = 0
+        while not stop.is_set():
+            store.add_rx_message(_event("flood", i))
+            i += 1
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        blob = _event("blobs", 0).model_copy(update={"payload": b"\x00\x01" * 100})
+        store.add_tx_message(blob)
+        for _ in range(5):
+            assert store[blob.id].payload == blob.payload
+    finally:
+        stop.set()
+        writer.join()
+    store.close()
+    store.add_rx_message(_event("late", 0))
+    store.flush()
+
+
+def test_sqlite_store_skips_bad_messages():
+    """A message that cannot be stored is skipped; the writer keeps going."""
+    store = SqliteMessageStore()
+    bad = _event("a", 0).model_copy(update={"payload": object()})
+    store.add_rx_message(bad)
+    store.add_rx_message(_event("a", 1))
+    assert [m.body for m in store] == ["1"]
+    # Naive timestamps are local time.
+    naive = _event("b", 0).model_copy(update={"timestamp": datetime.datetime.now()})
+    store.add_rx_message(naive)
+    assert [m.body for m in store.query(topic="b")] == ["0"]
+    store.close()
@@ -0,0 +1,38 @@
+import pytest
+
+from pyaduct.topics import TopicError, TopicTrie
+
+
+def test_topic_trie_wildcards():
+    trie = TopicTrie()
+    trie.subscribe("metrics.host_1.cpu", "exact")
+    trie.subscribe("metrics.*.cpu", "single")
+    trie.subscribe("metrics.#", "multi")
+    trie.subscribe("#", "everything")
+    assert trie.match("metrics.host_1.cpu") == {"exact", "single", "multi", "everything"}
+    assert trie.match("metrics.host_2.cpu") == {"single", "multi", "everything"}
+    assert trie.match("metrics.host_2.mem") == {"multi", "everything"}
+    assert trie.match("metrics") == {"multi", "everything"}
+    assert trie.match("logs.host_1") == {"everything"}
+    assert trie.match("metrics.host_1.cpu.core_0") == {"multi", "everything"}
+
+
+def test_topic_trie_set_semantics_and_unsubscribe():
+    trie = TopicTrie()
+    assert trie.subscribe("a.b", "client_1")
+    assert not trie.subscribe("a.b", "client_1")
+    assert trie.subscribe("a.*", "client_1")
+    assert trie.match("a.b") == {"client_1"}
+    assert len(trie) == 2
+    assert trie.unsubscribe("a.b", "client_1")
+    assert not trie.unsubscribe("a.b", "client_1")
+    assert trie.match("a.b") == {"client_1"}
+    trie.remove("client_1")
+    assert trie.match("a.b") == frozenset()
+    assert trie._root.children == {}
+
+
+@pytest.mark.parametrize("pattern", ["", "a..b", "a.#.b", "."])
+def test_topic_trie_rejects_malformed(pattern):
+    with pytest.raises(TopicError):
+        TopicTrie().subscribe(pattern, "client_1")
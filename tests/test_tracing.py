@@ -0,0 +1,57 @@
+import json
+import uuid
+from collections import Counter
+
+from zmq import DEALER, ROUTER
+
+from pyaduct import Broker, Client
+from pyaduct.tracing import ChromeTracer, Stage, breakdown, merge, sampled
+
+
+def test_request_trace(ctx, tmp_path):
+    """A request and its response make up one trace across every node."""
+    router = ctx.socket(ROUTER)
+    port = router.bind_to_random_port("tcp://127.0.0.1")
+    tracers = {name: ChromeTracer(tmp_path / f"{name}.json") for name in ("broker", "a", "b")}
+    broker = Broker(router, tracer=tracers["broker"])
+    broker.start()
+    clients = []
+    for name in ("a", "b"):
+        socket = ctx.socket(DEALER)
+        socket.connect(f"tcp://127.0.0.1:{port}")
+        clients.append(Client(socket, name=name, tracer=tracers[name]))
+        clients[-1].start()
+    requester, responder = clients
+    try:
+        future = requester.submit(requester.generate_request("b", "hello"))
+        responder.respond(responder.requests.get(timeout=2), "world")
+        request_id = future.result(timeout=2).request_id
+    finally:
+        for client in clients:
+            client.stop()
+        broker.stop()
+    for tracer in tracers.values():
+        tracer.close()
+
+    stamps = merge([tracer.path for tracer in tracers.values()], tmp_path / "merged.json")
+    trail = [stamp for _, stamp in stamps if stamp.trace == request_id]
+    # Once for the request and once for the response.
+    assert Counter(stamp.stage for stamp in trail) == {stage: 2 for stage in Stage}
+    assert {stamp.node for stamp in trail} == {"broker", "a", "b"}
+    first = min(trail, key=lambda stamp: stamp.time)
+    last = max(trail, key=lambda stamp: stamp.time)
+    assert (first.stage, first.node) == (Stage.CLIENT_ENQUEUE, "a")
+    assert (last.stage, last.node) == (Stage.HANDLED, "a")
+    spans = breakdown(stamps)
+    assert spans["client_tx > broker_rx"].count >= 2
+    events = json.loads((tmp_path / "merged.json").read_text())["traceEvents"]
+    assert any(event["ph"] == "b" and event["id"] == request_id.hex for event in events)
+
+
+def test_sampling():
+    ids = [uuid.uuid4() for _ in range(10_000)]
+    assert not any(sampled(trace, 0.0) for trace in ids)
+    assert all(sampled(trace, 1.0) for trace in ids)
+    assert 800 < sum(sampled(trace, 0.1) for trace in ids) < 1200
+    tracer = ChromeTracer("unused.json", sample=0.1)
+    assert [tracer.sampled(trace) for trace in ids] == [sampled(trace, 0.1) for trace in ids]
@@ -0,0 +1,46 @@
+from pyaduct import Event, Register, Request, Response
+from pyaduct.codec import BINARY_CODEC, JSON_CODEC
+from pyaduct.wire import Envelope, Header
+
+request = Request(source="client_1", target="client_2", body="hello", timeout=3)
+
+
+def test_header_roundtrip():
+    header = Header.from_message(request)
+    assert Header.decode(header.encode()) == header
+    assert header.route == "client_2"
+    assert header.deadline == request.timestamp.timestamp() + 3
+    response = Response(source="client_2", requestor="client_1", request_id=request.id, body="")
+    header = Header.decode(Header.from_message(response).encode())
+    assert header.route == "client_1"
+    assert header.ref == request.id
+    assert Header.decode(Header.from_message(Register(source="é")).encode()).source == "é"
+
+
+def test_envelope_passes_body_through():
+    event = Event(source="client_1", topic="test_topic", body="hello")
+    header, body = Header.from_message(event).encode(), BINARY_CODEC.encode(event)
+    envelope = Envelope.from_frames([header, body])
+    assert envelope.header.route == "test_topic"
+    assert envelope.frames(BINARY_CODEC, True)[1] is body
+    assert envelope._message is None
+    # Only a receiver with another codec forces a decode, and only once.
+    assert envelope.frames(JSON_CODEC, False) == [JSON_CODEC.encode(event)]
+    assert envelope.frames(JSON_CODEC, True)[1] is envelope.frames(JSON_CODEC, True)[1]
+    assert envelope.message == event
+
+
+def test_envelope_from_legacy_frame():
+    envelope = Envelope.from_frames([JSON_CODEC.encode(request)])
+    assert envelope.header == Header.from_message(request)
+    assert envelope.message == request
+
+
+def test_envelope_payload_frame():
+    event = Event(source="client_1", topic="blobs", body="", payload=b"\x00" * 1024)
+    assert BINARY_CODEC.decode(BINARY_CODEC.encode(event)).payload is None
+    header, body = Header.from_message(event).encode(), BINARY_CODEC.encode(event)
+    envelope = Envelope.from_frames([header, body, event.payload])
+    assert envelope.frames(BINARY_CODEC, True)[2] is event.payload
+    assert envelope.frames(JSON_CODEC, False) == [JSON_CODEC.encode(event)]
+    assert envelope.message.payload is event.payload